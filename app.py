@@ -2,6 +2,7 @@ import logging
 from flask import Flask
 from model import *
 from mongo import *
+from mongo.base import MongoBase
 
 
 def app():
@@ -26,6 +27,8 @@ def app():
     ]
     for api, prefix in api2prefix:
         app.register_blueprint(api, url_prefix=prefix)
+    # loaded documents are shared in a request only
+    app.teardown_request(MongoBase.clear_identity_map)
 
     if not User('first_admin'):
         ADMIN = {
@@ -0,0 +1,33 @@
+'''
+drain the judge queue and send submissions to sandboxes.
+run it as a standalone process beside the web server:
+
+    python judge_dispatcher.py
+
+it reads the same environment variables as the web server
+(MONGO_HOST, REDIS_HOST, REDIS_PORT, ...), and these optional ones:
+- JUDGE_QUEUE_MAX_ATTEMPTS: send attempts before an item is dead
+- JUDGE_QUEUE_BACKOFF_BASE: retry delay is BASE ** attempts seconds
+- JUDGE_QUEUE_BACKOFF_MAX: upper bound of the retry delay
+- REJUDGE_RATE: submissions of batch rejudge sent per second
+- SANDBOX_POLL_INTERVAL: seconds between polling sandboxes' status,
+  0 to rely on heartbeats pushed by sandboxes
+- SANDBOX_HEARTBEAT_TTL: seconds before a silent sandbox is ignored
+- SANDBOX_STATUS_TIMEOUT: read timeout of the status request
+- SANDBOX_STATUS_RETRIES: retries of the status request
+- SANDBOX_CONNECT_TIMEOUT: connect timeout of requests to sandboxes
+- SANDBOX_SUBMIT_TIMEOUT: read timeout of sending a submission
+- SANDBOX_POOL_SIZE: keep-alive connections per sandbox
+- SANDBOX_SCHEDULER: how to pick a sandbox, one of least-outstanding
+  (default), least-load, weighted-round-robin and consistent-hash
+'''
+
+import logging
+from mongo.judge_queue import Dispatcher
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+    )
+    Dispatcher(logger=logging.getLogger('judge-dispatcher')).run()
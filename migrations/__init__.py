@@ -0,0 +1,6 @@
+'''
+one-off scripts to migrate existing data, run them from the project
+root, e.g.
+
+    python -m migrations.pack_submission_output
+'''
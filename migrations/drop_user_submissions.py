@@ -0,0 +1,41 @@
+'''
+remove the legacy `submissions` and `problemSubmission` from user documents.
+
+the former held references to every submission of the user and was
+loaded with the user on each request, submissions are queried by user
+instead. the latter held today's submission counts, they are kept in
+redis now (see `Problem.submit_count_key`). it's safe to be re-run,
+stripped users won't be selected again.
+'''
+
+import logging
+import argparse
+from mongo import engine
+
+LEGACY_FIELDS = ('submissions', 'problemSubmission')
+LEGACY_QUERY = {'$or': [{k: {'$exists': True}} for k in LEGACY_FIELDS]}
+
+
+def migrate(dry_run: bool = False) -> int:
+    '''
+    Returns:
+        how many users have legacy fields
+    '''
+    collection = engine.User._get_collection()
+    if dry_run:
+        return collection.count_documents(LEGACY_QUERY)
+    result = collection.update_many(
+        LEGACY_QUERY,
+        {'$unset': {k: ''
+                    for k in LEGACY_FIELDS}},
+    )
+    logging.info(f'{result.modified_count} users stripped')
+    return result.modified_count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(f'{migrate(args.dry_run)} users have legacy fields')
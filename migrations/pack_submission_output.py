@@ -0,0 +1,91 @@
+'''
+convert per-case output zips of existing submissions into the packed
+format (see `mongo.submission.OutputPacker`).
+
+it's safe to be interrupted and re-run, converted submissions won't be
+selected again.
+'''
+
+import logging
+import argparse
+from zipfile import ZipFile, BadZipFile
+from mongo import engine
+from mongo.submission import Submission, OutputPacker
+
+# submissions which still have per-case output files
+LEGACY_QUERY = {'tasks.cases.output': {'$type': 'objectId'}}
+
+
+def migrate_one(submission: Submission) -> int:
+    '''
+    Returns:
+        how many legacy files are removed
+    '''
+    # a pack left by an interrupted run isn't referred by any case
+    if submission.output_pack.grid_id is not None:
+        submission.output_pack.delete()
+    # they are written before, so don't truncate them
+    packer = OutputPacker(submission.output_pack,
+                          Submission.INLINE_OUTPUT_SIZE)
+    legacy = []
+    for task in submission.tasks:
+        for case in task.cases:
+            if case.output is None:
+                continue
+            if case.output.grid_id is not None:
+                legacy.append(case.output.grid_id)
+                try:
+                    with ZipFile(case.output) as zf:
+                        output = {k: zf.read(k) for k in ('stdout', 'stderr')}
+                except (BadZipFile, KeyError) as e:
+                    logging.warning(f'drop broken output of {submission}: {e}')
+                    output = None
+                if output is not None:
+                    for k, v in packer.add(**output).items():
+                        setattr(case, k, v)
+            case.output = None
+    if packer.size:
+        submission.output_pack.close()
+    # cases and the pack they refer to are set at once, `update` can't
+    # serialize a file field
+    submission.update(
+        __raw__={
+            '$set': {
+                'tasks': [task.to_mongo() for task in submission.tasks],
+                'outputPack': submission.output_pack.grid_id,
+            },
+        })
+    Submission.delete_grid_files(legacy)
+    return len(legacy)
+
+
+def migrate(batch_size: int = 100, limit: int = 0) -> int:
+    '''
+    Returns:
+        how many submissions are migrated
+    '''
+    cnt = 0
+    while limit <= 0 or cnt < limit:
+        size = batch_size if limit <= 0 else min(batch_size, limit - cnt)
+        docs = [*engine.Submission.objects(__raw__=LEGACY_QUERY).limit(size)]
+        if not docs:
+            break
+        for doc in docs:
+            migrate_one(Submission(doc))
+        cnt += len(docs)
+        logging.info(f'{cnt} submissions migrated')
+    return cnt
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=0,
+        help='stop after migrating this many submissions, 0 for no limit',
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(f'{migrate(args.batch_size, args.limit)} submissions migrated')
@@ -0,0 +1,102 @@
+'''
+move `studentStatus` of existing homeworks into the `homework_status`
+collection (see `mongo.engine.HomeworkStatus`).
+
+status untouched students are not copied, they are filled with default
+value when read. rows created by new submissions are kept as they are.
+it's safe to be interrupted and re-run, converted homeworks won't be
+selected again.
+'''
+
+import logging
+import argparse
+from pymongo import UpdateOne
+from mongo import engine
+
+LEGACY_QUERY = {'studentStatus': {'$exists': True}}
+
+
+def is_touched(stat) -> bool:
+    return bool(
+        stat.get('submissionIds') or stat.get('score')
+        or stat.get('problemStatus') is not None
+        or stat.get('rawScore') is not None)
+
+
+def migrate_one(homework) -> int:
+    '''
+    Args:
+        homework: raw homework document
+
+    Returns:
+        how many status are copied
+    '''
+    requests = []
+    for username, problems in (homework['studentStatus'] or {}).items():
+        for pid, stat in problems.items():
+            if not is_touched(stat):
+                continue
+            fields = {
+                'score': stat.get('score', 0),
+                'problemStatus': stat.get('problemStatus'),
+                'submissionIds': stat.get('submissionIds', []),
+            }
+            if stat.get('rawScore') is not None:
+                fields['rawScore'] = stat['rawScore']
+            requests.append(
+                UpdateOne(
+                    {
+                        'homework': homework['_id'],
+                        'user': username,
+                        'problemId': int(pid),
+                    },
+                    {'$setOnInsert': fields},
+                    upsert=True,
+                ))
+    if requests:
+        engine.HomeworkStatus._get_collection().bulk_write(
+            requests,
+            ordered=False,
+        )
+    engine.Homework._get_collection().update_one(
+        {'_id': homework['_id']},
+        {'$unset': {
+            'studentStatus': ''
+        }},
+    )
+    return len(requests)
+
+
+def migrate(batch_size: int = 20) -> int:
+    '''
+    Returns:
+        how many homeworks are migrated
+    '''
+    # create indexes before bulk upserts
+    engine.HomeworkStatus.ensure_indexes()
+    collection = engine.Homework._get_collection()
+    cnt = 0
+    while True:
+        docs = [
+            *collection.find(
+                LEGACY_QUERY,
+                {
+                    'studentStatus': 1
+                },
+            ).limit(batch_size)
+        ]
+        if not docs:
+            break
+        for doc in docs:
+            migrate_one(doc)
+        cnt += len(docs)
+        logging.info(f'{cnt} homeworks migrated')
+    return cnt
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--batch-size', type=int, default=20)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(f'{migrate(args.batch_size)} homeworks migrated')
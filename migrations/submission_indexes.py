@@ -0,0 +1,43 @@
+'''
+sync indexes of the `submission` collection with `engine.Submission`.
+
+mongoengine only creates indexes declared in `meta`, the ones removed
+from there are kept in the database and still slow down writes. this
+drops them and creates the missing ones.
+'''
+
+import logging
+import argparse
+from mongo import engine
+
+
+def migrate(dry_run: bool = False):
+    '''
+    Returns:
+        (dropped index names, created index keys)
+    '''
+    diff = engine.Submission.compare_indexes()
+    collection = engine.Submission._get_collection()
+    dropped = []
+    for name, info in collection.index_information().items():
+        if name == '_id_':
+            continue
+        if info['key'] in diff['extra']:
+            dropped.append(name)
+            logging.info(f'drop index {name}')
+            if not dry_run:
+                collection.drop_index(name)
+    for key in diff['missing']:
+        logging.info(f'create index {key}')
+    if not dry_run:
+        engine.Submission.ensure_indexes()
+    return dropped, diff['missing']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    dropped, created = migrate(args.dry_run)
+    print(f'{len(dropped)} indexes dropped, {len(created)} created')
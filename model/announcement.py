@@ -3,6 +3,7 @@ from flask import Blueprint, request
 
 from mongo import *
 from mongo.utils import *
+from mongo.loader import ref_id, UserInfo
 from .auth import *
 from .utils import *
 from .course import *
@@ -12,21 +13,31 @@ __all__ = ['ann_api']
 ann_api = Blueprint('ann_api', __name__)
 
 
-@ann_api.route('/', methods=['GET'])
-@ann_api.route('/<ann_id>', methods=['GET'])
-def get_sys_ann(ann_id=None):
-    public_name = Course.get_public().course_name
-    anns = Announcement.ann_list(None, public_name)
-    data = [{
+def ann_dicts(anns, ann_id=None):
+    '''
+    serialize announcements, only the one has `ann_id` if it's given
+    '''
+    anns = [an for an in anns if ann_id == None or str(an.id) == ann_id]
+    infos = UserInfo.get_many(
+        ref_id(an, k) for an in anns for k in ('creator', 'updater'))
+    return [{
         'annId': str(an.id),
         'title': an.title,
         'createTime': int(an.create_time.timestamp()),
         'updateTime': int(an.update_time.timestamp()),
-        'creator': an.creator.info,
-        'updater': an.updater.info,
+        'creator': infos[ref_id(an, 'creator')],
+        'updater': infos[ref_id(an, 'updater')],
         'markdown': an.markdown,
         'pinned': an.pinned
-    } for an in anns if ann_id == None or str(an.id) == ann_id]
+    } for an in anns]
+
+
+@ann_api.route('/', methods=['GET'])
+@ann_api.route('/<ann_id>', methods=['GET'])
+def get_sys_ann(ann_id=None):
+    public_name = Course.get_public().course_name
+    anns = Announcement.ann_list(None, public_name)
+    data = ann_dicts(anns, ann_id)
     return HTTPResponse('Sys Ann bro', data=data)
 
 
@@ -43,16 +54,7 @@ def anncmnt(user, course_name=None, ann_id=None):
             return HTTPError('Cannot Access a Announcement', 403)
         if anns is None:
             return HTTPError('Announcement Not Found', 404)
-        data = [{
-            'annId': str(an.id),
-            'title': an.title,
-            'createTime': int(an.create_time.timestamp()),
-            'updateTime': int(an.update_time.timestamp()),
-            'creator': an.creator.info,
-            'updater': an.updater.info,
-            'markdown': an.markdown,
-            'pinned': an.pinned
-        } for an in anns if ann_id == None or str(an.id) == ann_id]
+        data = ann_dicts(anns, ann_id)
         return HTTPResponse('Announcement List', data=data)
 
     @Request.json('title', 'markdown', 'course_name', 'pinned')
@@ -42,15 +42,15 @@ def login_required(func):
     def wrapper(token, *args, **kwargs):
         if token is None:
             return HTTPError('Not Logged In', 403)
-        json = jwt_decode(token)
-        if json is None or not json.get('secret'):
+        session = User.session(token)
+        if session is None:
             return HTTPError('Invalid Token', 403)
-        user = User(json['data']['username'])
-        if json['data'].get('userId') != user.user_id:
+        if session['token_user_id'] != session['user_id']:
             return HTTPError(f'Authorization Expired', 403)
-        if not user.active:
+        if not session['active']:
             return HTTPError('Inactive User', 403)
-        kwargs['user'] = user
+        # the document is loaded if the handler needs more than these
+        kwargs['user'] = User.from_session(session)
         return func(*args, **kwargs)
 
     return wrapper
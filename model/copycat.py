@@ -5,6 +5,7 @@ from mongo.utils import *
 from .utils import *
 from .auth import *
 
+import os
 import mosspy
 import threading
 import logging
@@ -14,6 +15,8 @@ import re
 __all__ = ['copycat_api']
 
 copycat_api = Blueprint('copycat_api', __name__)
+# seconds to wait for moss
+REPORT_TIMEOUT = float(os.getenv('MOSS_REPORT_TIMEOUT', '10'))
 
 
 def is_valid_url(url):
@@ -118,11 +121,13 @@ def get_report_task(user, problem_id, student_dict: Dict):
 
 def get_report_by_url(url: str):
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=REPORT_TIMEOUT)
         return response.text
     except (requests.exceptions.MissingSchema,
             requests.exceptions.InvalidSchema):
         return 'No report.'
+    except requests.exceptions.RequestException:
+        return 'Fail to fetch report.'
 
 
 @copycat_api.route('/', methods=['GET'])
@@ -5,6 +5,8 @@ from .auth import *
 from .utils import *
 from mongo.utils import *
 from mongo.course import *
+from mongo.scoreboard import Scoreboard
+from mongo.loader import ref_id, ref_ids, UserInfo
 from mongo import engine
 from datetime import datetime
 
@@ -42,10 +44,12 @@ def get_courses(user):
         return HTTPResponse('Success.')
 
     if request.method == 'GET':
+        courses = Course.get_user_courses(user)
+        infos = UserInfo.get_many(ref_id(c, 'teacher') for c in courses)
         data = [{
             'course': c.course_name,
-            'teacher': c.teacher.info,
-        } for c in Course.get_user_courses(user)]
+            'teacher': infos[ref_id(c, 'teacher')],
+        } for c in courses]
         return HTTPResponse('Success.', data=data)
     else:
         return modify_courses()
@@ -87,13 +91,16 @@ def get_course(user, course_name):
         return HTTPResponse('Success.')
 
     if request.method == 'GET':
+        teacher = ref_id(course.obj, 'teacher')
+        tas = ref_ids(course.obj, 'tas')
+        students = [*course.student_nicknames]
+        infos = UserInfo.get_many([teacher, *tas, *students])
         return HTTPResponse(
             'Success.',
             data={
-                "teacher": course.teacher.info,
-                "TAs": [ta.info for ta in course.tas],
-                "students":
-                [User(name).info for name in course.student_nicknames]
+                "teacher": infos[teacher],
+                "TAs": [infos[ta] for ta in tas],
+                "students": [infos[name] for name in students],
             },
         )
     else:
@@ -185,9 +192,14 @@ def grading(user, course_name, student):
 
 @course_api.route('/<course_name>/scoreboard', methods=['GET'])
 @login_required
-@Request.args('pids: str', 'start', 'end')
+@Request.args('pids: str', 'start', 'end', 'version')
 @Request.doc('course_name', 'course', Course)
-def get_course_scoreboard(user, pids, start, end, course):
+def get_course_scoreboard(user, pids, start, end, version, course):
+    '''
+    get scoreboard of selected problems, the version of the snapshot is
+    returned in `X-Scoreboard-Version` header, pass it as `version` to
+    read the same snapshot again.
+    '''
     try:
         pids = pids.split(',')
         pids = [int(pid.strip()) for pid in pids]
@@ -205,13 +217,24 @@ def get_course_scoreboard(user, pids, start, end, course):
         except:
             return HTTPError('Type of `end` should be float.', 400)
 
+    if version is not None:
+        try:
+            version = int(version)
+        except ValueError:
+            return HTTPError('Type of `version` should be int.', 400)
+
     permission = perm(course, user)
     if permission < 2:
         return HTTPError('Permission denied', 403)
 
-    ret = course.get_scoreboard(pids, start, end)
+    try:
+        version, ret = Scoreboard(course).get(pids, start, end, version)
+    except DoesNotExist as e:
+        return HTTPError(str(e), 404)
 
-    return HTTPResponse(
+    resp, status_code = HTTPResponse(
         'Success.',
         data=ret,
     )
+    resp.headers['X-Scoreboard-Version'] = version
+    return resp, status_code
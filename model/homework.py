@@ -1,7 +1,9 @@
-from typing import List
+from typing import List, Optional
 from flask import Blueprint, request
 from mongo import *
 from mongo import engine
+from mongo.judge_queue import JudgeQueue
+from mongo.utils import perm
 from .utils import *
 from .auth import login_required
 from .course import course_api
@@ -11,6 +13,32 @@ __all__ = ['homework_api']
 homework_api = Blueprint('homework_api', __name__)
 
 
+def parse_page(offset, count):
+    offset = int(offset or 0)
+    count = None if count is None else int(count)
+    if offset < 0 or (count is not None and count < 0):
+        raise ValueError('offset and count should not be negative')
+    return offset, count
+
+
+def student_status(
+    user,
+    homework: Homework,
+    students: List[str],
+    offset: int = 0,
+    count: Optional[int] = None,
+):
+    '''
+    get a page of students' status, normal user can only view their own
+    '''
+    if user.role >= 2:
+        if user.username not in students:
+            return None
+        return homework.get_student_status([user.username])[user.username]
+    end = None if count is None else offset + count
+    return homework.get_student_status(students[offset:end])
+
+
 @homework_api.route('/', methods=['POST'])
 @homework_api.route('/<homework_id>', methods=['PUT', 'DELETE', 'GET'])
 @login_required
@@ -32,7 +60,7 @@ def homework_entry(user, homework_id=None):
                 problem_ids=problem_ids or [],
                 start=start,
                 end=end,
-                penalty=penalty, 
+                penalty=penalty,
             )
         except NameError:
             return HTTPError('user must be the teacher or ta of this course',
@@ -44,7 +72,7 @@ def homework_entry(user, homework_id=None):
     @Request.json('name', 'markdown', 'start', 'end', 'problem_ids',
                   'scoreboard_status', 'penalty')
     def update_homework(name, markdown, start, end, problem_ids,
-                        scoreboard_status,penalty):
+                        scoreboard_status, penalty):
         homework = Homework.update(
             user=user,
             homework_id=homework_id,
@@ -64,8 +92,13 @@ def homework_entry(user, homework_id=None):
                                             course=homework.course_id)
         return HTTPResponse('Delete homework Success')
 
-    def get_homework():
-        homework = Homework.get_by_id(homework_id)
+    @Request.args('offset', 'count')
+    def get_homework(offset, count):
+        try:
+            page = parse_page(offset, count)
+        except ValueError as e:
+            return HTTPError(str(e), 400)
+        homework = Homework(Homework.get_by_id(homework_id))
         ret = {
             'name':
             homework.homework_name,
@@ -78,8 +111,7 @@ def homework_entry(user, homework_id=None):
             'markdown':
             homework.markdown,
             'studentStatus':
-            homework.student_status
-            if user.role < 2 else homework.student_status.get(user.username),
+            student_status(user, homework, homework.students(), *page),
             'penalty':
             homework.penalty,
         }
@@ -100,16 +132,54 @@ def homework_entry(user, homework_id=None):
         return HTTPError(str(e), 403)
 
 
+@homework_api.route('/<homework_id>/rejudge', methods=['GET', 'POST'])
+@login_required
+def rejudge_homework(user, homework_id):
+    '''
+    rejudge submissions of problems in this homework during its duration
+    '''
+    try:
+        homework = Homework.get_by_id(homework_id)
+    except engine.DoesNotExist as e:
+        return HTTPError(str(e), 404)
+    except ValidationError:
+        return HTTPError('homework not exist', 404)
+    course = engine.Course.objects.get(id=homework.course_id)
+    if perm(course, user) < 2:
+        return HTTPError('user is not teacher or ta', 403)
+    job = f'homework-{homework.id}'
+    if request.method == 'POST':
+        # problems can be shared by courses, only rejudge this course's
+        Submission.rejudge_many(
+            job,
+            problem__in=homework.problem_ids,
+            user__in=list(course.student_nicknames),
+            timestamp__gte=homework.duration.start,
+            timestamp__lte=homework.duration.end,
+        )
+    progress = JudgeQueue().progress(job)
+    if progress is None:
+        return HTTPError('Homework has not been rejudged.', 404)
+    return HTTPResponse('Success.', data=progress)
+
+
 @course_api.route('/<course_name>/homework', methods=['GET'])
 @login_required
-def get_homework_list(user, course_name):
+@Request.args('offset', 'count')
+def get_homework_list(user, course_name, offset, count):
     '''
-    get a list of homework
+    get a list of homework, `offset` and `count` select students whose
+    status are returned
     '''
+    try:
+        page = parse_page(offset, count)
+    except ValueError as e:
+        return HTTPError(str(e), 400)
     try:
         homeworks = Homework.get_homeworks(course_name=course_name)
+        students = sorted(Course(course_name).student_nicknames)
         data = []
-        for homework in homeworks:
+        for homework in map(Homework, homeworks):
             new = {
                 'name': homework.homework_name,
                 'start': int(homework.duration.start.timestamp()),
@@ -118,14 +188,12 @@ def get_homework_list(user, course_name):
                 'markdown': homework.markdown,
                 'id': str(homework.id)
             }
-            # normal user can not view other's status
-            if user.role < 2:
-                new.update({'studentStatus': homework.student_status})
-            else:
-                new.update({
-                    'studentStatus':
-                    homework.student_status.get(user.username)
-                })
+            new['studentStatus'] = student_status(
+                user,
+                homework,
+                students,
+                *page,
+            )
             data.append(new)
     except FileNotFoundError:
         return HTTPError('course not exists',
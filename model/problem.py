@@ -7,6 +7,7 @@ from zipfile import BadZipFile
 from mongo import *
 from mongo import engine
 from mongo import sandbox
+from mongo.judge_queue import JudgeQueue
 from .auth import *
 from .utils import *
 from mongo.utils import can_view_problem
@@ -64,6 +65,7 @@ def view_problem_list(
         data = Problem.get_problem_list(**ks)
     except IndexError:
         return HTTPError('invalid offset', 400)
+    submit_counts = Problem.submit_counts(user)
     data = [{
         'problemId': p.problem_id,
         'problemName': p.problem_name,
@@ -73,7 +75,7 @@ def view_problem_list(
         'tags': p.tags,
         'type': p.problem_type,
         'quota': p.quota,
-        'submitCount': Problem(p.problem_id).submit_count(user)
+        'submitCount': submit_counts.get(str(p.problem_id), 0),
     } for p in data]
     return HTTPResponse('Success.', data=data)
 
@@ -350,13 +352,29 @@ def problem_stats(user: User, problem: Problem):
         'count': 10,
         'problem': problem.id,
         'status': 0,
+        'fields': Submission.LIST_FIELDS,
     }
-    top_10_runtime_submissions = [
-        s.to_dict() for s in Submission.filter(**params, sort_by='runTime')
-    ]
+    top_10_runtime_submissions = Submission.to_dicts(
+        Submission.filter(**params, sort_by='runTime'))
     ret['top10RunTime'] = top_10_runtime_submissions
-    top_10_memory_submissions = [
-        s.to_dict() for s in Submission.filter(**params, sort_by='memoryUsage')
-    ]
+    top_10_memory_submissions = Submission.to_dicts(
+        Submission.filter(**params, sort_by='memoryUsage'))
     ret['top10MemoryUsage'] = top_10_memory_submissions
     return HTTPResponse('Success.', data=ret)
+
+
+@problem_api.route('/<int:problem_id>/rejudge', methods=['GET', 'POST'])
+@login_required
+@Request.doc('problem_id', 'problem', Problem)
+def rejudge_problem(user: User, problem: Problem):
+    if not problem.is_manager(user):
+        return HTTPError('Not enough permission.', 403)
+    job = f'problem-{problem.problem_id}'
+    if request.method == 'POST':
+        if problem.test_case.case_zip is None:
+            return HTTPError('Test case not found.', 400)
+        Submission.rejudge_many(job, problem=problem.id)
+    progress = JudgeQueue().progress(job)
+    if progress is None:
+        return HTTPError('Problem has not been rejudged.', 404)
+    return HTTPResponse('Success.', data=progress)
@@ -43,7 +43,7 @@ def edit_profile(user, displayed_name, bio):
         if bio is not None:
             profile['bio'] = bio
 
-        user.obj.update(profile=profile)
+        user.update(profile=profile)
     except:
         return HTTPError('Upload fail.', 400)
 
@@ -64,7 +64,7 @@ def edit_config(user, font_size, theme, indent_type, tab_size, language):
             'language': language
         }
 
-        user.obj.update(editor_config=config)
+        user.update(editor_config=config)
     except ValidationError as ve:
         return HTTPError('Update fail.', 400, data=ve.to_dict())
 
@@ -1,22 +1,36 @@
+import os
 from flask import Blueprint, request
 
 from mongo import *
 from .auth import *
 from .utils import *
-from mongo import engine
+from mongo.ranking import Ranking
 
 __all__ = ['ranking_api']
 
 ranking_api = Blueprint('ranking_api', __name__)
+# upper bound of users in a page
+RANKING_MAX_COUNT = int(os.getenv('RANKING_MAX_COUNT', '100'))
 
 
 @ranking_api.route('/', methods=['GET'])
-def get_ranking():
-    data = list({
-        "user": user.info,
-        "ACProblem": len(user.AC_problem_ids),
-        "ACSubmission": user.AC_submission,
-        "Submission": user.submission
-    } for user in engine.User.objects())
+@Request.args('offset', 'count')
+def get_ranking(offset, count):
+    '''
+    get a page of the ranking, `count` is at most `RANKING_MAX_COUNT`
+    '''
+    try:
+        offset = int(offset or 0)
+        count = int(count or RANKING_MAX_COUNT)
+    except ValueError:
+        return HTTPError('offset and count should be integers', 400)
+    if offset < 0 or count <= 0:
+        return HTTPError('offset should >= 0 and count should > 0', 400)
+    count = min(count, RANKING_MAX_COUNT)
+    return HTTPResponse('Success.', data=Ranking().page(offset, count))
 
-    return HTTPResponse('Success.', data=data)
+
+@ranking_api.route('/me', methods=['GET'])
+@login_required
+def get_my_ranking(user):
+    return HTTPResponse('Success.', data=Ranking().rank_of(user))
@@ -1,9 +1,11 @@
 import io
+import os
 from typing import Optional
 import requests as rq
 import random
 import secrets
 import json
+import hashlib
 from flask import (
     Blueprint,
     send_file,
@@ -14,6 +16,9 @@ from datetime import datetime, timedelta
 from functools import wraps
 from mongo import *
 from mongo import engine
+from mongo import sandbox
+from mongo.sandbox import SandboxClient, SandboxRegistry
+from mongo.scoreboard import Scoreboard
 from mongo.utils import (
     can_view_problem,
     RedisCache,
@@ -25,6 +30,8 @@ from .auth import *
 
 __all__ = ['submission_api']
 submission_api = Blueprint('submission_api', __name__)
+# submission lists are invalidated by versions, this only bounds the size
+SUBMISSION_LIST_TTL = int(os.getenv('SUBMISSION_LIST_TTL', '3600'))
 
 
 def submission_required(func):
@@ -105,14 +112,18 @@ def create_submission(user, language_type, problem_id):
                 'got': language_type
             },
         )
+    # teachers and TAs of its courses aren't limited
+    quota = problem.obj.quota
+    if quota != -1:
+        role = max(
+            (perm(course, user) for course in problem.obj.courses),
+            default=0,
+        )
+        if role >= 2:
+            quota = -1
     # check if the user has used all his quota
-    if problem.obj.quota != -1 and max(
-            perm(course, user)
-            for course in problem.obj.courses) < 2 and problem.submit_count(
-                user) >= problem.obj.quota:
+    if not problem.take_quota(user, quota):
         return HTTPError('you have used all your quotas', 403)
-    user.problem_submission[str(problem_id)] = problem.submit_count(user) + 1
-    user.save()
     # insert submission to DB
     try:
         submission = Submission.add(
@@ -122,16 +133,16 @@ def create_submission(user, language_type, problem_id):
             timestamp=now,
         )
     except ValidationError:
+        problem.release_quota(user)
         return HTTPError('invalid data!', 400)
     except engine.DoesNotExist as e:
+        problem.release_quota(user)
         return HTTPError(str(e), 404)
     except TestCaseNotFound as e:
+        problem.release_quota(user)
         return HTTPError(str(e), 403)
     # update user
-    user.update(
-        last_submit=now,
-        push__submissions=submission.obj,
-    )
+    user.update(last_submit=now)
     # update problem
     submission.problem.update(inc__submitter=1)
     return HTTPResponse(
@@ -155,6 +166,8 @@ def create_submission(user, language_type, problem_id):
     'course',
     'before',
     'after',
+    'cursor',
+    'with_count',
 )
 def get_submission_list(
     user,
@@ -167,9 +180,16 @@ def get_submission_list(
     before,
     after,
     language_type,
+    cursor,
+    with_count,
 ):
     '''
     get the list of submission data
+
+    pass `nextCursor` of the response as `cursor` to get the next page
+    without skipping, and `withCount=false` to skip counting. pages are
+    cached until a submission they might contain changes, send `ETag` of
+    the response as `If-None-Match` to get 304 if the page is unchanged
     '''
     def parse_int(val: Optional[int], name: str):
         if val is None:
@@ -179,8 +199,34 @@ def get_submission_list(
         except ValueError:
             raise ValueError(f'can not convert {name} to integer')
 
+    # students can only get their own submissions
+    if user.role == User.engine.Role.STUDENT:
+        username = user.username
+    # convert args, they're normalized before being part of the cache key
+    try:
+        offset = parse_int(offset, 'offset')
+        count = parse_int(count, 'count')
+        problem_id = parse_int(problem_id, 'problemId')
+        status = parse_int(status, 'status')
+        before = parse_int(before, 'before')
+        after = parse_int(after, 'after')
+    except ValueError as e:
+        return HTTPError(str(e), 400)
+    if before is not None:
+        before = datetime.fromtimestamp(before)
+    if after is not None:
+        after = datetime.fromtimestamp(after)
+    if language_type is not None:
+        try:
+            language_type = list(map(int, language_type.split(',')))
+        except ValueError as e:
+            return HTTPError(
+                'cannot parse integers from languageType',
+                400,
+            )
     cache_key = (
         'SUBMISSION_LIST_API',
+        Submission.list_version(user, problem_id, username, course),
         user,
         problem_id,
         username,
@@ -191,37 +237,18 @@ def get_submission_list(
         count,
         before,
         after,
+        cursor,
+        with_count,
     )
     cache_key = '_'.join(map(str, cache_key))
     cache = RedisCache()
     # check cache
-    if cache.exists(cache_key):
-        submissions = json.loads(cache.get(cache_key))
+    if (cached := cache.get(cache_key)) is not None:
+        submissions = json.loads(cached)
         submission_count = submissions['submission_count']
+        next_cursor = submissions['next_cursor']
         submissions = submissions['submissions']
     else:
-        # convert args
-        offset = parse_int(offset, 'offset')
-        count = parse_int(count, 'count')
-        problem_id = parse_int(problem_id, 'problemId')
-        status = parse_int(status, 'status')
-        before = parse_int(before, 'before')
-        if before is not None:
-            before = datetime.fromtimestamp(before)
-        after = parse_int(after, 'after')
-        if after is not None:
-            after = datetime.fromtimestamp(after)
-        if language_type is not None:
-            try:
-                language_type = list(map(int, language_type.split(',')))
-            except ValueError as e:
-                return HTTPError(
-                    'cannot parse integers from languageType',
-                    400,
-                )
-        # students can only get their own submissions
-        if user.role == User.engine.Role.STUDENT:
-            username = user.username
         try:
             params = drop_none({
                 'user': user,
@@ -234,18 +261,32 @@ def get_submission_list(
                 'course': course,
                 'before': before,
                 'after': after,
+                'cursor': cursor,
             })
-            submissions, submission_count = Submission.filter(
-                **params,
-                with_count=True,
-            )
-            submissions = [s.to_dict() for s in submissions]
-            cache.set(
-                cache_key,
-                json.dumps({
-                    'submissions': submissions,
-                    'submission_count': submission_count,
-                }), 15)
+            params['fields'] = Submission.LIST_FIELDS
+            submission_count = None
+            if with_count == 'false':
+                submissions = Submission.filter(**params)
+            else:
+                submissions, submission_count = Submission.filter(
+                    **params,
+                    with_count=True,
+                )
+            # there might be more submissions after a full page
+            next_cursor = None
+            if count is not None and count > 0 and len(submissions) == count:
+                last = submissions[-1]
+                next_cursor = Submission.encode_cursor(
+                    last['timestamp'],
+                    last['_id'],
+                )
+            submissions = Submission.to_dicts(submissions)
+            cached = json.dumps({
+                'submissions': submissions,
+                'submission_count': submission_count,
+                'next_cursor': next_cursor,
+            })
+            cache.set(cache_key, cached, SUBMISSION_LIST_TTL)
         except ValueError as e:
             return HTTPError(str(e), 400)
     # unicorn gifs
@@ -259,11 +300,19 @@ def get_submission_list(
         'unicorn': random.choice(unicorns),
         'submissions': submissions,
         'submissionCount': submission_count,
+        'nextCursor': next_cursor,
     }
-    return HTTPResponse(
+    resp, _ = HTTPResponse(
         'here you are, bro',
         data=ret,
     )
+    if isinstance(cached, str):
+        cached = cached.encode()
+    resp.set_etag(hashlib.sha1(cached).hexdigest())
+    # the page might be changed anytime, always revalidate
+    resp.cache_control.no_cache = True
+    resp.cache_control.private = True
+    return resp.make_conditional(request)
 
 
 @submission_api.route('/<submission_id>', methods=['GET'])
@@ -384,20 +433,52 @@ def get_submission_count(user, problem_id, submission_id, username, status,
 
 
 @submission_api.route('/<submission_id>/complete', methods=['PUT'])
-@Request.json('tasks: list', 'token: str')
 @submission_required
-def on_submission_complete(submission, tasks, token):
-    if not Submission.verify_token(submission.id, token):
-        return HTTPError('i don\'t know you', 403)
-    try:
-        submission.process_result(tasks)
-    except (ValidationError, KeyError) as e:
-        return HTTPError(
-            'invalid data!\n'
-            f'{type(e).__name__}: {e}',
-            400,
-        )
-    return HTTPResponse(f'{submission} result recieved.')
+def on_submission_complete(submission):
+    '''
+    receive result from sandbox, it can be sent as
+    - json: {'token': str, 'tasks': [[case, ...], ...]}
+    - multipart: the `token` field, the `meta` field contains `tasks`
+      json without outputs, and each case's outputs are uploaded as
+      files named `stdout-{task}-{case}` and `stderr-{task}-{case}`.
+      large outputs should be sent in this way, they are streamed into
+      storage instead of loaded into memory.
+    '''
+    @Request.json('tasks: list', 'token: str')
+    def by_json(tasks, token):
+        return complete(tasks, token)
+
+    @Request.form('meta: str', 'token: str')
+    def by_multipart(meta, token):
+        try:
+            tasks = json.loads(meta)
+        except (TypeError, ValueError) as e:
+            return HTTPError(f'invalid meta: {e}', 400)
+        if not isinstance(tasks, list):
+            return HTTPError('meta should be a list', 400)
+        for i, cases in enumerate(tasks):
+            for j, case in enumerate(cases):
+                for fd in ('stdout', 'stderr'):
+                    case[fd] = request.files.get(f'{fd}-{i}-{j}', b'')
+        return complete(tasks, token)
+
+    def complete(tasks, token):
+        if not Submission.verify_token(submission.id, token):
+            return HTTPError('i don\'t know you', 403)
+        SandboxRegistry().release(submission.id)
+        try:
+            submission.process_result(tasks)
+        except (ValidationError, KeyError, TypeError) as e:
+            return HTTPError(
+                'invalid data!\n'
+                f'{type(e).__name__}: {e}',
+                400,
+            )
+        return HTTPResponse(f'{submission} result recieved.')
+
+    if (request.content_type or '').startswith('multipart/form-data'):
+        return by_multipart()
+    return by_json()
 
 
 @submission_api.route('/<submission_id>', methods=['PUT'])
@@ -461,8 +542,11 @@ def grade_submission(user, submission, score):
     if score < 0 or score > 100:
         return HTTPError('score must be between 0 to 100.', 400)
 
+    # graded before, drop its old score
+    if submission.status != -1:
+        Scoreboard.invalidate([submission.problem_id])
     # AC if the score is 100, WA otherwise
-    submission.update(score=score, status=(0 if score == 100 else 1))
+    submission.modify(score=score, status=(0 if score == 100 else 1))
     submission.finish_judging()
     return HTTPResponse(f'{submission} score recieved.')
 
@@ -543,22 +627,30 @@ def config(user):
             )
         # skip if during testing
         if not current_app.config['TESTING']:
-            resps = []
+            errs = []
             # check sandbox status
             for sb in sandbox_instances:
-                resp = rq.get(f'{sb.url}/status')
+                try:
+                    resp = SandboxClient.status(sb)
+                except rq.RequestException as e:
+                    errs.append({
+                        'name': sb.name,
+                        'statusCode': None,
+                        'response': str(e),
+                    })
+                    continue
                 if not resp.ok:
-                    resps.append((sb.name, resp))
+                    errs.append({
+                        'name': sb.name,
+                        'statusCode': resp.status_code,
+                        'response': resp.text,
+                    })
             # some exception occurred
-            if len(resps) != 0:
+            if len(errs) != 0:
                 return HTTPError(
                     'some error occurred when check sandbox status',
                     400,
-                    data=[{
-                        'name': name,
-                        'statusCode': resp.status_code,
-                        'response': resp.text,
-                    } for name, resp in resps],
+                    data=errs,
                 )
         try:
             config.update(
@@ -567,8 +659,24 @@ def config(user):
             )
         except ValidationError as e:
             return HTTPError(str(e), 400)
+        SandboxRegistry().retain(sb.name for sb in sandbox_instances)
 
         return HTTPResponse('success.')
 
     methods = {'GET': get_config, 'PUT': modify_config}
     return methods[request.method]()
+
+
+@submission_api.route('/sandbox/heartbeat', methods=['PUT'])
+@Request.json('token: str', 'load')
+def sandbox_heartbeat(token, load):
+    '''
+    sandboxes report their load here periodically
+    '''
+    sb = sandbox.find_by_token(token or '')
+    if sb is None:
+        return HTTPError('Invalid sandbox token', 401)
+    if not isinstance(load, (int, float)):
+        return HTTPError('load must be a number', 400)
+    SandboxRegistry().report(sb.name, load)
+    return HTTPResponse('ok')
@@ -1,7 +1,8 @@
-from flask import current_app
+from flask import current_app, g, has_request_context
 from . import engine
 from mongoengine.errors import *
 import logging
+from typing import Dict, Optional
 
 __all__ = ['MongoBase']
 
@@ -16,17 +17,72 @@ class MongoBase:
     def __new__(cls, pk, *args, **kwargs):
         if isinstance(pk, cls):
             return pk
+        if (new := cls._recall(pk)) is not None:
+            return new
         new = super().__new__(cls)
         # got a engine instance
         if isinstance(pk, new.engine):
             new.obj = pk
+            # instances are `_created` until they are saved
+            new._exists = not pk._created
         else:
             try:
                 new.obj = new.engine.objects(pk=pk).get()
+                new._exists = True
             except engine.DoesNotExist:
                 new.obj = new.engine(id=pk)
+                new._exists = False
+        new._exists = new._exists and new._match()
+        # engine instances might be partially loaded, don't share them
+        if new._exists and not isinstance(pk, new.engine):
+            new._remember(pk)
         return new
 
+    @staticmethod
+    def identity_map() -> Optional[Dict]:
+        '''
+        wrappers loaded in current request, keyed by (class, pk), `None`
+        if it's outside a request
+        '''
+        if not has_request_context():
+            return None
+        if 'identity_map' not in g:
+            g.identity_map = {}
+        return g.identity_map
+
+    @staticmethod
+    def clear_identity_map(*args):
+        if has_request_context():
+            g.pop('identity_map', None)
+
+    @classmethod
+    def _recall(cls, key) -> Optional['MongoBase']:
+        if (identity_map := cls.identity_map()) is None:
+            return None
+        return identity_map.get((cls, str(key)))
+
+    def _remember(self, key):
+        if (identity_map := self.identity_map()) is not None:
+            identity_map[(self.__class__, str(key))] = self
+
+    def forget(self):
+        '''
+        drop this wrapper from the identity map, the next lookup will load
+        the document again
+        '''
+        if (identity_map := self.identity_map()) is None:
+            return
+        for key in [k for k, v in identity_map.items() if v is self]:
+            del identity_map[key]
+
+    def _match(self) -> bool:
+        '''
+        check loaded document against `qs_filter`, only equality filters
+        can be checked without querying
+        '''
+        return all(
+            getattr(self.obj, k) == v for k, v in self.qs_filter.items())
+
     def __getattr__(self, name):
         return self.obj.__getattribute__(name)
 
@@ -40,10 +96,22 @@ class MongoBase:
         return self and other is not None and self.pk == other.pk
 
     def __bool__(self):
-        try:
-            return self._qs.filter(pk=self.pk, **self.qs_filter).__bool__()
-        except ValidationError:
-            return False
+        return self._exists
+
+    def exists(self, refresh: bool = False) -> bool:
+        '''
+        whether the document exists, the result of loading it is used
+        unless `refresh` is set, which queries the db again
+        '''
+        if refresh:
+            try:
+                self._exists = self._qs.filter(
+                    pk=self.pk,
+                    **self.qs_filter,
+                ).__bool__()
+            except ValidationError:
+                self._exists = False
+        return self._exists
 
     def __str__(self):
         return f'{self.__class__.__name__.lower()} [{self.pk}]'
@@ -52,13 +120,34 @@ class MongoBase:
         return self.obj.to_json() if self else '{}'
 
     def reload(self, *fields):
-        if self:
+        # it might be created after this wrapper
+        try:
             self.obj.reload(*fields)
+            self._exists = self._match()
+        except (engine.DoesNotExist, ValidationError):
+            self._exists = False
         return self
 
+    def update(self, *args, **ks):
+        # the loaded document isn't changed by update
+        ret = self.obj.update(*args, **ks)
+        self.forget()
+        return ret
+
+    def save(self, *args, **ks):
+        ret = self.obj.save(*args, **ks)
+        self._exists = True
+        self.forget()
+        return ret
+
+    def delete(self, *args, **ks):
+        self.obj.delete(*args, **ks)
+        self._exists = False
+        self.forget()
+
     @property
     def logger(self):
         try:
             return current_app.logger
         except RuntimeError:
-            return logging.getLogger('gunicorn.error')
\ No newline at end of file
+            return logging.getLogger('gunicorn.error')
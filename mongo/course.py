@@ -4,7 +4,7 @@ from .utils import *
 import re
 from typing import Dict, List, Optional
 from .base import MongoBase
-from datetime import datetime
+from .scoreboard import Scoreboard
 
 __all__ = [
     'Course',
@@ -19,6 +19,7 @@ class Course(MongoBase, engine=engine.Course):
             try:
                 pk = Course.engine.objects(course_name=course_name).get()
                 new = super().__new__(cls, pk)
+                new._remember(course_name)
             except engine.DoesNotExist:
                 new = super().__new__(cls, '0' * 24)
         return new
@@ -38,12 +39,12 @@ class Course(MongoBase, engine=engine.Course):
             self.add_user(User(user).obj)
         self.student_nicknames = student_nicknames
         # TODO: use event to update homework data
+        # new students' status is created when they submit
         drop_user = [*map(User, drop_user)]
-        new_user = [*map(User, new_user)]
         for homework in map(Homework, self.homeworks):
             homework.remove_student(drop_user)
-            homework.add_student(new_user)
         self.save()
+        Scoreboard.bump([self.id])
 
     def add_user(self, user: User):
         if not self:
@@ -104,82 +105,7 @@ class Course(MongoBase, engine=engine.Course):
         start: Optional[float] = None,
         end: Optional[float] = None,
     ) -> List[Dict]:
-        scoreboard = []
-        usernames = [User(u).id for u in self.student_nicknames.keys()]
-        matching = {
-            "user": {
-                "$in": usernames
-            },
-            "problem": {
-                "$in": problem_ids
-            },
-            "timestamp": {},
-        }
-        if start:
-            matching['timestamp']['$gte'] = datetime.fromtimestamp(start)
-        if end:
-            matching['timestamp']['$lte'] = datetime.fromtimestamp(end)
-        if not matching["timestamp"]:
-            del matching["timestamp"]
-        pipeline = [
-            {
-                "$match": matching
-            },
-            {
-                "$group": {
-                    "_id": {
-                        "user": "$user",
-                        "problem": "$problem",
-                    },
-                    "count": {
-                        "$sum": 1
-                    },
-                    "max": {
-                        "$max": "$score"
-                    },
-                    "min": {
-                        "$min": "$score"
-                    },
-                    "avg": {
-                        "$avg": "$score"
-                    },
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$_id.user",
-                    "scores": {
-                        "$push": {
-                            "pid": "$_id.problem",
-                            "count": "$count",
-                            "max": "$max",
-                            "min": "$min",
-                            "avg": "$avg",
-                        },
-                    },
-                }
-            },
-        ]
-        cursor = engine.Submission.objects().aggregate(pipeline)
-        unrecorded_users = set(usernames)
-        for item in cursor:
-            sum_of_score = sum(s['max'] for s in item['scores'])
-            scoreboard.append({
-                'user': User(item['_id']).info,
-                'sum': sum_of_score,
-                'avg': sum_of_score / len(problem_ids),
-                **{f'{score["pid"]}': score
-                   for score in item['scores']},
-            })
-            unrecorded_users.remove(item['_id'])
-        for u in unrecorded_users:
-            scoreboard.append({
-                'user': User(u).info,
-                'sum': 0,
-                'avg': 0,
-            })
-
-        return scoreboard
+        return Scoreboard(self).get(problem_ids, start, end)[1]
 
     @classmethod
     def add_course(cls, course, teacher):
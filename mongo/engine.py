@@ -6,8 +6,19 @@ import html
 from enum import Enum, IntEnum
 from datetime import datetime
 from zipfile import ZipFile, BadZipFile
-from .utils import perm, can_view_problem, RedisCache
-from typing import Union
+from .utils import (
+    can_view_problem,
+    course_roles,
+    invalidate_course_roles,
+    invalidate_problem_access,
+    invalidate_sessions,
+    invalidate_user_infos,
+    RedisCache,
+    COURSE_ROLES_VERSION_KEY,
+    PROBLEM_VERSION_KEY,
+)
+from .loader import ref_id, ref_ids
+from typing import Dict, Set, Union
 import json
 
 __all__ = [*mongoengine.__all__]
@@ -121,7 +132,31 @@ class Duration(EmbeddedDocument):
         return self.start <= other <= self.end
 
 
+@handler(signals.post_save)
+def invalidate_user_cache(sender, document, **kwargs):
+    invalidate_sessions(document.pk)
+    invalidate_user_infos(document.pk)
+
+
+@handler(signals.post_delete)
+def invalidate_deleted_user_cache(sender, document, **kwargs):
+    # ranking depends on this module
+    from .ranking import Ranking
+    invalidate_sessions(document.pk)
+    invalidate_user_infos(document.pk)
+    Ranking.remove(document.pk)
+
+
+@invalidate_user_cache.apply
+@invalidate_deleted_user_cache.apply
 class User(Document):
+    meta = {
+        # `submissions` and `problemSubmission` are dropped, query
+        # `Submission` by user instead, see
+        # migrations/drop_user_submissions.py
+        'strict': False,
+    }
+
     class Role(IntEnum):
         ADMIN = 0
         TEACHER = 1
@@ -143,12 +178,10 @@ class User(Document):
     )
     contest = ReferenceField('Contest', db_field='contestId')
     courses = ListField(ReferenceField('Course'))
-    submissions = ListField(ReferenceField('Submission'))
     last_submit = DateTimeField(default=datetime.min)
     AC_problem_ids = ListField(IntField(), default=list)
     AC_submission = IntField(default=0)
     submission = IntField(default=0)
-    problem_submission = DictField(db_field='problemSubmission')
 
     @property
     def info(self):
@@ -162,6 +195,11 @@ class User(Document):
 
 @escape_markdown.apply
 class Homework(Document):
+    meta = {
+        # `studentStatus` moved to `HomeworkStatus`, see
+        # migrations/split_homework_status.py
+        'strict': False,
+    }
     homework_name = StringField(
         max_length=64,
         required=True,
@@ -177,8 +215,60 @@ class Homework(Document):
     course_id = StringField(required=True, db_field='courseId')
     duration = EmbeddedDocumentField(Duration, default=Duration)
     problem_ids = ListField(IntField(), db_field='problemIds')
-    student_status = DictField(db_field='studentStatus')
     ip_filters = ListField(StringField(max_length=64), default=list)
+    # python statements to adjust `score` of late submissions by `overtime` days
+    penalty = StringField(max_length=10000, null=True)
+
+
+class HomeworkStatus(Document):
+    '''
+    a student's status of a problem in a homework, only exists after the
+    student submitted it
+    '''
+    meta = {
+        'indexes': [
+            {
+                'fields': ['homework', 'user', 'problem_id'],
+                'unique': True,
+            },
+            # all status of a student
+            ('user', 'homework'),
+        ]
+    }
+    homework = ReferenceField(
+        Homework,
+        required=True,
+        reverse_delete_rule=CASCADE,
+    )
+    user = ReferenceField(User, required=True)
+    problem_id = IntField(required=True, db_field='problemId')
+    score = IntField(default=0)
+    # score before penalty
+    raw_score = IntField(default=None, null=True, db_field='rawScore')
+    problem_status = IntField(
+        default=None,
+        null=True,
+        db_field='problemStatus',
+    )
+    submission_ids = ListField(StringField(), db_field='submissionIds')
+
+
+class ScoreboardCell(Document):
+    '''
+    statistics of a user's submissions to a problem, see mongo/scoreboard.py
+    '''
+    meta = {
+        'indexes': [{
+            'fields': ['problem_id', 'user'],
+            'unique': True,
+        }]
+    }
+    problem_id = IntField(required=True, db_field='problemId')
+    user = ReferenceField(User, required=True)
+    count = IntField(default=0)
+    sum = IntField(default=0)
+    max = IntField(default=0)
+    min = IntField(default=0)
 
 
 class Contest(Document):
@@ -193,6 +283,48 @@ class Contest(Document):
     participants = DictField(db_field='participants')
 
 
+def course_members(doc: Dict) -> Set[str]:
+    '''
+    usernames of teacher, TAs and students in a raw course document
+    '''
+    return {
+        *filter(None, [doc.get('teacher')]),
+        *doc.get('tas', []),
+        *doc.get('studentNicknames', {}),
+    }
+
+
+@handler(signals.pre_save)
+def collect_course_members(sender, document, **kwargs):
+    # members before saving are also affected, they may be removed
+    members = ('teacher', 'tas', 'studentNicknames')
+    changed = {f.split('.')[0] for f in document._get_changed_fields()}
+    if document._created or changed & {*members}:
+        old = sender._get_collection().find_one(
+            {'_id': document.pk},
+            {k: 1
+             for k in members},
+        ) if document.pk else None
+        document._members = course_members(old or {}) | course_members(
+            document.to_mongo())
+    else:
+        document._members = set()
+
+
+@handler(signals.post_save)
+def invalidate_course_members(sender, document, **kwargs):
+    invalidate_course_roles(*getattr(document, '_members', ()))
+    document._members = set()
+
+
+@handler(signals.post_delete)
+def invalidate_deleted_course_members(sender, document, **kwargs):
+    invalidate_course_roles(*course_members(document.to_mongo()))
+
+
+@collect_course_members.apply
+@invalidate_course_members.apply
+@invalidate_deleted_course_members.apply
 class Course(Document):
     course_name = StringField(
         max_length=64,
@@ -276,7 +408,13 @@ def problem_desc_escape(sender, document):
     document.description.escape()
 
 
+@handler(signals.post_save)
+def invalidate_problem(sender, document, **kwargs):
+    invalidate_problem_access(document.pk)
+
+
 @problem_desc_escape.apply
+@invalidate_problem.apply
 class Problem(Document):
     problem_id = SequenceField(
         db_field='problemId',
@@ -350,11 +488,16 @@ class CaseResult(EmbeddedDocument):
     status = IntField(required=True)
     exec_time = IntField(required=True, db_field='execTime')
     memory_usage = IntField(required=True, db_field='memoryUsage')
-    output = ZipField(
-        required=True,
-        null=True,
-        max_size=11**9,
-    )
+    # legacy format, a zip contains stdout/stderr for each case
+    output = ZipField(max_size=11**9)
+    # small output is stored inline
+    stdout = StringField()
+    stderr = StringField()
+    # otherwise, it's placed at `Submission.output_pack[offset:]`,
+    # stdout first and then stderr
+    output_offset = IntField(db_field='outputOffset')
+    stdout_size = IntField(db_field='stdoutSize')
+    stderr_size = IntField(db_field='stderrSize')
 
 
 class TaskResult(EmbeddedDocument):
@@ -367,16 +510,22 @@ class TaskResult(EmbeddedDocument):
 
 class Submission(Document):
     meta = {
+        # see tests/test_submission_indexes.py for queries they serve,
+        # run migrations/submission_indexes.py after changing them
         'indexes': [
-            (
-                'id',
-                'user',
-                'score',
-                'status',
-                'problem',
-                'language',
-                'timestamp',
-            ),
+            # submission list sorted by time, see `Submission.filter`,
+            # filters on status and language are applied on index scans
+            ('-timestamp', '-id'),
+            ('user', '-timestamp', '-id'),
+            # by problem (batch rejudge, time-windowed scoreboard, tried
+            # users), by problem and user (handwritten cleanup)
+            ('problem', '-timestamp', '-id'),
+            ('problem', 'user', '-timestamp', '-id'),
+            # status count, AC users and problem stats sorted by them
+            ('problem', 'status', 'exec_time'),
+            ('problem', 'status', 'memory_usage'),
+            # high score
+            ('user', 'problem', '-score'),
         ]
     }
     problem = ReferenceField(Problem, required=True)
@@ -396,6 +545,14 @@ class Submission(Document):
     code = ZipField(required=True, null=True, max_size=10**7)
     last_send = DateTimeField(db_field='lastSend', default=datetime.now)
     comment = FileField(default=None, null=True)
+    # packed stdout/stderr of all cases
+    output_pack = FileField(db_field='outputPack', default=None, null=True)
+
+    # cached permissions are invalidated by versions in their keys
+    PERMISSION_KEY = (
+        'SUBMISSION_PERMISSION_{submission}_{user}_{user_version}'
+        '_{problem}_{problem_version}')
+    PERMISSION_TTL = int(os.getenv('SUBMISSION_PERMISSION_TTL', '86400'))
 
     def permission(self, user):
         '''
@@ -403,24 +560,47 @@ class Submission(Document):
         2: can view upload & comment, 
         1: can view basic info, 
         0: can't view
+
+        The answer is cached, the user's version is bumped when the
+        courses they joined change, and the problem's version is bumped
+        when who can view it changes.
         '''
-        key = f'SUBMISSION_PERMISSION_{self.id}_{user.id}_{self.problem.id}'
-        # Check cache
-        cache = RedisCache()
-        if (v := cache.get(key)) is not None:
-            return int(v)
-        # Calculate
+        client = RedisCache().client
+        problem_id = ref_id(self, 'problem')
+        user_version, problem_version = client.mget(
+            COURSE_ROLES_VERSION_KEY.format(user=user.username),
+            PROBLEM_VERSION_KEY.format(problem=problem_id),
+        )
+        key = self.PERMISSION_KEY.format(
+            submission=self.id,
+            user=user.username,
+            # role and contest of the user also decide permissions
+            user_version='{}_{}_{}'.format(
+                int(user_version or 0),
+                user.role,
+                ref_id(user, 'contest'),
+            ),
+            problem=problem_id,
+            problem_version=int(problem_version or 0),
+        )
+        if (cached := client.get(key)) is None:
+            cached = self._permission(user)
+            client.set(key, cached, ex=self.PERMISSION_TTL)
+        return int(cached)
+
+    def _permission(self, user) -> int:
         if not can_view_problem(user, self.problem):
-            ret = 0
-        else:
-            ret = 3 - [
-                max(perm(course, user)
-                    for course in self.problem.courses) >= 2,
-                user.username == self.user.username,
-                True,
-            ].index(True)
-        cache.set(key, ret, 60)
-        return ret
+            return 0
+        roles = course_roles(user)
+        courses = map(str, ref_ids(self.problem, 'courses'))
+        return 3 - [
+            user.role == 0 or max(
+                (roles.get(c, 0) for c in courses),
+                default=0,
+            ) >= 2,
+            user.username == ref_id(self, 'user'),
+            True,
+        ].index(True)
 
 
 @escape_markdown.apply
@@ -481,6 +661,8 @@ class Sandbox(EmbeddedDocument):
     name = StringField(required=True)
     url = StringField(required=True)
     token = StringField(required=True)
+    # how many submissions it can judge concurrently
+    capacity = IntField(default=1, min_value=1)
 
 
 class SubmissionConfig(Config):
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from . import engine
 from .user import User
 from .base import MongoBase
@@ -103,16 +103,8 @@ class Homework(MongoBase, engine=engine.Homework):
         if end:
             homework.duration.end = datetime.fromtimestamp(end)
         homework.save()
-        # init student status
-        user_problems = {}
         for problem in problems:
-            problem_id = str(problem.problem_id)
-            user_problems[problem_id] = cls.default_problem_status()
             problem.update(push__homeworks=homework)
-        homework.update(student_status={
-            s: user_problems
-            for s in course.student_nicknames
-        })
         # add homework to course
         course.update(push__homeworks=homework.id)
         return homework
@@ -165,26 +157,25 @@ class Homework(MongoBase, engine=engine.Homework):
         homework.save()
         drop_ids = set(homework.problem_ids) - set(problem_ids)
         new_ids = set(problem_ids) - set(homework.problem_ids)
-        student_status = homework.student_status
         # add
         for pid in new_ids:
-            problem = Problem(pid).obj
-            if problem is None:
+            problem = Problem(pid)
+            if not problem:
                 continue
             homework.update(push__problem_ids=pid)
             problem.update(push__homeworks=homework)
-            for key in course.student_nicknames:
-                student_status[key][str(pid)] = cls.default_problem_status()
         # delete
         for pid in drop_ids:
-            problem = Problem(pid).obj
-            if problem is None:
+            problem = Problem(pid)
+            if not problem:
                 continue
             homework.update(pull__problem_ids=pid)
             problem.update(pull__homeworks=homework)
-            for status in student_status.values():
-                del status[str(pid)]
-        homework.update(student_status=student_status)
+        if drop_ids:
+            engine.HomeworkStatus.objects(
+                homework=homework,
+                problem_id__in=[*drop_ids],
+            ).delete()
         return homework
 
     # delete problems/paticipants in hw
@@ -198,8 +189,8 @@ class Homework(MongoBase, engine=engine.Homework):
         if perm(course, user) <= 1:
             raise PermissionError('user is not teacher or ta')
         for pid in self.problem_ids:
-            problem = Problem(pid).obj
-            if problem is None:
+            problem = Problem(pid)
+            if not problem:
                 continue
             problem.update(pull__homeworks=self.obj)
         self.delete()
@@ -239,20 +230,49 @@ class Homework(MongoBase, engine=engine.Homework):
             'submissionIds': [],
         }
 
-    def add_student(self, students: List[User]):
-        if any(u.username in self.student_status for u in students):
-            raise ValueError('Student already in homework')
-        user_status = {
-            str(pid): self.default_problem_status()
-            for pid in self.problem_ids
+    def students(self) -> List[str]:
+        '''
+        usernames of students in this homework, sorted
+        '''
+        course = engine.Course.objects.only('student_nicknames').get(
+            id=self.course_id)
+        return sorted(course.student_nicknames)
+
+    def get_student_status(
+        self,
+        usernames: List[str],
+    ) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        '''
+        get status of these students, the result is like
+        {username: {problem id: status}}
+        '''
+        ret = {
+            username: {
+                str(pid): self.default_problem_status()
+                for pid in self.problem_ids
+            }
+            for username in usernames
         }
-        for student in students:
-            self.student_status[student.username] = user_status
-        self.save()
+        rows = engine.HomeworkStatus.objects(
+            homework=self.id,
+            user__in=usernames,
+        ).as_pymongo()
+        for row in rows:
+            stat = ret[row['user']].get(str(row['problemId']))
+            # problem has been removed
+            if stat is None:
+                continue
+            stat.update(
+                score=row.get('score', 0),
+                problemStatus=row.get('problemStatus'),
+                submissionIds=row.get('submissionIds', []),
+            )
+            if row.get('rawScore') is not None:
+                stat['rawScore'] = row['rawScore']
+        return ret
 
     def remove_student(self, students: List[User]):
-        if any(u.username not in self.student_status for u in students):
-            raise ValueError('Student not in homework')
-        for student in students:
-            del self.student_status[student.username]
-        self.save()
+        engine.HomeworkStatus.objects(
+            homework=self.id,
+            user__in=[s.username for s in students],
+        ).delete()
@@ -1,6 +1,7 @@
 from . import engine
 from .user import *
 from .base import *
+from .loader import load, ref_id, UserInfo
 
 __all__ = ['Inbox']
 
@@ -23,25 +24,36 @@ class Inbox(MongoBase, engine=engine.Inbox):
 
     @classmethod
     def messages(cls, username):
-        messages = sorted(cls.engine.objects(receiver=username, status__ne=2),
-                          key=lambda x: x.message.timestamp,
-                          reverse=True)
+        inboxes = cls.engine.objects(receiver=username, status__ne=2)
+        inboxes = [(i, ref_id(i, 'message')) for i in inboxes]
+        messages = load(engine.Message, (m for _, m in inboxes))
+        senders = UserInfo.get_many(m.sender for m in messages.values())
+        inboxes = sorted(
+            ((i, messages[m]) for i, m in inboxes if m in messages),
+            key=lambda x: x[1].timestamp,
+            reverse=True,
+        )
         return [{
-            'messageId': str(m.id),
-            'status': m.status,
-            'sender': User(m.message.sender).info,
-            'title': m.message.title,
-            'message': m.message.markdown,
-            'timestamp': int(m.message.timestamp.timestamp())
-        } for m in messages]
+            'messageId': str(i.id),
+            'status': i.status,
+            'sender': senders[m.sender],
+            'title': m.title,
+            'message': m.markdown,
+            'timestamp': int(m.timestamp.timestamp())
+        } for i, m in inboxes]
 
     @classmethod
     def sents(cls, username):
-        sents = engine.Message.objects(sender=username,
-                                       status=0).order_by('-timestamp')
+        sents = [
+            *engine.Message.objects(
+                sender=username,
+                status=0,
+            ).order_by('-timestamp')
+        ]
+        receivers = UserInfo.get_many(r for s in sents for r in s.receivers)
         return [{
             'messageId': str(s.id),
-            'receivers': [User(r).info for r in s.receivers],
+            'receivers': [receivers[r] for r in s.receivers],
             'title': s.title,
             'message': s.markdown,
             'timestamp': int(s.timestamp.timestamp())
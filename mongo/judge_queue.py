@@ -0,0 +1,359 @@
+'''
+A durable queue between the web workers and the sandboxes.
+
+`Submission.submit` and `Submission.rejudge` only push the submission
+into this queue and return, a separate dispatcher process (see
+`judge_dispatcher.py`) drains it and send submissions to sandboxes.
+'''
+import os
+import json
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+import requests as rq
+
+from .utils import RedisCache
+from .sandbox import SandboxRegistry
+
+__all__ = [
+    'JudgeQueue',
+    'Dispatcher',
+]
+
+
+class JudgeQueue:
+    '''
+    reliable queue built on redis lists
+
+    - waiting items are kept in `QUEUE_KEY`
+    - popped items are moved to `PROCESSING_KEY` until they are acked,
+      so they can be recovered if the dispatcher crashed
+    - failed items wait in `DELAYED_KEY` (a sorted set scored by the
+      time they should be retried)
+    - items which reach `MAX_ATTEMPTS` are moved to `DEAD_KEY`
+    - batch rejudges are kept in `BULK_KEY`, the dispatcher only takes
+      them at a limited rate so they won't starve new submissions, even
+      if they're retried
+    '''
+    QUEUE_KEY = 'JUDGE_QUEUE'
+    PROCESSING_KEY = 'JUDGE_QUEUE_PROCESSING'
+    DELAYED_KEY = 'JUDGE_QUEUE_DELAYED'
+    DEAD_KEY = 'JUDGE_QUEUE_DEAD'
+    BULK_KEY = 'JUDGE_QUEUE_BULK'
+    # submission id -> the batch job it belongs to
+    JOB_KEY = 'JUDGE_QUEUE_JOB'
+    PROGRESS_KEY = 'JUDGE_QUEUE_PROGRESS_{job}'
+    MAX_ATTEMPTS = int(os.getenv('JUDGE_QUEUE_MAX_ATTEMPTS', '8'))
+    BACKOFF_BASE = float(os.getenv('JUDGE_QUEUE_BACKOFF_BASE', '2'))
+    BACKOFF_MAX = float(os.getenv('JUDGE_QUEUE_BACKOFF_MAX', '300'))
+
+    def __init__(self):
+        self.client = RedisCache().client
+
+    @staticmethod
+    def encode(submission_id: str, attempts: int = 0) -> str:
+        return json.dumps({
+            'submissionId': str(submission_id),
+            'attempts': attempts,
+        })
+
+    @staticmethod
+    def decode(raw) -> Dict[str, Any]:
+        if isinstance(raw, bytes):
+            raw = raw.decode()
+        return json.loads(raw)
+
+    def __len__(self):
+        return self.client.llen(self.QUEUE_KEY)
+
+    def push(self, submission_id: str):
+        self.client.lpush(self.QUEUE_KEY, self.encode(submission_id))
+
+    def push_bulk(self, job: str, submission_ids: List[str]):
+        '''
+        push submissions of a batch job into the low priority list,
+        the progress of the previous run of this job will be reset
+        '''
+        submission_ids = [*map(str, submission_ids)]
+        progress_key = self.PROGRESS_KEY.format(job=job)
+        pipe = self.client.pipeline()
+        pipe.delete(progress_key)
+        pipe.hset(
+            progress_key,
+            mapping={
+                'total': len(submission_ids),
+                'dispatched': 0,
+                'finished': 0,
+                'failed': 0,
+                'createdAt': time.time(),
+            },
+        )
+        if submission_ids:
+            pipe.hset(
+                self.JOB_KEY,
+                mapping={_id: job
+                         for _id in submission_ids},
+            )
+            pipe.lpush(self.BULK_KEY, *map(self.encode, submission_ids))
+        pipe.execute()
+
+    def bulk_size(self) -> int:
+        return self.client.llen(self.BULK_KEY)
+
+    def pop_bulk(self) -> Optional[bytes]:
+        return self.client.rpoplpush(self.BULK_KEY, self.PROCESSING_KEY)
+
+    def _job(self, submission_id: str) -> Optional[str]:
+        job = self.client.hget(self.JOB_KEY, str(submission_id))
+        return job and job.decode()
+
+    def mark_dispatched(self, submission_id: str):
+        job = self._job(submission_id)
+        if job is not None:
+            self.client.hincrby(
+                self.PROGRESS_KEY.format(job=job),
+                'dispatched',
+            )
+
+    def mark_finished(self, submission_id: str):
+        self._mark_done(submission_id, 'finished')
+
+    def mark_failed(self, submission_id: str):
+        '''
+        the submission is moved to dead letters, it won't be finished
+        '''
+        self._mark_done(submission_id, 'failed')
+
+    def _mark_done(self, submission_id: str, field: str):
+        job = self._job(submission_id)
+        # only the one who remove it can count it
+        if job is not None and self.client.hdel(
+                self.JOB_KEY,
+                str(submission_id),
+        ):
+            self.client.hincrby(self.PROGRESS_KEY.format(job=job), field)
+
+    def progress(self, job: str) -> Optional[Dict[str, Any]]:
+        '''
+        get progress of a batch job, None if it hasn't been run
+        '''
+        progress = self.client.hgetall(self.PROGRESS_KEY.format(job=job))
+        if not progress:
+            return None
+        ret = {k.decode(): float(v) for k, v in progress.items()}
+        for k in ('total', 'dispatched', 'finished', 'failed'):
+            ret[k] = int(ret.get(k, 0))
+        return ret
+
+    def pop(self, timeout: int = 0) -> Optional[bytes]:
+        '''
+        move the oldest item into processing list and return it,
+        block at most `timeout` seconds if `timeout` > 0
+        '''
+        if timeout > 0:
+            return self.client.brpoplpush(
+                self.QUEUE_KEY,
+                self.PROCESSING_KEY,
+                timeout,
+            )
+        return self.client.rpoplpush(self.QUEUE_KEY, self.PROCESSING_KEY)
+
+    def ack(self, raw):
+        '''
+        the item is handled, remove it from processing list
+        '''
+        self.client.lrem(self.PROCESSING_KEY, 1, raw)
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.BACKOFF_BASE**attempts, self.BACKOFF_MAX)
+
+    def retry(self, raw, reason: str = ''):
+        '''
+        schedule a failed item, or move it to dead letters if it
+        has been tried too many times
+        '''
+        item = self.decode(raw)
+        attempts = item['attempts'] + 1
+        pipe = self.client.pipeline()
+        pipe.lrem(self.PROCESSING_KEY, 1, raw)
+        if attempts >= self.MAX_ATTEMPTS:
+            self._dead(pipe, item, reason)
+        else:
+            due = time.time() + self.backoff(attempts)
+            pipe.zadd(
+                self.DELAYED_KEY,
+                {self.encode(item['submissionId'], attempts): due},
+            )
+        pipe.execute()
+        if attempts >= self.MAX_ATTEMPTS:
+            self.mark_failed(item['submissionId'])
+
+    def dead(self, raw, reason: str = ''):
+        item = self.decode(raw)
+        pipe = self.client.pipeline()
+        pipe.lrem(self.PROCESSING_KEY, 1, raw)
+        self._dead(pipe, item, reason)
+        pipe.execute()
+        self.mark_failed(item['submissionId'])
+
+    def _dead(self, pipe, item: Dict[str, Any], reason: str):
+        pipe.lpush(
+            self.DEAD_KEY,
+            json.dumps({
+                **item,
+                'reason': reason,
+                'time': time.time(),
+            }),
+        )
+
+    def promote(self, now: Optional[float] = None) -> int:
+        '''
+        move due items from delayed set back to queue, items of batch
+        jobs go back to the bulk list
+
+        Returns:
+            how many items are moved
+        '''
+        if now is None:
+            now = time.time()
+        raws = self.client.zrangebyscore(self.DELAYED_KEY, '-inf', now)
+        if not raws:
+            return 0
+        jobs = self.client.hmget(
+            self.JOB_KEY,
+            [self.decode(raw)['submissionId'] for raw in raws],
+        )
+        cnt = 0
+        for raw, job in zip(raws, jobs):
+            # only the one who remove it can push it back
+            if self.client.zrem(self.DELAYED_KEY, raw):
+                key = self.QUEUE_KEY if job is None else self.BULK_KEY
+                self.client.lpush(key, raw)
+                cnt += 1
+        return cnt
+
+    def recover(self) -> int:
+        '''
+        push items left in processing list back to queue, should be
+        called before the dispatcher start consuming
+        '''
+        cnt = 0
+        while self.client.rpoplpush(self.PROCESSING_KEY, self.QUEUE_KEY):
+            cnt += 1
+        return cnt
+
+    def dead_letters(self) -> List[Dict[str, Any]]:
+        return [
+            self.decode(raw)
+            for raw in self.client.lrange(self.DEAD_KEY, 0, -1)
+        ]
+
+
+class Dispatcher:
+    '''
+    consume `JudgeQueue` and send submissions to sandboxes
+    '''
+    POLL_INTERVAL = float(os.getenv('SANDBOX_POLL_INTERVAL', '5'))
+    # submissions of batch rejudge sent per second
+    REJUDGE_RATE = float(os.getenv('REJUDGE_RATE', '2'))
+
+    def __init__(self, queue: Optional[JudgeQueue] = None, logger=None):
+        self.queue = queue or JudgeQueue()
+        self.logger = logger or logging.getLogger('gunicorn.error')
+        self.next_bulk = 0
+
+    def pop(self, timeout: int = 0):
+        '''
+        pop from the normal queue first, then the bulk one if the
+        rate allows
+        '''
+        raw = self.queue.pop()
+        if raw is not None:
+            return raw
+        now = time.time()
+        if self.queue.bulk_size():
+            if now >= self.next_bulk:
+                raw = self.queue.pop_bulk()
+                if raw is not None:
+                    self.next_bulk = now + 1 / self.REJUDGE_RATE
+                    return raw
+            # don't block longer than the next bulk item is allowed
+            wait = self.next_bulk - now
+            # `BRPOPLPUSH` only accepts integer timeout
+            if timeout > 0 and wait < 1:
+                time.sleep(max(wait, 0))
+                return self.queue.pop()
+            timeout = min(timeout, int(wait))
+        return self.queue.pop(timeout)
+
+    def dispatch_one(self, timeout: int = 0) -> bool:
+        '''
+        try to send one submission
+
+        Returns:
+            whether an item is consumed from queue
+        '''
+        from .submission import (
+            Submission,
+            JudgeQueueFullError,
+            TestCaseNotFound,
+        )
+        self.queue.promote()
+        raw = self.pop(timeout)
+        if raw is None:
+            return False
+        submission_id = self.queue.decode(raw)['submissionId']
+        try:
+            submission = Submission(submission_id)
+            if not submission:
+                self.logger.warning(f'{submission} not found, drop it')
+                self.queue.ack(raw)
+                return True
+            success = submission.send()
+        # these won't be fixed by retrying
+        except (TestCaseNotFound, ValueError) as e:
+            self.logger.error(f'can not send {submission_id}: {e}')
+            self.queue.dead(raw, f'{type(e).__name__}: {e}')
+            return True
+        except (JudgeQueueFullError, rq.RequestException) as e:
+            self.logger.warning(f'fail to send {submission_id}: {e!r}')
+            self.queue.retry(raw, f'{type(e).__name__}: {e}')
+            return True
+        # anything else shouldn't stop the loop or strand the item in
+        # processing, it's dead after `MAX_ATTEMPTS` retries
+        except Exception as e:
+            self.logger.exception(f'error while sending {submission_id}')
+            self.queue.retry(raw, f'{type(e).__name__}: {e}')
+            return True
+        if success:
+            self.queue.ack(raw)
+            self.queue.mark_dispatched(submission.id)
+        else:
+            self.queue.retry(raw, 'sandbox unavailable')
+        return True
+
+    def poll_sandboxes(self):
+        from .submission import Submission
+        sandboxes = Submission.config().sandbox_instances
+        registry = SandboxRegistry(logger=self.logger)
+        registry.retain(sb.name for sb in sandboxes)
+        registry.poll(sandboxes)
+
+    def run(self, timeout: int = 1):
+        recovered = self.queue.recover()
+        if recovered:
+            self.logger.info(f'recover {recovered} unfinished items')
+        next_poll = 0
+        while True:
+            # sandboxes can push heartbeats by themselves,
+            # set `SANDBOX_POLL_INTERVAL` to 0 to disable polling
+            if self.POLL_INTERVAL > 0 and time.time() >= next_poll:
+                # the dispatcher should keep running, registry might be
+                # refreshed by heartbeats
+                try:
+                    self.poll_sandboxes()
+                except Exception:
+                    self.logger.exception('error while polling sandboxes')
+                next_poll = time.time() + self.POLL_INTERVAL
+            self.dispatch_one(timeout)
@@ -0,0 +1,124 @@
+'''
+Batch loading of referenced documents.
+
+Accessing a `ReferenceField` fetches the document it points to, so
+serializing a list row by row costs a query per row. Collect the ids of
+the rows first, then fetch each collection once with `$in`.
+
+`UserInfo` also caches the info of users in redis, it's shown almost
+everywhere a user is.
+'''
+import json
+from typing import Any, Dict, Iterable, List, Type
+
+from bson import DBRef
+from mongoengine import Document
+
+from . import engine
+# `utils` imports this module, only use it at runtime
+from . import utils
+
+__all__ = [
+    'ref_id',
+    'ref_ids',
+    'load',
+    'UserInfo',
+]
+
+# fields `engine.User.info` needs
+USER_INFO_FIELDS = ('username', 'profile', 'md5', 'role')
+
+
+def _id_of(value) -> Any:
+    if isinstance(value, DBRef):
+        return value.id
+    if isinstance(value, Document):
+        return value.pk
+    return value
+
+
+def ref_id(document: Document, field: str) -> Any:
+    '''
+    id referenced by a field, without dereferencing it
+    '''
+    return _id_of(document._data.get(field))
+
+
+def ref_ids(document: Document, field: str) -> List[Any]:
+    '''
+    ids referenced by a list field, without dereferencing them
+    '''
+    return [*map(_id_of, document._data.get(field) or [])]
+
+
+def load(
+    document: Type[Document],
+    ids: Iterable,
+    *fields: str,
+) -> Dict[Any, Document]:
+    '''
+    fetch documents by their ids in one query
+
+    Args:
+        ids: ids, references or documents, `None`s are ignored
+        fields: only load these fields
+
+    Returns:
+        a dict maps id to document, missing ones are not included
+    '''
+    ids = {*map(_id_of, ids)} - {None}
+    if not ids:
+        return {}
+    docs = document.objects(pk__in=[*ids])
+    if fields:
+        docs = docs.only(*fields)
+    return {doc.pk: doc for doc in docs}
+
+
+class UserInfo:
+    '''
+    `engine.User.info` of users, cached until `utils.invalidate_user_infos`
+    is called with them
+    '''
+    @staticmethod
+    def get_many(usernames: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        '''
+        info of users, missing users get the info of a blank user like
+        `User(username).info` does
+
+        Args:
+            usernames: usernames, references or documents of users,
+                `None`s are ignored
+
+        Returns:
+            a dict maps username to info
+        '''
+        usernames = [*{*map(_id_of, usernames)} - {None}]
+        if not usernames:
+            return {}
+        client = utils.RedisCache().client
+        keys = [utils.USER_INFO_KEY.format(user=u) for u in usernames]
+        ret, missing = {}, []
+        for username, cached in zip(usernames, client.mget(keys)):
+            if cached is None:
+                missing.append(username)
+            else:
+                ret[username] = json.loads(cached)
+        users = load(engine.User, missing, *USER_INFO_FIELDS)
+        pipe = client.pipeline()
+        for username in missing:
+            user = users.get(username)
+            ret[username] = (user or engine.User(username=username)).info
+            # missing ones might sign up later
+            if user is not None:
+                pipe.set(
+                    utils.USER_INFO_KEY.format(user=username),
+                    json.dumps(ret[username]),
+                    ex=utils.USER_INFO_TTL,
+                )
+        pipe.execute()
+        return ret
+
+    @classmethod
+    def get(cls, username: str) -> Dict[str, Any]:
+        return cls.get_many([username])[_id_of(username)]
@@ -3,20 +3,41 @@ from mongo.course import *
 from datetime import datetime
 from .user import *
 from .utils import *
+from .loader import load, ref_id, ref_ids, UserInfo
+from typing import Any, Dict
 __all__ = ['Post']
 
 
 class Post():
     @classmethod
-    def found_thread(cls, target_thread):
-        reply_thread = []
-        if target_thread.reply:
-            for reply in target_thread.reply:
-                reply_thread.append(Post.found_thread(reply))
+    def load_threads(cls, thread_ids) -> Dict[Any, engine.PostThread]:
+        '''
+        load threads and their replies, a query for each depth
+        '''
+        threads = {}
+        while thread_ids:
+            docs = load(engine.PostThread, thread_ids)
+            threads.update(docs)
+            thread_ids = [
+                reply for doc in docs.values()
+                for reply in ref_ids(doc, 'reply') if reply not in threads
+            ]
+        return threads
+
+    @classmethod
+    def found_thread(cls, target_thread, threads=None, authors=None):
+        if threads is None:
+            threads = cls.load_threads([target_thread.id])
+            authors = UserInfo.get_many(
+                ref_id(t, 'author') for t in threads.values())
+        reply_thread = [
+            Post.found_thread(threads[reply], threads, authors)
+            for reply in ref_ids(target_thread, 'reply') if reply in threads
+        ]
         thread = {
             'id': str(target_thread.id),
             'content': target_thread.markdown,
-            'author': target_thread.author.info,
+            'author': authors.get(ref_id(target_thread, 'author')),
             'status': target_thread.status,
             'created': target_thread.created.timestamp(),
             'updated': target_thread.updated.timestamp(),
@@ -26,12 +47,19 @@ class Post():
 
     @classmethod
     def found_post(cls, course_obj, target_id=None):
+        posts = [(x, ref_id(x, 'thread')) for x in course_obj.posts]
+        if target_id is not None:
+            posts = [(x, t) for x, t in posts if str(t) == target_id]
+        threads = cls.load_threads([t for _, t in posts])
+        authors = UserInfo.get_many(
+            ref_id(t, 'author') for t in threads.values())
         data = []
-        for x in course_obj.posts:  # target_threads
-            if (target_id is not None and str(x.thread.id) != target_id):
+        for x, thread_id in posts:  # target_threads
+            if thread_id not in threads:
                 continue
             post = {
-                'thread': Post.found_thread(x.thread),
+                'thread': Post.found_thread(threads[thread_id], threads,
+                                            authors),
                 'title': x.post_name,
             }
             data.append(post)
@@ -4,13 +4,15 @@ from .base import MongoBase
 from .course import *
 from .utils import (
     RedisCache,
-    can_view_problem,
     doc_required,
     drop_none,
+    invalidate_problem_access,
+    perm,
+    viewable_problems,
 )
 from .user import User
 from zipfile import ZipFile
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import (
     Any,
     Dict,
@@ -18,6 +20,7 @@ from typing import (
     Optional,
 )
 import json
+import secrets
 import zipfile
 
 __all__ = [
@@ -42,6 +45,22 @@ class BadTestCase(Exception):
 
 
 class Problem(MongoBase, engine=engine.Problem):
+    # a user's submission count of each problem in a day
+    SUBMIT_COUNT_KEY = 'SUBMIT_COUNT_{user}_{day}'
+    # set by the one loads counts from submissions
+    SEEDED = '_seeded'
+    # fields shown in problem list
+    LIST_FIELDS = (
+        'problem_id',
+        'problem_name',
+        'problem_status',
+        'ac_user',
+        'submitter',
+        'tags',
+        'problem_type',
+        'quota',
+    )
+
     def __init__(self, problem_id):
         self.problem_id = problem_id
 
@@ -94,12 +113,93 @@ class Problem(MongoBase, engine=engine.Problem):
             return False
         return bool((1 << language) & self.allowed_language)
 
-    def submit_count(self, user):
-        # reset quota if it's a new day
-        if user.last_submit.date() != datetime.now().date():
-            user.update(problem_submission={})
-            return 0
-        return user.problem_submission.get(str(self.problem_id), 0)
+    @classmethod
+    def submit_count_key(cls, username: str) -> str:
+        '''
+        key of today's submission counts, it starts with the counts in
+        the submission collection and expires at midnight
+        '''
+        client = RedisCache().client
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        key = cls.SUBMIT_COUNT_KEY.format(
+            user=username,
+            day=today.strftime('%Y%m%d'),
+        )
+        if client.exists(key):
+            return key
+        # seed a private key and move it in at once, so the counts can't be
+        # seen before they're loaded, or be left without expiration
+        seeding = f'{key}_SEEDING_{secrets.token_hex(8)}'
+        counts = engine.Submission.objects(
+            user=username,
+            timestamp__gte=today,
+        ).aggregate([{
+            '$group': {
+                '_id': '$problem',
+                'count': {
+                    '$sum': 1
+                },
+            }
+        }])
+        pipe = client.pipeline()
+        pipe.hset(seeding, cls.SEEDED, 1)
+        for doc in counts:
+            pipe.hincrby(seeding, doc['_id'], doc['count'])
+        pipe.expireat(seeding, today + timedelta(days=1))
+        pipe.execute()
+        # counts since the key is moved in are added by others
+        if not client.renamenx(seeding, key):
+            client.delete(seeding)
+        return key
+
+    @classmethod
+    def submit_counts(cls, user) -> Dict[str, int]:
+        '''
+        submission count of each problem today, keyed by problem id
+        '''
+        counts = RedisCache().client.hgetall(
+            cls.submit_count_key(user.username))
+        return {
+            k.decode(): int(v)
+            for k, v in counts.items() if k.decode() != cls.SEEDED
+        }
+
+    def submit_count(self, user) -> int:
+        count = RedisCache().client.hget(
+            self.submit_count_key(user.username),
+            self.problem_id,
+        )
+        return int(count or 0)
+
+    def take_quota(self, user, quota: int) -> bool:
+        '''
+        count a submission of the user today, nothing is counted if it
+        would exceed `quota`
+
+        Args:
+            quota: -1 for unlimited
+
+        Returns:
+            whether it's counted
+        '''
+        client = RedisCache().client
+        key = self.submit_count_key(user.username)
+        count = client.hincrby(key, self.problem_id, 1)
+        # concurrent ones can't both pass, the later one sees both counts
+        if quota != -1 and count > quota:
+            client.hincrby(key, self.problem_id, -1)
+            return False
+        return True
+
+    def release_quota(self, user):
+        '''
+        give back a submission counted by `take_quota`
+        '''
+        RedisCache().client.hincrby(
+            self.submit_count_key(user.username),
+            self.problem_id,
+            -1,
+        )
 
     def running_homeworks(self) -> List:
         from .homework import Homework
@@ -109,6 +209,14 @@ class Problem(MongoBase, engine=engine.Problem):
     def is_valid_ip(self, ip: str):
         return all(hw.is_valid_ip(ip) for hw in self.running_homeworks())
 
+    def is_manager(self, user: User) -> bool:
+        '''
+        admin, owner and teachers/TAs of its courses can manage it
+        '''
+        if user.role == 0 or user.username == self.owner:
+            return True
+        return any(perm(course, user) >= 2 for course in self.courses)
+
     def get_submission_status(self) -> Dict[str, int]:
         pipeline = {
             "$group": {
@@ -172,12 +280,13 @@ class Problem(MongoBase, engine=engine.Problem):
         course: str = None,
     ):
         '''
-        get a list of problems
+        get a list of problems the user can view, only fields listed in
+        `LIST_FIELDS` are loaded
         '''
         if course is not None:
-            course = Course(course).obj
-            if course is None:
+            if not (course := Course(course)):
                 return []
+            course = course.obj
         # qurey args
         ks = {
             'problem_id': problem_id,
@@ -186,14 +295,23 @@ class Problem(MongoBase, engine=engine.Problem):
             'tags__in': tags,
         }
         ks = {k: v for k, v in ks.items() if v is not None}
-        problems = engine.Problem.objects(**ks).order_by('problemId')
-        problems = [p for p in problems if can_view_problem(user, p)]
+        if offset < 0:
+            raise IndexError
+        problems = engine.Problem.objects(**ks)
+        if (q := viewable_problems(user)) is not None:
+            problems = problems.filter(q)
+        problems = problems.only(*cls.LIST_FIELDS).order_by('problemId')
         # truncate
-        if offset < 0 or (offset >= len(problems) and len(problems)):
+        # `limit(0)` means no limit
+        page = [] if count == 0 else problems.skip(offset)
+        if count > 0:
+            page = page.limit(count)
+        page = [*page]
+        # offset is out of range of a non-empty list, the page is also
+        # empty with `count=0`
+        if not page and offset and offset >= problems.count():
             raise IndexError
-        right = len(problems) if count < 0 else offset + count
-        right = min(len(problems), right)
-        return problems[offset:right]
+        return page
 
     @classmethod
     def add(
@@ -257,7 +375,7 @@ class Problem(MongoBase, engine=engine.Problem):
         quota=-1,
         default_code='',
     ):
-        problem = Problem(problem_id).obj
+        problem = Problem(problem_id)
         course_objs = []
         for name in courses:
             if not (course := Course(name)):
@@ -286,6 +404,7 @@ class Problem(MongoBase, engine=engine.Problem):
                 can_view_stdout=can_view_stdout,
                 test_case=test_case,
             )
+        invalidate_problem_access(problem.problem_id)
 
     @classmethod
     def edit_problem_test_case(cls, problem_id, test_case):
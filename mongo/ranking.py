@@ -0,0 +1,135 @@
+'''
+Global ranking of users.
+
+Users are kept in a redis sorted set, ordered by the count of problems
+they have solved, ties are broken by the ratio of accepted submissions.
+Counters shown with the ranking are kept in a hash beside it, so pages
+are served without touching mongo. `User.add_submission` updates both,
+`Ranking.rebuild` recomputes them from users to correct drifts, see
+rebuild_ranking.py.
+'''
+import json
+import secrets
+from typing import Any, Dict, List, Optional
+
+from . import engine
+from .utils import RedisCache
+from .loader import UserInfo
+
+__all__ = ['Ranking']
+
+
+class Ranking:
+    KEY = 'RANKING'
+    # username -> values of `STATS`
+    STATS_KEY = 'RANKING_STATS'
+    STATS = ('ACProblem', 'ACSubmission', 'Submission')
+    # fields of `engine.User` the ranking is computed from
+    FIELDS = ('username', 'AC_problem_ids', 'AC_submission', 'submission')
+
+    def __init__(self):
+        self.client = RedisCache().client
+
+    @staticmethod
+    def score(ac_problem: int, ac_submission: int, submission: int) -> float:
+        # the ratio part is less than 1, it only breaks ties
+        return ac_problem + ac_submission / (submission + 1)
+
+    @staticmethod
+    def stats_of(user: engine.User) -> List[int]:
+        return [len(user.AC_problem_ids), user.AC_submission, user.submission]
+
+    @classmethod
+    def update(cls, user: engine.User):
+        '''
+        update a user's position, the counters should be up to date
+        '''
+        client = RedisCache().client
+        # the user will be included when it's built
+        if not client.exists(cls.KEY):
+            return
+        stats = cls.stats_of(user)
+        pipe = client.pipeline()
+        pipe.zadd(cls.KEY, {user.username: cls.score(*stats)})
+        pipe.hset(cls.STATS_KEY, user.username, json.dumps(stats))
+        pipe.execute()
+
+    @classmethod
+    def remove(cls, *usernames: str):
+        '''
+        drop users from the ranking, e.g. they are deleted
+        '''
+        if not usernames:
+            return
+        pipe = RedisCache().client.pipeline()
+        pipe.zrem(cls.KEY, *usernames)
+        pipe.hdel(cls.STATS_KEY, *usernames)
+        pipe.execute()
+
+    def rebuild(self, batch_size: int = 1000) -> int:
+        '''
+        recompute the ranking from users and replace the current one
+
+        Returns:
+            how many users are ranked
+        '''
+        # concurrent rebuilds shouldn't move each other's keys
+        suffix = secrets.token_hex(8)
+        tmp = f'{self.KEY}_TMP_{suffix}'
+        tmp_stats = f'{self.STATS_KEY}_TMP_{suffix}'
+        cnt = 0
+        users = engine.User.objects.only(*self.FIELDS).batch_size(batch_size)
+        pipe = self.client.pipeline(transaction=False)
+        for user in users:
+            stats = self.stats_of(user)
+            pipe.zadd(tmp, {user.username: self.score(*stats)})
+            pipe.hset(tmp_stats, user.username, json.dumps(stats))
+            cnt += 1
+            if cnt % batch_size == 0:
+                pipe.execute()
+        pipe.execute()
+        # swap them at once
+        pipe = self.client.pipeline()
+        if cnt:
+            pipe.rename(tmp, self.KEY)
+            pipe.rename(tmp_stats, self.STATS_KEY)
+        else:
+            pipe.delete(self.KEY, self.STATS_KEY)
+        pipe.execute()
+        return cnt
+
+    def ensure(self):
+        '''
+        build the ranking if it hasn't been built
+        '''
+        if not self.client.exists(self.KEY):
+            self.rebuild()
+
+    def rows(self, usernames: List[str], start: int) -> List[Dict[str, Any]]:
+        if not usernames:
+            return []
+        infos = UserInfo.get_many(usernames)
+        stats = self.client.hmget(self.STATS_KEY, usernames)
+        return [{
+            'rank': start + i + 1,
+            'user': infos[username],
+            **dict(zip(self.STATS, json.loads(stat or '[0, 0, 0]'))),
+        } for i, (username, stat) in enumerate(zip(usernames, stats))]
+
+    def page(self, offset: int = 0, count: int = 100) -> List[Dict[str, Any]]:
+        '''
+        users ranked from `offset` (0-based), at most `count` of them
+        '''
+        self.ensure()
+        usernames = self.client.zrevrange(self.KEY, offset, offset + count - 1)
+        return self.rows([u.decode() for u in usernames], offset)
+
+    def rank_of(self, user) -> Optional[Dict[str, Any]]:
+        '''
+        the row of a user, `None` if the user isn't ranked
+        '''
+        self.ensure()
+        rank = self.client.zrevrank(self.KEY, user.username)
+        if rank is None:
+            return None
+        return self.rows([user.username], rank)[0]
@@ -1,13 +1,438 @@
+import os
+import abc
+import time
+import bisect
+import hashlib
 import secrets
-from .submission import Submission
+import logging
+import functools
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import requests as rq
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .utils import RedisCache
+
+__all__ = [
+    'find_by_token',
+    'SandboxClient',
+    'SandboxRegistry',
+    'Scheduler',
+    'LeastLoadScheduler',
+    'LeastOutstandingScheduler',
+    'WeightedRoundRobinScheduler',
+    'ConsistentHashScheduler',
+    'get_scheduler',
+]
 
 
 def find_by_token(token: str):
     '''
     Find sandbox by token. return None if cannot find a sandbox with that token.
     '''
+    from .submission import Submission
     sandboxes = Submission.config().sandbox_instances
     for sandbox in sandboxes:
         if secrets.compare_digest(token, sandbox.token):
             return sandbox
     return None
+
+
+class SandboxClient:
+    '''
+    every request to sandboxes should be sent by this client. it keeps
+    one keep-alive session per sandbox, so we don't pay a handshake on
+    each submission, and it always sets timeouts so a slow sandbox
+    can't block a worker forever.
+    '''
+    # should be at least the threads of a gunicorn worker
+    POOL_SIZE = int(os.getenv('SANDBOX_POOL_SIZE', '5'))
+    CONNECT_TIMEOUT = float(os.getenv('SANDBOX_CONNECT_TIMEOUT', '3'))
+    # uploading code and testdata may take a while
+    SUBMIT_TIMEOUT = float(os.getenv('SANDBOX_SUBMIT_TIMEOUT', '30'))
+    STATUS_TIMEOUT = float(os.getenv('SANDBOX_STATUS_TIMEOUT', '3'))
+    STATUS_RETRIES = int(os.getenv('SANDBOX_STATUS_RETRIES', '2'))
+    _sessions: Dict[str, rq.Session] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def session(cls, url: str) -> rq.Session:
+        '''
+        get the shared session of sandbox at `url`
+        '''
+        session = cls._sessions.get(url)
+        if session is not None:
+            return session
+        with cls._lock:
+            if url not in cls._sessions:
+                cls._sessions[url] = cls.new_session()
+            return cls._sessions[url]
+
+    @classmethod
+    def new_session(cls) -> rq.Session:
+        # by default, urllib3 only retries idempotent methods after the
+        # request is sent, so it's safe to share it with `submit`
+        retry = Retry(
+            total=cls.STATUS_RETRIES,
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=cls.POOL_SIZE,
+            max_retries=retry,
+        )
+        session = rq.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @classmethod
+    def close(cls):
+        '''
+        close all sessions, e.g. after forking
+        '''
+        with cls._lock:
+            for session in cls._sessions.values():
+                session.close()
+            cls._sessions.clear()
+
+    @classmethod
+    def status(cls, sandbox) -> rq.Response:
+        return cls.session(sandbox.url).get(
+            f'{sandbox.url}/status',
+            timeout=(cls.CONNECT_TIMEOUT, cls.STATUS_TIMEOUT),
+        )
+
+    @classmethod
+    def submit(
+        cls,
+        sandbox,
+        submission_id: str,
+        data: dict,
+        files: dict,
+    ) -> rq.Response:
+        return cls.session(sandbox.url).post(
+            f'{sandbox.url}/submit/{submission_id}',
+            data=data,
+            files=files,
+            timeout=(cls.CONNECT_TIMEOUT, cls.SUBMIT_TIMEOUT),
+        )
+
+
+class SandboxRegistry:
+    '''
+    cached sandbox load, refreshed by `poll` or by sandboxes pushing
+    heartbeats. a sandbox is considered dead if it hasn't reported for
+    `TTL` seconds.
+    '''
+    LOAD_KEY = 'SANDBOX_LOAD'
+    HEARTBEAT_KEY = 'SANDBOX_HEARTBEAT'
+    OUTSTANDING_KEY = 'SANDBOX_OUTSTANDING'
+    ASSIGNMENT_KEY = 'SANDBOX_ASSIGNMENT'
+    TTL = float(os.getenv('SANDBOX_HEARTBEAT_TTL', '30'))
+
+    def __init__(self, logger=None):
+        self.client = RedisCache().client
+        self.logger = logger or logging.getLogger('gunicorn.error')
+
+    def report(self, name: str, load: float, now: Optional[float] = None):
+        '''
+        record the current load of a sandbox
+        '''
+        if now is None:
+            now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zadd(self.LOAD_KEY, {name: load})
+        pipe.zadd(self.HEARTBEAT_KEY, {name: now})
+        pipe.execute()
+
+    def remove(self, *names: str):
+        if not names:
+            return
+        # submissions assigned to them won't be released to a new counter
+        assignments = [
+            submission_id for submission_id, name in self.client.hgetall(
+                self.ASSIGNMENT_KEY).items() if name.decode() in names
+        ]
+        pipe = self.client.pipeline()
+        pipe.zrem(self.LOAD_KEY, *names)
+        pipe.zrem(self.HEARTBEAT_KEY, *names)
+        pipe.hdel(self.OUTSTANDING_KEY, *names)
+        if assignments:
+            pipe.hdel(self.ASSIGNMENT_KEY, *assignments)
+        pipe.execute()
+
+    def retain(self, names: Iterable[str]):
+        '''
+        forget sandboxes not in `names`
+        '''
+        names = {*names}
+        known = {
+            n.decode()
+            for n in self.client.zrange(self.HEARTBEAT_KEY, 0, -1)
+        }
+        self.remove(*(known - names))
+
+    def loads(self, now: Optional[float] = None) -> Dict[str, float]:
+        '''
+        get load of alive sandboxes
+        '''
+        if now is None:
+            now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zrange(self.LOAD_KEY, 0, -1, withscores=True)
+        pipe.zrangebyscore(self.HEARTBEAT_KEY, now - self.TTL, '+inf')
+        loads, alive = pipe.execute()
+        alive = {n.decode() for n in alive}
+        return {
+            name.decode(): load
+            for name, load in loads if name.decode() in alive
+        }
+
+    def alive(self, now: Optional[float] = None) -> List[str]:
+        '''
+        get names of alive sandboxes
+        '''
+        if now is None:
+            now = time.time()
+        return [
+            n.decode() for n in self.client.zrangebyscore(
+                self.HEARTBEAT_KEY,
+                now - self.TTL,
+                '+inf',
+            )
+        ]
+
+    def acquire(self, name: str, submission_id: str):
+        '''
+        count a submission sent to sandbox `name` as outstanding
+        '''
+        submission_id = str(submission_id)
+        # a rejudged submission may still be counted by another sandbox
+        self.release(submission_id)
+        pipe = self.client.pipeline()
+        pipe.hset(self.ASSIGNMENT_KEY, submission_id, name)
+        pipe.hincrby(self.OUTSTANDING_KEY, name, 1)
+        pipe.execute()
+
+    def release(self, submission_id: str) -> Optional[str]:
+        '''
+        the submission is finished (or failed to send), decrease the
+        outstanding count of its sandbox
+
+        Returns:
+            the sandbox name it was assigned to
+        '''
+        submission_id = str(submission_id)
+        name = self.client.hget(self.ASSIGNMENT_KEY, submission_id)
+        # only the one who remove the assignment can decrease the counter
+        if name is None or not self.client.hdel(
+                self.ASSIGNMENT_KEY,
+                submission_id,
+        ):
+            return None
+        name = name.decode()
+        # the sandbox is removed after the assignment is read
+        if self.client.hincrby(self.OUTSTANDING_KEY, name, -1) < 0:
+            self.client.hincrby(self.OUTSTANDING_KEY, name, 1)
+        return name
+
+    def outstanding(self) -> Dict[str, int]:
+        '''
+        get how many submissions each sandbox is judging
+        '''
+        return {
+            name.decode(): max(int(cnt), 0)
+            for name, cnt in self.client.hgetall(self.OUTSTANDING_KEY).items()
+        }
+
+    def least_loaded(self, now: Optional[float] = None) -> Optional[str]:
+        '''
+        get the name of the alive sandbox with minimum load
+        '''
+        loads = self.loads(now)
+        if not loads:
+            return None
+        return min(loads, key=loads.get)
+
+    def poll(self, sandboxes):
+        '''
+        query `/status` of each sandbox and update the registry
+        '''
+        for sb in sandboxes:
+            try:
+                resp = SandboxClient.status(sb)
+            except rq.RequestException as e:
+                self.logger.warning(f'can not reach sandbox {sb.name}: {e}')
+                self.remove(sb.name)
+                continue
+            if not resp.ok:
+                self.logger.warning(f'sandbox {sb.name} status exception')
+                self.logger.warning(
+                    f'status code: {resp.status_code}\n '
+                    f'body: {resp.text}', )
+                self.remove(sb.name)
+                continue
+            try:
+                load = float(resp.json()['load'])
+            except (ValueError, KeyError, TypeError) as e:
+                self.logger.warning(
+                    f'invalid status of sandbox {sb.name}: {e!r}\n'
+                    f'body: {resp.text}', )
+                self.remove(sb.name)
+                continue
+            self.report(sb.name, load)
+
+
+class Scheduler(abc.ABC):
+    '''
+    policy to pick a sandbox for a submission, only alive sandboxes
+    in the registry will be picked
+    '''
+    name = None
+
+    def __init__(self, registry: Optional[SandboxRegistry] = None):
+        self.registry = registry or SandboxRegistry()
+
+    def candidates(self, sandboxes, now: Optional[float] = None):
+        alive = {*self.registry.alive(now)}
+        return [sb for sb in sandboxes if sb.name in alive]
+
+    def pick(
+        self,
+        sandboxes,
+        problem_id: int,
+        now: Optional[float] = None,
+    ):
+        '''
+        pick one from `sandboxes`, return None if all of them are dead
+        '''
+        candidates = self.candidates(sandboxes, now)
+        if not candidates:
+            return None
+        return self._pick(candidates, problem_id, now)
+
+    @abc.abstractmethod
+    def _pick(self, candidates, problem_id: int, now: Optional[float]):
+        raise NotImplementedError
+
+
+class LeastLoadScheduler(Scheduler):
+    '''
+    pick the sandbox with minimum reported load
+    '''
+    name = 'least-load'
+
+    def _pick(self, candidates, problem_id, now):
+        loads = self.registry.loads(now)
+        return min(
+            candidates,
+            key=lambda sb: loads.get(sb.name, float('inf')),
+        )
+
+
+class LeastOutstandingScheduler(Scheduler):
+    '''
+    pick the sandbox with minimum outstanding submissions per capacity,
+    the counters are updated on sending so a burst of submissions can
+    be spread even if the reported loads are stale
+    '''
+    name = 'least-outstanding'
+
+    def _pick(self, candidates, problem_id, now):
+        outstanding = self.registry.outstanding()
+        return min(
+            candidates,
+            key=lambda sb: outstanding.get(sb.name, 0) / sb.capacity,
+        )
+
+
+class WeightedRoundRobinScheduler(Scheduler):
+    '''
+    smooth weighted round-robin by sandbox capacity
+    '''
+    name = 'weighted-round-robin'
+    COUNTER_KEY = 'SANDBOX_ROUND_ROBIN'
+
+    @staticmethod
+    def sequence(weights: List[int]) -> List[int]:
+        '''
+        the order of indexes in one round, e.g. [5, 1, 1] gives
+        [0, 0, 1, 0, 2, 0, 0] instead of sending 5 submissions to the
+        first one in a row
+        '''
+        total = sum(weights)
+        current = [0] * len(weights)
+        ret = []
+        for _ in range(total):
+            for i, w in enumerate(weights):
+                current[i] += w
+            i = max(range(len(weights)), key=current.__getitem__)
+            current[i] -= total
+            ret.append(i)
+        return ret
+
+    def _pick(self, candidates, problem_id, now):
+        seq = self.sequence([sb.capacity for sb in candidates])
+        cnt = self.registry.client.incr(self.COUNTER_KEY)
+        return candidates[seq[cnt % len(seq)]]
+
+
+class ConsistentHashScheduler(Scheduler):
+    '''
+    map problems onto a hash ring of sandboxes, so submissions of one
+    problem go to the same sandbox and hit its testdata cache. only
+    problems on a dead sandbox are moved when sandboxes change.
+    '''
+    name = 'consistent-hash'
+    # virtual nodes per capacity
+    REPLICAS = 64
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+    @classmethod
+    @functools.lru_cache(maxsize=16)
+    def ring(cls, nodes):
+        '''
+        build the ring from a tuple of (name, capacity)
+        '''
+        return sorted((cls.hash(f'{name}#{i}'), name)
+                      for name, capacity in nodes
+                      for i in range(capacity * cls.REPLICAS))
+
+    def _pick(self, candidates, problem_id, now):
+        ring = self.ring(tuple((sb.name, sb.capacity) for sb in candidates))
+        i = bisect.bisect(ring, (self.hash(str(problem_id)), ))
+        name = ring[i % len(ring)][1]
+        return next(sb for sb in candidates if sb.name == name)
+
+
+SCHEDULERS = {
+    cls.name: cls
+    for cls in (
+        LeastLoadScheduler,
+        LeastOutstandingScheduler,
+        WeightedRoundRobinScheduler,
+        ConsistentHashScheduler,
+    )
+}
+
+
+def get_scheduler(
+    name: Optional[str] = None,
+    registry: Optional[SandboxRegistry] = None,
+) -> Scheduler:
+    '''
+    get scheduler by name, default to env `SANDBOX_SCHEDULER`
+    '''
+    if name is None:
+        name = os.getenv('SANDBOX_SCHEDULER', 'least-outstanding')
+    if name not in SCHEDULERS:
+        raise ValueError(f'unknown scheduler {name}')
+    return SCHEDULERS[name](registry)
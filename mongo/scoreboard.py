@@ -0,0 +1,374 @@
+'''
+Materialized course scoreboard.
+
+Statistics of each user's submissions to a problem (count / sum / max /
+min of scores) are kept in `engine.ScoreboardCell`. Cells of a problem
+are built from submissions the first time it's requested, after that
+`Submission.finish_judging` updates them incrementally. Rejudging a
+problem drops its cells, so they will be built again. Submissions judged
+while cells are being built mark them dirty, the build is repeated so
+they won't be missed.
+
+Rendered scoreboards are cached in redis as snapshots keyed by the
+course's version, which is bumped whenever a submission of its problems
+is judged. A snapshot can be requested by its version until it expires,
+so clients can keep reading a consistent one. Time-windowed scoreboards
+can't be maintained incrementally, they are rebuilt from submissions in
+a background thread while the latest snapshot is served.
+'''
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from . import engine
+from .utils import RedisCache
+from .loader import UserInfo
+
+__all__ = ['Scoreboard']
+
+
+class Scoreboard:
+    # problem ids whose cells are built
+    BUILT_KEY = 'SCOREBOARD_BUILT'
+    # problem ids whose cells are being built, and the ones of them have
+    # submissions judged since then
+    BUILDING_KEY = 'SCOREBOARD_BUILDING'
+    DIRTY_KEY = 'SCOREBOARD_DIRTY'
+    # give up building cells which keep being dirty, they are built on
+    # the next request
+    BUILD_ROUNDS = 3
+    VERSION_KEY = 'SCOREBOARD_VERSION_{course}'
+    SNAPSHOT_KEY = 'SCOREBOARD_SNAPSHOT_{course}_{view}_{version}'
+    # version of the latest snapshot of a view
+    LATEST_KEY = 'SCOREBOARD_LATEST_{course}_{view}'
+    REBUILD_LOCK_KEY = 'SCOREBOARD_REBUILD_{course}_{view}'
+    SNAPSHOT_TTL = int(os.getenv('SCOREBOARD_SNAPSHOT_TTL', '600'))
+
+    def __init__(self, course: engine.Course):
+        self.course = course
+        self.client = RedisCache().client
+        # the last background rebuild, kept for waiting on it
+        self.worker = None
+
+    def version(self) -> int:
+        version = self.client.get(
+            self.VERSION_KEY.format(course=self.course.id))
+        return int(version or 0)
+
+    @classmethod
+    def bump(cls, course_ids: Iterable):
+        pipe = RedisCache().client.pipeline()
+        for course_id in course_ids:
+            pipe.incr(cls.VERSION_KEY.format(course=course_id))
+        pipe.execute()
+
+    @staticmethod
+    def courses_of(problem_ids: Iterable[int]) -> List:
+        docs = engine.Problem._get_collection().find(
+            {'_id': {
+                '$in': [*problem_ids]
+            }},
+            {'courses': 1},
+        )
+        return [*{c for doc in docs for c in doc.get('courses', [])}]
+
+    @classmethod
+    def record(cls, submission):
+        '''
+        apply a judged submission to the cells and invalidate snapshots
+        '''
+        client = RedisCache().client
+        pid = submission.problem_id
+        pipe = client.pipeline()
+        pipe.sismember(cls.BUILT_KEY, pid)
+        pipe.sismember(cls.BUILDING_KEY, pid)
+        built, building = pipe.execute()
+        # the build might have aggregated before it's judged
+        if building:
+            client.sadd(cls.DIRTY_KEY, pid)
+        elif built:
+            engine.ScoreboardCell._get_collection().update_one(
+                {
+                    'problemId': submission.problem_id,
+                    'user': submission.username,
+                },
+                {
+                    '$inc': {
+                        'count': 1,
+                        'sum': submission.score,
+                    },
+                    '$max': {
+                        'max': submission.score
+                    },
+                    '$min': {
+                        'min': submission.score
+                    },
+                },
+                upsert=True,
+            )
+        cls.bump(cls.courses_of([submission.problem_id]))
+
+    @classmethod
+    def invalidate(cls, problem_ids: Iterable[int]):
+        '''
+        drop cells of these problems, call it when submissions' results
+        are changed or removed instead of being judged the first time
+        '''
+        problem_ids = [*{*problem_ids}]
+        if not problem_ids:
+            return
+        RedisCache().client.srem(cls.BUILT_KEY, *problem_ids)
+        engine.ScoreboardCell.objects(problem_id__in=problem_ids).delete()
+        cls.bump(cls.courses_of(problem_ids))
+
+    @staticmethod
+    def aggregate(
+        problem_ids: List[int],
+        users: Optional[List[str]] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        '''
+        compute cells from judged submissions
+
+        Returns:
+            a dict maps (username, problem id) to a cell
+        '''
+        matching = {
+            'problem': {
+                '$in': problem_ids
+            },
+            # not judged yet
+            'status': {
+                '$ne': -1
+            },
+        }
+        if users is not None:
+            matching['user'] = {'$in': users}
+        if start or end:
+            matching['timestamp'] = {}
+            if start:
+                matching['timestamp']['$gte'] = start
+            if end:
+                matching['timestamp']['$lte'] = end
+        pipeline = [
+            {
+                '$match': matching
+            },
+            {
+                '$group': {
+                    '_id': {
+                        'user': '$user',
+                        'problem': '$problem',
+                    },
+                    'count': {
+                        '$sum': 1
+                    },
+                    'sum': {
+                        '$sum': '$score'
+                    },
+                    'max': {
+                        '$max': '$score'
+                    },
+                    'min': {
+                        '$min': '$score'
+                    },
+                }
+            },
+        ]
+        cells = {}
+        for doc in engine.Submission.objects().aggregate(pipeline):
+            key = (doc['_id']['user'], doc['_id']['problem'])
+            cells[key] = {k: doc[k] for k in ('count', 'sum', 'max', 'min')}
+        return cells
+
+    @classmethod
+    def build(cls, problem_ids: List[int]):
+        '''
+        build cells of problems haven't been built
+        '''
+        client = RedisCache().client
+        problem_ids = [
+            pid for pid in {*problem_ids}
+            if not client.sismember(cls.BUILT_KEY, pid)
+        ]
+        for _ in range(cls.BUILD_ROUNDS):
+            if not problem_ids:
+                return
+            pipe = client.pipeline()
+            pipe.srem(cls.BUILT_KEY, *problem_ids)
+            pipe.sadd(cls.BUILDING_KEY, *problem_ids)
+            pipe.srem(cls.DIRTY_KEY, *problem_ids)
+            pipe.execute()
+            cls._write_cells(cls.aggregate(problem_ids))
+            pipe = client.pipeline()
+            pipe.sadd(cls.BUILT_KEY, *problem_ids)
+            pipe.srem(cls.BUILDING_KEY, *problem_ids)
+            for pid in problem_ids:
+                pipe.srem(cls.DIRTY_KEY, pid)
+            dirty = pipe.execute()[2:]
+            problem_ids = [
+                pid for pid, removed in zip(problem_ids, dirty) if removed
+            ]
+        if problem_ids:
+            client.srem(cls.BUILT_KEY, *problem_ids)
+
+    @staticmethod
+    def _write_cells(cells: Dict[Tuple[str, int], Dict[str, Any]]):
+        requests = [
+            UpdateOne(
+                {
+                    'problemId': pid,
+                    'user': user,
+                },
+                {'$set': cell},
+                upsert=True,
+            ) for (user, pid), cell in cells.items()
+        ]
+        if requests:
+            engine.ScoreboardCell._get_collection().bulk_write(
+                requests,
+                ordered=False,
+            )
+
+    def render(
+        self,
+        problem_ids: List[int],
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> List[Dict[str, Any]]:
+        users = sorted(self.course.student_nicknames)
+        if start or end:
+            cells = self.aggregate(problem_ids, users, start, end)
+        else:
+            self.build(problem_ids)
+            docs = engine.ScoreboardCell.objects(
+                problem_id__in=problem_ids,
+                user__in=users,
+            ).as_pymongo()
+            cells = {(doc['user'], doc['problemId']): doc for doc in docs}
+        infos = UserInfo.get_many(users)
+        scoreboard = []
+        for user in users:
+            scores = {
+                str(pid): {
+                    'pid': pid,
+                    'count': cell['count'],
+                    'max': cell['max'],
+                    'min': cell['min'],
+                    'avg': cell['sum'] / cell['count'],
+                }
+                for pid in problem_ids
+                if (cell := cells.get((user, pid))) is not None
+            }
+            sum_of_score = sum(s['max'] for s in scores.values())
+            avg = sum_of_score / len(problem_ids) if scores else 0
+            scoreboard.append({
+                'user': infos.get(user),
+                'sum': sum_of_score,
+                'avg': avg,
+                **scores,
+            })
+        return scoreboard
+
+    def snapshot(self, view: str, version: int) -> Optional[List[Dict]]:
+        data = self.client.get(
+            self.SNAPSHOT_KEY.format(
+                course=self.course.id,
+                view=view,
+                version=version,
+            ))
+        return None if data is None else json.loads(data)
+
+    def save(self, view: str, version: int, scoreboard: List[Dict]):
+        pipe = self.client.pipeline()
+        pipe.set(
+            self.SNAPSHOT_KEY.format(
+                course=self.course.id,
+                view=view,
+                version=version,
+            ),
+            json.dumps(scoreboard),
+            ex=self.SNAPSHOT_TTL,
+        )
+        pipe.set(
+            self.LATEST_KEY.format(course=self.course.id, view=view),
+            version,
+            ex=self.SNAPSHOT_TTL,
+        )
+        pipe.execute()
+
+    def rebuild(self, view: str, version: int, *args):
+        try:
+            self.save(view, version, self.render(*args))
+        except Exception as e:
+            logging.error(f'failed to rebuild scoreboard: {e}')
+        finally:
+            self.client.delete(
+                self.REBUILD_LOCK_KEY.format(
+                    course=self.course.id,
+                    view=view,
+                ))
+
+    def get(
+        self,
+        problem_ids: List[int],
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        version: Optional[int] = None,
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        '''
+        get scoreboard of the course's students
+
+        Args:
+            start, end: only count submissions in this period
+            version: get the snapshot of this version
+
+        Returns:
+            (version, scoreboard)
+        '''
+        view = json.dumps([problem_ids, start, end]).encode()
+        view = hashlib.md5(view).hexdigest()
+        if version is not None:
+            scoreboard = self.snapshot(view, version)
+            if scoreboard is None:
+                raise engine.DoesNotExist(
+                    f'scoreboard snapshot {version} expired')
+            return version, scoreboard
+        # read before rendering, so a change during that will be noticed
+        current = self.version()
+        scoreboard = self.snapshot(view, current)
+        if scoreboard is not None:
+            return current, scoreboard
+        args = (
+            problem_ids,
+            start and datetime.fromtimestamp(start),
+            end and datetime.fromtimestamp(end),
+        )
+        if start or end:
+            latest = self.client.get(
+                self.LATEST_KEY.format(course=self.course.id, view=view))
+            scoreboard = latest and self.snapshot(view, int(latest))
+            # serve the outdated one and rebuild it in background
+            if scoreboard is not None:
+                lock = self.REBUILD_LOCK_KEY.format(
+                    course=self.course.id,
+                    view=view,
+                )
+                if self.client.set(lock, 1, nx=True, ex=self.SNAPSHOT_TTL):
+                    self.worker = threading.Thread(
+                        target=self.rebuild,
+                        args=(view, current, *args),
+                        daemon=True,
+                    )
+                    self.worker.start()
+                return int(latest), scoreboard
+        scoreboard = self.render(*args)
+        self.save(view, current, scoreboard)
+        return current, scoreboard
@@ -1,21 +1,29 @@
 from __future__ import annotations
+import io
 import os
+import json
+import base64
+import binascii
 import pathlib
 import secrets
 import logging
 from typing import (
+    IO,
     Any,
     Dict,
     Optional,
     Union,
     List,
+    Tuple,
+    Iterable,
 )
 import tempfile
-import requests as rq
 import itertools
+from bson import ObjectId
+from bson.errors import InvalidId
 from bson.son import SON
-from flask import current_app
-from tempfile import NamedTemporaryFile
+from pymongo import UpdateOne
+from mongoengine import Q
 from datetime import date, datetime
 from zipfile import ZipFile, is_zipfile
 
@@ -24,7 +32,21 @@ from .base import MongoBase
 from .user import User
 from .problem import Problem
 from .course import Course
-from .utils import RedisCache
+from .utils import (
+    RedisCache,
+    COURSE_ROLES_VERSION_KEY,
+    SUBMISSION_LIST_VERSION_KEY,
+    invalidate_submission_lists,
+)
+from .judge_queue import JudgeQueue
+from .scoreboard import Scoreboard
+from .loader import ref_id, UserInfo
+from .sandbox import (
+    SandboxClient,
+    SandboxRegistry,
+    Scheduler,
+    get_scheduler,
+)
 
 __all__ = [
     'SubmissionConfig',
@@ -64,6 +86,81 @@ class TestCaseNotFound(Exception):
         return f'{Problem(self.problem_id)}\'s testcase is not found'
 
 
+class OutputPacker:
+    '''
+    pack stdout/stderr of all cases into one blob, outputs not larger
+    than `inline_size` bytes are kept in the case result instead.
+    each output is copied by chunks and truncated at `cap` bytes, so
+    the memory usage doesn't depend on the output size.
+    '''
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fp, inline_size: int, cap: int = 0):
+        '''
+        Args:
+            fp: a writable binary file
+            cap: max bytes of each stdout/stderr, 0 for no limit
+        '''
+        self.fp = fp
+        self.inline_size = inline_size
+        self.cap = cap
+        self.size = 0
+
+    @staticmethod
+    def _stream(output: Union[str, bytes, IO[bytes], None]) -> IO[bytes]:
+        if output is None:
+            output = b''
+        if isinstance(output, str):
+            output = output.encode()
+        if isinstance(output, bytes):
+            output = io.BytesIO(output)
+        return output
+
+    def _copy(self, head: bytes, stream: IO[bytes]) -> int:
+        size = 0
+        chunk = head
+        while chunk and (self.cap <= 0 or size < self.cap):
+            if self.cap > 0:
+                chunk = chunk[:self.cap - size]
+            self.fp.write(chunk)
+            size += len(chunk)
+            chunk = stream.read(self.CHUNK_SIZE)
+        self.size += size
+        return size
+
+    def add(
+        self,
+        stdout: Union[str, bytes, IO[bytes], None],
+        stderr: Union[str, bytes, IO[bytes], None],
+    ) -> Dict[str, Any]:
+        '''
+        Args:
+            stdout, stderr: content or a readable binary file
+
+        Returns:
+            fields of `engine.CaseResult` to locate the output
+        '''
+        streams = [*map(self._stream, (stdout, stderr))]
+        heads = [s.read(self.inline_size + 1) for s in streams]
+        # both of them are read to the end
+        if sum(map(len, heads)) <= self.inline_size:
+            try:
+                return {
+                    'stdout': heads[0].decode(),
+                    'stderr': heads[1].decode(),
+                }
+            # binary output can't be stored as string
+            except UnicodeDecodeError:
+                pass
+        offset = self.size
+        out_size, err_size = map(self._copy, heads, streams)
+        return {
+            'output_offset': offset,
+            'stdout_size': out_size,
+            'stderr_size': err_size,
+        }
+
+
 class SubmissionConfig(MongoBase, engine=engine.SubmissionConfig):
     TMP_DIR = pathlib.Path(
         os.getenv(
@@ -77,6 +174,22 @@ class SubmissionConfig(MongoBase, engine=engine.SubmissionConfig):
 
 class Submission(MongoBase, engine=engine.Submission):
     _config = None
+    # fields shown in submission lists
+    LIST_FIELDS = (
+        'problem',
+        'user',
+        'language',
+        'timestamp',
+        'status',
+        'score',
+        'exec_time',
+        'memory_usage',
+        'last_send',
+    )
+    # in bytes, see `OutputPacker`
+    INLINE_OUTPUT_SIZE = int(os.getenv('SUBMISSION_INLINE_OUTPUT_SIZE',
+                                       '1024'))
+    OUTPUT_CAP = int(os.getenv('SUBMISSION_OUTPUT_CAP', str(1 << 20)))
 
     def __init__(self, submission_id):
         self.submission_id = str(submission_id)
@@ -146,7 +259,8 @@ class Submission(MongoBase, engine=engine.Submission):
 
     @classmethod
     def config(cls):
-        if not cls._config:
+        # it might be removed by others
+        if cls._config is None or not cls._config.exists(refresh=True):
             cls._config = SubmissionConfig('submission')
         if not cls._config:
             cls._config.save()
@@ -157,16 +271,61 @@ class Submission(MongoBase, engine=engine.Submission):
             case = self.tasks[task_no].cases[case_no]
         except IndexError:
             raise FileNotFoundError('task not exist')
-        ret = {}
-        try:
-            with ZipFile(case.output) as zf:
-                ret = {k: zf.read(k) for k in ('stdout', 'stderr')}
-                if text:
-                    ret = {k: v.decode('utf-8') for k, v in ret.items()}
-        except AttributeError as e:
+        ret = self.read_output(case)
+        if ret is None:
             raise AttributeError('The submission is still in pending')
+        if text:
+            # output might be truncated in the middle of a character
+            ret = {k: v.decode('utf-8', 'replace') for k, v in ret.items()}
         return ret
 
+    def read_output(
+        self,
+        case: engine.CaseResult,
+        pack: Optional[bytes] = None,
+    ) -> Optional[Dict[str, bytes]]:
+        '''
+        read stdout/stderr of a case, only the range of this case is
+        read from `output_pack` unless the whole `pack` is given
+
+        Returns:
+            None if the output doesn't exist
+        '''
+        if case.stdout is not None:
+            return {
+                'stdout': case.stdout.encode(),
+                'stderr': (case.stderr or '').encode(),
+            }
+        if case.output_offset is not None:
+            size = case.stdout_size + case.stderr_size
+            if pack is not None:
+                data = pack[case.output_offset:case.output_offset + size]
+            else:
+                fp = self.output_pack.get()
+                fp.seek(case.output_offset)
+                data = fp.read(size)
+            return {
+                'stdout': data[:case.stdout_size],
+                'stderr': data[case.stdout_size:],
+            }
+        # legacy format
+        if case.output is not None and case.output.grid_id is not None:
+            with ZipFile(case.output) as zf:
+                return {k: zf.read(k) for k in ('stdout', 'stderr')}
+        return None
+
+    def save_output_pack(self):
+        '''
+        finish writing `output_pack` by `OutputPacker` and save it
+        '''
+        self.output_pack.close()
+        # `update` can't serialize a file field
+        self.update(__raw__={
+            '$set': {
+                'outputPack': self.output_pack.grid_id
+            },
+        })
+
     def delete_output(self, *args):
         '''
         delete stdout/stderr of this submission
@@ -176,7 +335,10 @@ class Submission(MongoBase, engine=engine.Submission):
         '''
         for task in self.tasks:
             for case in task.cases:
-                case.output.delete()
+                if case.output is not None:
+                    case.output.delete()
+        if self.output_pack.grid_id is not None:
+            self.output_pack.delete()
 
     def delete(self, *keeps):
         '''
@@ -198,7 +360,7 @@ class Submission(MongoBase, engine=engine.Submission):
 
         for d in drops:
             del_funcs.get(d, default_del_func)(d)
-        self.obj.delete()
+        super().delete()
 
     def sandbox_resp_handler(self, resp):
         # judge queue is currently full
@@ -229,22 +391,17 @@ class Submission(MongoBase, engine=engine.Submission):
                 f'body: {resp.text}', )
             return False
 
-    def target_sandbox(self):
-        load = 10**3  # current min load
-        tar = None  # target
-        for sb in self.config().sandbox_instances:
-            resp = rq.get(f'{sb.url}/status')
-            if not resp.ok:
-                self.logger.warning(f'sandbox {sb.name} status exception')
-                self.logger.warning(
-                    f'status code: {resp.status_code}\n '
-                    f'body: {resp.text}', )
-                continue
-            resp = resp.json()
-            if resp['load'] < load:
-                load = resp['load']
-                tar = sb
-        return tar
+    def target_sandbox(self, scheduler: Optional[Scheduler] = None):
+        '''
+        pick an alive sandbox by `scheduler` (default to the one set by
+        `SANDBOX_SCHEDULER`), return None if no sandbox is alive
+        '''
+        if scheduler is None:
+            scheduler = get_scheduler()
+        return scheduler.pick(
+            self.config().sandbox_instances,
+            self.problem_id,
+        )
 
     def get_comment(self) -> bytes:
         '''
@@ -281,15 +438,75 @@ class Submission(MongoBase, engine=engine.Submission):
         '''
         # delete output file
         self.delete_output()
+        if self.status != -1:
+            Scoreboard.invalidate([self.problem_id])
         # turn back to haven't be judged
         self.update(
             status=-1,
             last_send=datetime.now(),
             tasks=[],
+            output_pack=None,
         )
-        if current_app.config['TESTING']:
-            return True
-        return self.send()
+        invalidate_submission_lists([self.problem_id], [self.username])
+        return self.enqueue()
+
+    @classmethod
+    def rejudge_many(cls, job: str, **ks) -> int:
+        '''
+        rejudge submissions filtered by `ks` in background, they are
+        reset at once and fed to sandboxes at `REJUDGE_RATE`. progress
+        can be queried by `JudgeQueue().progress(job)`
+
+        Returns:
+            how many submissions will be rejudged
+        '''
+        # skip handwritten ones and the ones haven't upload code
+        docs = engine.Submission.objects(
+            status__ne=-2,
+            language__ne=3,
+            **ks,
+        ).only(
+            'id',
+            'problem',
+            'user',
+            'output_pack',
+            'tasks.cases.output',
+        ).as_pymongo()
+        ids, outputs, problems, users = [], [], set(), set()
+        for doc in docs:
+            ids.append(doc['_id'])
+            problems.add(doc['problem'])
+            users.add(doc['user'])
+            if doc.get('outputPack') is not None:
+                outputs.append(doc['outputPack'])
+            # legacy outputs
+            outputs.extend(case['output'] for task in doc.get('tasks', [])
+                           for case in task.get('cases', [])
+                           if case.get('output') is not None)
+        if ids:
+            engine.Submission.objects(id__in=ids).update(
+                status=-1,
+                last_send=datetime.now(),
+                tasks=[],
+                output_pack=None,
+            )
+            cls.delete_grid_files(outputs)
+            Scoreboard.invalidate(problems)
+            invalidate_submission_lists(problems, users)
+        JudgeQueue().push_bulk(job, ids)
+        return len(ids)
+
+    @staticmethod
+    def delete_grid_files(grid_ids: List, collection: str = 'fs'):
+        '''
+        delete GridFS files by ids in one query, instead of one by one
+        '''
+        if not grid_ids:
+            return
+        db = engine.Submission._get_db()
+        query = {'$in': grid_ids}
+        db[f'{collection}.files'].delete_many({'_id': query})
+        db[f'{collection}.chunks'].delete_many({'files_id': query})
 
     def submit(self, code_file) -> bool:
         '''
@@ -319,18 +536,35 @@ class Submission(MongoBase, engine=engine.Submission):
             }
             for submission in engine.Submission.objects(**q):
                 if submission != self.obj:
-                    for homework in self.problem.homeworks:
-                        stat = homework.student_status[self.user.username][str(
-                            self.problem_id)]
-                        stat['score'] = 0
-                        stat['problemStatus'] = -1
-                        stat['submissionIds'] = []
-                        homework.save()
+                    engine.HomeworkStatus.objects(
+                        user=self.user,
+                        problem_id=self.problem_id,
+                    ).update(
+                        score=0,
+                        problem_status=-1,
+                        submission_ids=[],
+                    )
                     submission.delete()
-        # we no need to actually send code to sandbox during testing
-        if current_app.config['TESTING'] or self.handwritten:
+                    Scoreboard.invalidate([self.problem_id])
+        invalidate_submission_lists([self.problem_id], [self.username])
+        # handwritten submission will be judged by teacher
+        if self.handwritten:
             return True
-        return self.send()
+        return self.enqueue()
+
+    def enqueue(self) -> bool:
+        '''
+        push this submission into judge queue, the dispatcher
+        will send it to sandbox later
+        '''
+        if self.handwritten:
+            logging.warning(f'try to enqueue a handwritten {self}')
+            return False
+        if self.problem.test_case.case_zip is None:
+            raise TestCaseNotFound(self.problem.problem_id)
+        JudgeQueue().push(self.id)
+        self.logger.info(f'push {self} into judge queue')
+        return True
 
     def send(self) -> bool:
         '''
@@ -353,22 +587,29 @@ class Submission(MongoBase, engine=engine.Submission):
             return False
         # save token for validation
         Submission.assign_token(self.id, tar.token)
+        registry = SandboxRegistry()
+        registry.acquire(tar.name, self.id)
         post_data = {
             'token': tar.token,
             'checker': 'print("not implement yet. qaq")',
             'problem_id': self.problem_id,
             'language': self.language,
         }
-        judge_url = f'{tar.url}/submit/{self.id}'
         # send submission to snadbox for judgement
         self.logger.info(f'send {self} to {tar.name}')
-        resp = rq.post(
-            judge_url,
-            data=post_data,
-            files=files,
-        )
-        self.logger.info(f'recieve {self} resp from sandbox')
-        return self.sandbox_resp_handler(resp)
+        try:
+            resp = SandboxClient.submit(tar, self.id, post_data, files)
+            self.logger.info(f'recieve {self} resp from sandbox')
+            accepted = self.sandbox_resp_handler(resp)
+        except Exception:
+            # it's not judging, so don't count it as outstanding
+            registry.release(self.id)
+            raise
+        if accepted:
+            self.update(last_send=datetime.now())
+        else:
+            registry.release(self.id)
+        return accepted
 
     def process_result(self, tasks: list):
         '''
@@ -380,103 +621,234 @@ class Submission(MongoBase, engine=engine.Submission):
                 {
                     'exitCode': int,
                     'status': str,
-                    'stdout': str,
-                    'stderr': str,
+                    'stdout': str | bytes | binary file,
+                    'stderr': str | bytes | binary file,
                     'execTime': int,
                     'memoryUsage': int
                 }
+                outputs given as files are read by chunks
         '''
         self.logger.info(f'recieve {self} result')
-        for task in tasks:
-            for case in task:
-                # we don't need exit code
-                del case['exitCode']
-                # convert status into integer
-                case['status'] = self.status2code.get(case['status'], -3)
-        # process task
+        # outputs of the previous judgement
+        self.delete_output()
+        # `GridFSProxy` creates the file on the first write
+        packer = OutputPacker(
+            self.output_pack,
+            self.INLINE_OUTPUT_SIZE,
+            self.OUTPUT_CAP,
+        )
+        results = []
+        # aggregate of the whole submission
+        initial = {'status': -3, 'exec_time': -1, 'memory_usage': -1}
+        total = {**initial}
+        score = 0
         for i, cases in enumerate(tasks):
-            # save stdout/stderr
-            fds = ['stdout', 'stderr']
+            # each task starts from scratch, not from the earlier ones
+            task = engine.TaskResult(**initial, cases=[])
             for j, case in enumerate(cases):
-                tf = NamedTemporaryFile(delete=False)
-                with ZipFile(tf, 'w') as zf:
-                    for fd in fds:
-                        content = case.pop(fd)
-                        if content is None:
-                            self.logger.error(
-                                f'key {fd} not in case result {self} {i:02d}{j:02d}'
-                            )
-                        zf.writestr(fd, content)
-                tf.seek(0)
-                case['output'] = tf
+                # we don't need exit code
+                del case['exitCode']
+                output = {}
+                for fd in ('stdout', 'stderr'):
+                    output[fd] = case.get(fd)
+                    if output[fd] is None:
+                        self.logger.error(
+                            f'key {fd} not in case result {self} {i:02d}{j:02d}'
+                        )
                 # convert dict to document
-                cases[j] = engine.CaseResult(
-                    status=case['status'],
+                case = engine.CaseResult(
+                    # convert status into integer
+                    status=self.status2code.get(case['status'], -3),
                     exec_time=case['execTime'],
                     memory_usage=case['memoryUsage'],
-                    output=case['output'],
+                    **packer.add(**output),
                 )
-            status = max(c.status for c in cases)
-            exec_time = max(c.exec_time for c in cases)
-            memory_usage = max(c.memory_usage for c in cases)
-            tasks[i] = engine.TaskResult(
-                status=status,
-                exec_time=exec_time,
-                memory_usage=memory_usage,
-                score=self.problem.test_case.tasks[i].task_score
-                if status == 0 else 0,
-                cases=cases,
-            )
-        status = max(t.status for t in tasks)
-        exec_time = max(t.exec_time for t in tasks)
-        memory_usage = max(t.memory_usage for t in tasks)
-        self.update(
-            score=sum(task.score for task in tasks),
-            status=status,
-            tasks=tasks,
-            exec_time=exec_time,
-            memory_usage=memory_usage,
-        )
+                task.status = max(task.status, case.status)
+                task.exec_time = max(task.exec_time, case.exec_time)
+                task.memory_usage = max(task.memory_usage, case.memory_usage)
+                task.cases.append(case)
+            if task.status == 0:
+                task.score = self.problem.test_case.tasks[i].task_score
+                score += task.score
+            for k in total:
+                total[k] = max(total[k], task[k])
+            results.append(task)
+        fields = {'score': score, 'tasks': results, **total}
+        if packer.size:
+            self.save_output_pack()
+        else:
+            fields['output_pack'] = None
+        # update and refresh in one round trip
+        self.modify(**fields)
         self.finish_judging()
-        for has_code, has_output, has_code_detail in itertools.product(
-            [True, False], repeat=3):
-            # iterate through True and False
-            key = f'{self.id}_{has_code}_{has_output}_{has_code_detail}'
-            RedisCache().delete(key)
+        JudgeQueue().mark_finished(self.id)
         return True
 
     def finish_judging(self):
-        # update user's submission
-        User(self.username).add_submission(self.reload())
-        # update homework data
-        for homework in self.problem.homeworks:
-            # if the homework is overdue, do the penalty
-            stat = homework.student_status[self.username][str(self.problem_id)]
-            if self.timestamp > homework.duration.end:
-                if homework.penalty is None:
-                    continue
-                if self.handwritten:
-                    continue
-                if 'rawScore' not in stat:
-                        stat['rawScore'] = stat['score']
-                score = self.score - stat['rawScore']
-                if score >0:
-                    overtime = int((timestamp-homework.duration.end)/86400)
-                    exec(homework.penalty)
-                    stat['score']+=score
-                    stat['rawScore'] = self.score
-                continue
-            stat['submissionIds'].append(self.id)
-            # handwritten problem will only keep the last submission
-            if self.handwritten:
-                stat['submissionIds'] = stat['submissionIds'][-1:]
-            # update high score / handwritten problem is judged by teacher
-            if self.score >= stat['score'] or self.handwritten:
-                stat['score'] = self.score
-                stat['problemStatus'] = self.status
-            homework.save()
-        key = Problem(self.problem).high_score_key(user=self.user)
-        RedisCache().delete(key)
+        '''
+        update user, homework and cache after the submission's result is
+        set. the submission should be up to date before calling this.
+        '''
+        User(self.username).add_submission(self)
+        Scoreboard.record(self)
+        requests = [
+            *itertools.chain.from_iterable(
+                itertools.starmap(
+                    self.homework_status_updates,
+                    self.homework_status(),
+                ))
+        ]
+        if requests:
+            engine.HomeworkStatus._get_collection().bulk_write(
+                requests,
+                ordered=False,
+            )
+        keys = [
+            f'{self.id}_{has_code}_{has_output}_{has_code_detail}'
+            for has_code, has_output, has_code_detail in itertools.product(
+                [True, False], repeat=3)
+        ]
+        keys.append(Problem(self.problem_id).high_score_key(user=self.user))
+        RedisCache().delete(*keys)
+        invalidate_submission_lists([self.problem_id], [self.username])
+
+    def homework_status(self):
+        '''
+        yield (homework, status) of homeworks contain this problem and the
+        user is one of its students. only fields needed to update the
+        status are loaded, status is None if the user never submitted.
+        '''
+        homeworks = [
+            *engine.Homework._get_collection().find(
+                {'problemIds': self.problem_id},
+                {
+                    'courseId': 1,
+                    'duration.end': 1,
+                    'penalty': 1,
+                },
+            )
+        ]
+        if not homeworks:
+            return
+        courses = {
+            str(course['_id'])
+            for course in engine.Course._get_collection().find(
+                {
+                    '_id': {
+                        '$in': [ObjectId(hw['courseId']) for hw in homeworks]
+                    },
+                    f'studentNicknames.{self.username}': {
+                        '$exists': True
+                    },
+                },
+                {'_id': 1},
+            )
+        }
+        homeworks = [hw for hw in homeworks if hw['courseId'] in courses]
+        status = {
+            stat['homework']: stat
+            for stat in engine.HomeworkStatus._get_collection().find(
+                {
+                    'homework': {
+                        '$in': [hw['_id'] for hw in homeworks]
+                    },
+                    'user': self.username,
+                    'problemId': self.problem_id,
+                })
+        }
+        for homework in homeworks:
+            yield homework, status.get(homework['_id'])
+
+    def homework_status_updates(
+        self,
+        homework: Dict[str, Any],
+        stat: Optional[Dict[str, Any]],
+    ) -> List[UpdateOne]:
+        '''
+        get write operations to update user's status of a homework
+
+        Args:
+            homework, stat: raw documents yielded from `homework_status`
+        '''
+        key = {
+            'homework': homework['_id'],
+            'user': self.username,
+            'problemId': self.problem_id,
+        }
+        end = homework.get('duration', {}).get('end')
+        # if the homework is overdue, do the penalty
+        if end is not None and self.timestamp > end:
+            penalty = homework.get('penalty')
+            if penalty is None or self.handwritten:
+                return []
+            old_score = stat['score'] if stat else 0
+            raw_score = (stat or {}).get('rawScore')
+            if raw_score is None:
+                raw_score = old_score
+            score = self.score - raw_score
+            if score <= 0:
+                return []
+            overtime = int((self.timestamp - end).total_seconds() // 86400)
+            ns = {'score': score, 'overtime': overtime}
+            exec(penalty, {'__builtins__': {}}, ns)
+            update = {
+                '$inc': {
+                    'score': ns['score']
+                },
+                '$set': {
+                    'rawScore': self.score
+                },
+            }
+            if stat is None:
+                return [UpdateOne(key, update, upsert=True)]
+            # only apply if no one else changed the score
+            return [UpdateOne({**key, 'score': old_score}, update)]
+        # handwritten problem will only keep the last submission
+        # and is judged by teacher
+        if self.handwritten:
+            return [
+                UpdateOne(
+                    key,
+                    {
+                        '$set': {
+                            'submissionIds': [self.id],
+                            'score': self.score,
+                            'problemStatus': self.status,
+                        }
+                    },
+                    upsert=True,
+                )
+            ]
+        return [
+            UpdateOne(
+                key,
+                {
+                    '$push': {
+                        'submissionIds': self.id
+                    },
+                    '$setOnInsert': {
+                        'score': self.score,
+                        'problemStatus': self.status,
+                    },
+                },
+                upsert=True,
+            ),
+            # update high score
+            UpdateOne(
+                {
+                    **key,
+                    'score': {
+                        '$lte': self.score
+                    },
+                },
+                {
+                    '$set': {
+                        'score': self.score,
+                        'problemStatus': self.status,
+                    }
+                },
+            ),
+        ]
 
     def add_comment(self, file):
         '''
@@ -520,7 +892,16 @@ class Submission(MongoBase, engine=engine.Submission):
         after: Optional[datetime] = None,
         sort_by: Optional[str] = None,
         with_count: bool = False,
+        cursor: Optional[str] = None,
+        fields: Optional[Iterable[str]] = None,
     ):
+        '''
+        Args:
+            cursor: continue after the submission it points to, see
+                `encode_cursor`, only for results sorted by time
+            fields: only load these fields and return raw documents
+                instead of `Submission`s
+        '''
         if before is not None and after is not None:
             if after > before:
                 raise ValueError('the query period is empty')
@@ -530,6 +911,8 @@ class Submission(MongoBase, engine=engine.Submission):
             raise ValueError(f'count must >=-1!')
         if sort_by is not None and sort_by not in ['runTime', 'memoryUsage']:
             raise ValueError(f'can only sort by runTime or memoryUsage')
+        if sort_by is not None and cursor is not None:
+            raise ValueError('cursor can only be used when sorting by time')
         wont_have_results = False
         if isinstance(problem, int):
             problem = Problem(problem).obj
@@ -575,20 +958,74 @@ class Submission(MongoBase, engine=engine.Submission):
             'timestamp__gte': after,
         }
         q = {k: v for k, v in q.items() if v is not None}
-        # sort by upload time
-        submissions = engine.Submission.objects(
-            **q).order_by(sort_by if sort_by is not None else '-timestamp')
-        submission_count = submissions.count()
+        submissions = engine.Submission.objects(**q)
+        submission_count = submissions.count() if with_count else None
+        if sort_by is not None:
+            submissions = submissions.order_by(sort_by)
+        else:
+            # sort by upload time, id breaks ties for cursors
+            submissions = submissions.order_by('-timestamp', '-id')
+        if cursor is not None:
+            timestamp, _id = cls.decode_cursor(cursor)
+            submissions = submissions.filter(
+                Q(timestamp__lt=timestamp)
+                | Q(timestamp=timestamp, id__lt=_id))
+        if fields is not None:
+            submissions = submissions.only(*fields).as_pymongo()
         # truncate
         if count == -1:
             submissions = submissions[offset:]
         else:
             submissions = submissions[offset:offset + count]
-        submissions = list(cls(s) for s in submissions)
+        if fields is not None:
+            submissions = [*submissions]
+        else:
+            submissions = list(cls(s) for s in submissions)
         if with_count:
             return submissions, submission_count
         return submissions
 
+    @staticmethod
+    def list_version(
+        user,
+        problem_id: Optional[int] = None,
+        username: Optional[str] = None,
+        course: Optional[str] = None,
+    ) -> str:
+        '''
+        version of the submission list filtered by these args, it changes
+        whenever the list might change, see `invalidate_submission_lists`
+        '''
+        scopes = []
+        if username is not None:
+            scopes.append(f'USER_{username}')
+        if problem_id is not None:
+            scopes.append(f'PROBLEM_{problem_id}')
+        # problems of a course depend on what the user can view
+        if course is not None or not scopes:
+            scopes.append('ALL')
+        keys = [SUBMISSION_LIST_VERSION_KEY.format(scope=s) for s in scopes]
+        if course is not None:
+            keys.append(COURSE_ROLES_VERSION_KEY.format(user=user.username))
+        versions = RedisCache().client.mget(keys)
+        return '.'.join(str(int(v or 0)) for v in versions)
+
+    @staticmethod
+    def encode_cursor(timestamp: datetime, _id) -> str:
+        '''
+        an opaque token points to the submission in the list sorted by time
+        '''
+        token = json.dumps([timestamp.isoformat(), str(_id)])
+        return base64.urlsafe_b64encode(token.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+        try:
+            timestamp, _id = json.loads(base64.urlsafe_b64decode(cursor))
+            return datetime.fromisoformat(timestamp), ObjectId(_id)
+        except (ValueError, TypeError, binascii.Error, InvalidId):
+            raise ValueError('invalid cursor')
+
     @classmethod
     def add(
         cls,
@@ -622,6 +1059,7 @@ class Submission(MongoBase, engine=engine.Submission):
             timestamp=timestamp,
         )
         submission.save()
+        invalidate_submission_lists([problem_id], [username])
         return cls(submission.id)
 
     @classmethod
@@ -648,59 +1086,81 @@ class Submission(MongoBase, engine=engine.Submission):
         return valid
 
     def to_dict(self) -> Dict[str, Any]:
-        ret = self._to_dict()
-        # Convert Bson object to python dictionary
-        ret = ret.to_dict()
-        return ret
+        return self.serialize(self.to_mongo(), UserInfo.get(self.username))
 
-    def _to_dict(self) -> SON:
-        ret = self.to_mongo()
-        _ret = {
-            'problemId': ret['problem'],
-            'user': self.user.info,
-            'submissionId': str(self.id),
-            'timestamp': self.timestamp.timestamp(),
-            'lastSend': self.last_send.timestamp(),
-        }
-        old = [
-            '_id',
-            'problem',
-            'code',
-            'comment',
-            'tasks',
-        ]
-        # delete old keys
-        for o in old:
-            del ret[o]
-        # insert new keys
-        ret.update(**_ret)
+    @classmethod
+    def serialize(
+        cls,
+        doc: Dict[str, Any],
+        user_info: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        '''
+        build the dict of a submission from the raw document, only fields
+        in `LIST_FIELDS` are needed
+        '''
+        ret = {}
+        for name in cls.LIST_FIELDS:
+            field = engine.Submission._fields[name]
+            default = field.default() if callable(
+                field.default) else field.default
+            ret[field.db_field] = doc.get(field.db_field, default)
+        ret.update(
+            problemId=ret.pop('problem'),
+            user=user_info,
+            submissionId=str(doc['_id']),
+            timestamp=ret['timestamp'].timestamp(),
+            lastSend=ret['lastSend'].timestamp(),
+        )
         return ret
 
+    @classmethod
+    def to_dicts(cls, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        '''
+        serialize raw documents returned by `filter` with `LIST_FIELDS`,
+        their users are loaded at once
+        '''
+        infos = UserInfo.get_many(doc['user'] for doc in docs)
+        return [cls.serialize(doc, infos[doc['user']]) for doc in docs]
+
     def get_result(self) -> List[Dict[str, Any]]:
         '''
         Get results without output
         '''
+        output_keys = (
+            'output',
+            'stdout',
+            'stderr',
+            'outputOffset',
+            'stdoutSize',
+            'stderrSize',
+        )
         tasks = [task.to_mongo() for task in self.tasks]
         for task in tasks:
             for case in task['cases']:
-                del case['output']
+                for k in output_keys:
+                    case.pop(k, None)
         return [task.to_dict() for task in tasks]
 
     def get_detailed_result(self) -> List[Dict[str, Any]]:
         '''
         Get all results (including stdout/stderr) of this submission
         '''
-        tasks = [task.to_mongo() for task in self.tasks]
-        for task in tasks:
-            for case in task.cases:
-                # extract zip file
-                output = case.pop('output', None)
+        # read the whole pack once
+        pack = None
+        if self.output_pack.grid_id is not None:
+            fp = self.output_pack.get()
+            fp.seek(0)
+            pack = fp.read()
+        tasks = self.get_result()
+        for task, _task in zip(tasks, self.tasks):
+            for case, _case in zip(task['cases'], _task.cases):
+                output = self.read_output(_case, pack)
                 if output is not None:
-                    output = engine.GridFSProxy(output)
-                    with ZipFile(output) as zf:
-                        case['stdout'] = zf.read('stdout').decode('utf-8')
-                        case['stderr'] = zf.read('stderr').decode('utf-8')
-        return [task.to_dict() for task in tasks]
+                    case.update({
+                        k: v.decode('utf-8', 'replace')
+                        for k, v in output.items()
+                    })
+        return tasks
 
     def get_code(self, path: str, binary=False) -> Union[str, bytes]:
         # read file
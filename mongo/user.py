@@ -5,12 +5,18 @@ from typing import Any, Dict, List, TYPE_CHECKING, Optional
 
 from . import engine, course
 from .utils import *
+from .utils import SESSION_VERSION_KEY
 from .base import *
+from .loader import ref_id
+from .ranking import Ranking
+from bson import ObjectId
 
 import hashlib
+import json
 import jwt
 import os
 import re
+import time
 
 if TYPE_CHECKING:
     from .course import Course
@@ -20,9 +26,20 @@ __all__ = ['User', 'jwt_decode']
 JWT_EXP = timedelta(days=int(os.environ.get('JWT_EXP', '30')))
 JWT_ISS = os.environ.get('JWT_ISS', 'test.test')
 JWT_SECRET = os.environ.get('JWT_SECRET', 'SuperSecretString')
+# auth info of a session token, keyed by the token's digest
+SESSION_KEY = 'SESSION_{digest}'
+SESSION_TTL = int(os.environ.get('SESSION_TTL', '300'))
 
 
 class User(MongoBase, engine=engine.User):
+    # fields kept in sessions, enough to authorize a request
+    SESSION_FIELDS = ('username', 'user_id', 'active', 'role')
+    # references kept in sessions by id, they're read by `ref_id` to
+    # decide permissions
+    SESSION_REFS = ('contest', )
+    # fields `engine.User.info` is built from
+    INFO_FIELDS = ('profile', 'email', 'md5', 'role')
+
     @classmethod
     def signup(cls, username, password, email):
         if re.match(r'^[a-zA-Z0-9_\-]+$', username) is None:
@@ -38,7 +55,9 @@ class User(MongoBase, engine=engine.User):
             md5=hashlib.md5(email.encode()).hexdigest(),
             active=False,
         ).save(force_insert=True)
-        return user.reload()
+        user.reload()
+        Ranking.update(user.obj)
+        return user
 
     @classmethod
     def batch_signup(
@@ -115,6 +134,94 @@ class User(MongoBase, engine=engine.User):
         obj = cls.engine.objects.get(email=email.lower())
         return cls(obj)
 
+    @classmethod
+    def session(cls, token: str) -> Optional[Dict[str, Any]]:
+        '''
+        auth info of a `piann` token, cached until the token expires, the
+        user's sessions are invalidated or `SESSION_TTL` passed
+
+        Returns:
+            `SESSION_FIELDS` of the user and `token_user_id`, the user id
+            the token was signed with. `None` if the token is invalid
+        '''
+        client = RedisCache().client
+        digest = hashlib.sha256(token.encode()).hexdigest()
+        key = SESSION_KEY.format(digest=digest)
+        if (cached := client.get(key)) is not None:
+            session = json.loads(cached)
+            version = client.get(
+                SESSION_VERSION_KEY.format(user=session['username']))
+            # sessions cached before a field is added are reloaded
+            if session['version'] == int(version or 0) and all(
+                    k in session for k in cls.SESSION_REFS):
+                return session
+        payload = jwt_decode(token)
+        if payload is None or not payload.get('secret'):
+            return None
+        username = payload['data']['username']
+        # read the version before loading, changes after it will be seen
+        version = client.get(SESSION_VERSION_KEY.format(user=username))
+        user = cls(username)
+        refs = {k: ref_id(user, k) for k in cls.SESSION_REFS}
+        session = {
+            **{k: getattr(user, k)
+               for k in cls.SESSION_FIELDS},
+            **{k: _id and str(_id)
+               for k, _id in refs.items()},
+            'username': username,
+            'token_user_id': payload['data'].get('userId'),
+            'version': int(version or 0),
+        }
+        # don't keep it after the token expires
+        ttl = min(SESSION_TTL, int(payload['exp'] - time.time()))
+        if ttl > 0:
+            client.set(key, json.dumps(session), ex=ttl)
+        return session
+
+    @classmethod
+    def from_session(cls, session: Dict[str, Any]) -> 'User':
+        '''
+        a user whose document is loaded only when fields not in the
+        session are accessed
+        '''
+        if (user := cls._recall(session['username'])) is not None:
+            return user
+        user = object.__new__(cls)
+        user._session = {k: session[k] for k in cls.SESSION_FIELDS}
+        user._session['role'] = cls.engine.Role(session['role'])
+        # enough for `ref_id`, other fields load the document
+        user._session['_data'] = {
+            k: session[k] and ObjectId(session[k])
+            for k in cls.SESSION_REFS
+        }
+        user._exists = True
+        user._remember(session['username'])
+        return user
+
+    def __getattr__(self, name):
+        session = self.__dict__.get('_session')
+        if session is not None:
+            if name in session:
+                return session[name]
+            if name == 'pk':
+                return session['username']
+            if name == 'obj':
+                self._session = None
+                self.obj = self.engine(username=session['username'])
+                self.reload()
+                return self.obj
+        return super().__getattr__(name)
+
+    def update(self, *args, **ks):
+        ret = super().update(*args, **ks)
+        # e.g. `role`, `set__role` or `profile__bio`
+        fields = {k for key in ks for k in key.split('__')}
+        if fields & {*self.SESSION_FIELDS, *self.SESSION_REFS}:
+            invalidate_sessions(self.username)
+        if fields & {*self.INFO_FIELDS}:
+            invalidate_user_infos(self.username)
+        return ret
+
     @property
     def displayedName(self):
         return self.profile.displayed_name
@@ -212,13 +319,15 @@ class User(MongoBase, engine=engine.User):
         return self.reload()
 
     def add_submission(self, submission: engine.Submission):
+        ks = {'inc__submission': 1}
         if submission.score == 100:
-            self.update(
+            ks.update(
                 add_to_set__AC_problem_ids=submission.problem_id,
                 inc__AC_submission=1,
             )
-        self.submission += 1
-        self.save()
+        # update and refresh the counters in one round trip
+        self.obj.modify(**ks)
+        Ranking.update(self.obj)
 
 
 def jwt_decode(token):
@@ -1,15 +1,26 @@
 import abc
 import hashlib
+import json
 import os
 import redis
 from functools import wraps
 from typing import Dict, Optional, Any
+from bson import ObjectId
+from mongoengine import Q
 from . import engine
+from .loader import ref_id, ref_ids
 
 __all__ = (
     'hash_id',
     'perm',
     'can_view_problem',
+    'course_roles',
+    'invalidate_course_roles',
+    'invalidate_problem_access',
+    'invalidate_submission_lists',
+    'invalidate_sessions',
+    'invalidate_user_infos',
+    'viewable_problems',
     'RedisCache',
     'doc_required',
 )
@@ -21,33 +32,201 @@ def hash_id(salt, text):
     return sha.hexdigest()[:24]
 
 
+# per-user version of cached course roles, bumped on membership changes
+COURSE_ROLES_VERSION_KEY = 'COURSE_ROLES_VERSION_{user}'
+COURSE_ROLES_KEY = 'COURSE_ROLES_{user}_{version}'
+COURSE_ROLES_TTL = int(os.getenv('COURSE_ROLES_TTL', '86400'))
+# bumped when who can view a problem changes
+PROBLEM_VERSION_KEY = 'PROBLEM_VERSION_{problem}'
+# per-user version of cached sessions, bumped when the auth info changes
+SESSION_VERSION_KEY = 'SESSION_VERSION_{user}'
+# `engine.User.info` of a user, see `loader.UserInfo`
+USER_INFO_KEY = 'USER_INFO_{user}'
+USER_INFO_TTL = int(os.getenv('USER_INFO_TTL', '86400'))
+# versions of submission lists, the scope is `ALL`, `USER_{username}` or
+# `PROBLEM_{problem id}`
+SUBMISSION_LIST_VERSION_KEY = 'SUBMISSION_LIST_VERSION_{scope}'
+
+
 def perm(course, user):
     '''4: admin, 3: teacher, 2: TA, 1: student, 0: not found
     '''
-    return 4 - [
-        user.role == 0, user == course.teacher, user in course.tas,
-        user.username in course.student_nicknames.keys(), True
-    ].index(True)
+    if user.role == 0:
+        return 4
+    return course_roles(user).get(str(course.id), 0)
 
 
 def can_view_problem(user, problem):
     '''cheeck if a user can view the problem'''
     if user.role == 0:
         return True
-    if user.contest:
-        if user.contest in problem.contests:
-            return True
-        return False
+    if (contest := ref_id(user, 'contest')):
+        return contest in ref_ids(problem, 'contests')
     if user.username == problem.owner:
         return True
-    for course in problem.courses:
-        permission = 1 if course.course_name == 'Public' else perm(
-            course, user)
+    roles = _course_roles(user.username)
+    for course in map(str, ref_ids(problem, 'courses')):
+        if course == roles['public']:
+            permission = 1
+        else:
+            permission = roles['roles'].get(course, 0)
         if permission and (problem.problem_status == 0 or permission >= 2):
             return True
     return False
 
 
+def _course_roles(username: str) -> Dict[str, Any]:
+    '''
+    roles of a user in the courses joined and the id of the public course,
+    cached until `invalidate_course_roles` is called with the user
+    '''
+    client = RedisCache().client
+    version = client.get(COURSE_ROLES_VERSION_KEY.format(user=username))
+    key = COURSE_ROLES_KEY.format(user=username, version=int(version or 0))
+    if (cached := client.get(key)) is not None:
+        return json.loads(cached)
+    docs = engine.Course._get_collection().find(
+        {
+            '$or': [
+                {
+                    'courseName': 'Public'
+                },
+                {
+                    'teacher': username
+                },
+                {
+                    'tas': username
+                },
+                {
+                    f'studentNicknames.{username}': {
+                        '$exists': True
+                    }
+                },
+            ]
+        },
+        {
+            'courseName': 1,
+            'teacher': 1,
+            'tas': 1,
+            f'studentNicknames.{username}': 1,
+        },
+    )
+    ret = {'roles': {}, 'public': None}
+    for doc in docs:
+        if doc.get('courseName') == 'Public':
+            ret['public'] = str(doc['_id'])
+        if doc.get('teacher') == username:
+            role = 3
+        elif username in doc.get('tas', []):
+            role = 2
+        elif username in doc.get('studentNicknames', {}):
+            role = 1
+        else:
+            continue
+        ret['roles'][str(doc['_id'])] = role
+    client.set(key, json.dumps(ret), ex=COURSE_ROLES_TTL)
+    return ret
+
+
+def course_roles(user) -> Dict[str, int]:
+    '''
+    roles of a user in the courses joined, maps course id to the value
+    `perm` returns (3: teacher, 2: TA, 1: student)
+    '''
+    return _course_roles(user.username)['roles']
+
+
+def invalidate_course_roles(*usernames: str):
+    '''
+    call it after users join or leave courses, or their roles are changed
+    '''
+    if not usernames:
+        return
+    pipe = RedisCache().client.pipeline()
+    for username in {*usernames}:
+        pipe.incr(COURSE_ROLES_VERSION_KEY.format(user=username))
+    pipe.execute()
+
+
+def invalidate_sessions(*usernames: str):
+    '''
+    call it after users' passwords, roles or active states are changed,
+    or they are removed
+    '''
+    if not usernames:
+        return
+    pipe = RedisCache().client.pipeline()
+    for username in {*usernames}:
+        pipe.incr(SESSION_VERSION_KEY.format(user=username))
+    pipe.execute()
+
+
+def invalidate_user_infos(*usernames: str):
+    '''
+    call it after users' profiles, emails or roles are changed, or they
+    are removed
+    '''
+    if not usernames:
+        return
+    RedisCache().delete(*(USER_INFO_KEY.format(user=u) for u in usernames))
+
+
+def invalidate_problem_access(*problem_ids: int):
+    '''
+    call it after problems' courses, contests, owner or status are changed
+    '''
+    if not problem_ids:
+        return
+    pipe = RedisCache().client.pipeline()
+    for problem_id in {*problem_ids}:
+        pipe.incr(PROBLEM_VERSION_KEY.format(problem=problem_id))
+    # lists filtered by course depend on problems' courses and status
+    pipe.incr(SUBMISSION_LIST_VERSION_KEY.format(scope='ALL'))
+    pipe.execute()
+
+
+def invalidate_submission_lists(problem_ids=(), usernames=()):
+    '''
+    call it after submissions of these problems or users are created,
+    removed, or their results are changed
+    '''
+    scopes = {
+        'ALL',
+        *(f'PROBLEM_{problem_id}' for problem_id in problem_ids),
+        *(f'USER_{username}' for username in usernames),
+    }
+    pipe = RedisCache().client.pipeline()
+    for scope in scopes:
+        pipe.incr(SUBMISSION_LIST_VERSION_KEY.format(scope=scope))
+    pipe.execute()
+
+
+def viewable_problems(user) -> Optional[Q]:
+    '''
+    query of problems `can_view_problem` allows the user to view, `None`
+    if all of them are allowed
+    '''
+    if user.role == 0:
+        return None
+    # don't load the contest, only its id is needed
+    contest = ref_id(user, 'contest')
+    if contest:
+        return Q(contests=contest)
+    roles = _course_roles(user.username)
+    public = roles['public']
+    # everyone is a student of the public course
+    staff = [
+        ObjectId(c) for c, role in roles['roles'].items()
+        if role >= 2 and c != public
+    ]
+    students = [ObjectId(c) for c, role in roles['roles'].items() if role == 1]
+    if public is not None:
+        students.append(ObjectId(public))
+    return (Q(owner=user.username)
+            | Q(courses__in=staff)
+            | Q(courses__in=students, problem_status=0))
+
+
 class Cache(abc.ABC):
     @abc.abstractmethod
     def exists(self, key: str) -> bool:
@@ -71,15 +250,17 @@ class Cache(abc.ABC):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def delete(self, key: str):
+    def delete(self, *keys: str):
         '''
-        delete a value by key
+        delete values by keys
         '''
         raise NotImplementedError
 
 
 class RedisCache(Cache):
     POOL = None
+    # in-process stand-in shared by every instance if no redis is configured
+    FAKE_SERVER = None
 
     def __new__(cls) -> Any:
         if cls.POOL is None:
@@ -101,7 +282,10 @@ class RedisCache(Cache):
         if self._client is None:
             if self.PORT is None:
                 import fakeredis
-                self._client = fakeredis.FakeStrictRedis()
+                if RedisCache.FAKE_SERVER is None:
+                    RedisCache.FAKE_SERVER = fakeredis.FakeServer()
+                self._client = fakeredis.FakeStrictRedis(
+                    server=RedisCache.FAKE_SERVER)
             else:
                 self._client = redis.Redis(connection_pool=self.POOL)
         return self._client
@@ -112,8 +296,8 @@ class RedisCache(Cache):
     def get(self, key: str):
         return self.client.get(key)
 
-    def delete(self, key: str):
-        return self.client.delete(key)
+    def delete(self, *keys: str):
+        return self.client.delete(*keys)
 
     def set(self, key: str, value, ex: Optional[int] = None):
         return self.client.set(key, value, ex=ex)
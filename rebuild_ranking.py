@@ -0,0 +1,35 @@
+'''
+rebuild the global ranking from users to correct drifts of the one
+updated incrementally. run it once, or periodically with `--interval`:
+
+    python rebuild_ranking.py --interval 3600
+
+it reads the same environment variables as the web server
+(MONGO_HOST, REDIS_HOST, REDIS_PORT, ...).
+'''
+
+import time
+import logging
+import argparse
+from mongo.ranking import Ranking
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=0,
+        help='seconds between rebuilds, 0 to rebuild once',
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+    )
+    while True:
+        start = time.time()
+        cnt = Ranking().rebuild()
+        logging.info(f'{cnt} users ranked in {time.time() - start:.2f}s')
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,164 @@
+'''
+simulate a contest burst and compare sandbox scheduling policies.
+needs dev requirements (fakeredis), it doesn't touch the real redis:
+
+    python scheduler_benchmark.py --submissions 2000 --rate 8
+
+each sandbox judges `capacity` submissions concurrently, a submission
+takes longer if its problem's testdata is not cached on that sandbox.
+the queueing delay is the time between sending a submission and a
+sandbox start judging it.
+'''
+
+import heapq
+import random
+import argparse
+import statistics
+from collections import OrderedDict
+
+import fakeredis
+
+from mongo import engine
+from mongo.sandbox import SandboxRegistry, SCHEDULERS
+
+
+class SimSandbox:
+    def __init__(self, sandbox, cache_size):
+        self.sandbox = sandbox
+        # finish time of each worker
+        self.workers = [0.0] * sandbox.capacity
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def load(self, now):
+        busy = sum(t > now for t in self.workers)
+        return busy / len(self.workers)
+
+    def run(self, now, problem_id, exec_time, cold_penalty):
+        '''
+        queue a submission, return (start time, finish time, cold)
+        '''
+        i = min(range(len(self.workers)), key=self.workers.__getitem__)
+        start = max(now, self.workers[i])
+        cold = problem_id not in self.cache
+        if cold:
+            exec_time += cold_penalty
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+            self.cache[problem_id] = True
+        else:
+            self.cache.move_to_end(problem_id)
+        self.workers[i] = start + exec_time
+        return start, self.workers[i], cold
+
+
+def workload(args):
+    rnd = random.Random(args.seed)
+    # zipf-ish popularity, a few problems get most of the submissions
+    weights = [1 / (i + 1) for i in range(args.problems)]
+    now = 0.0
+    for _ in range(args.submissions):
+        now += rnd.expovariate(args.rate)
+        yield (
+            now,
+            rnd.choices(range(args.problems), weights)[0],
+            rnd.expovariate(1 / args.exec_time),
+        )
+
+
+def simulate(policy, sandboxes, args):
+    registry = SandboxRegistry()
+    registry.client = fakeredis.FakeStrictRedis()
+    scheduler = SCHEDULERS[policy](registry)
+    sims = {sb.name: SimSandbox(sb, args.cache_size) for sb in sandboxes}
+    finishing = []
+    delays = []
+    colds = 0
+    next_poll = 0.0
+    for i, (now, problem_id, exec_time) in enumerate(workload(args)):
+        # results sent back by sandboxes
+        while finishing and finishing[0][0] <= now:
+            _, submission_id = heapq.heappop(finishing)
+            registry.release(submission_id)
+        # status polled by dispatcher
+        while next_poll <= now:
+            for name, sim in sims.items():
+                registry.report(name, sim.load(next_poll), now=next_poll)
+            next_poll += args.poll_interval
+        sb = scheduler.pick(sandboxes, problem_id, now=now)
+        registry.acquire(sb.name, i)
+        start, end, cold = sims[sb.name].run(
+            now,
+            problem_id,
+            exec_time,
+            args.cold_penalty,
+        )
+        heapq.heappush(finishing, (end, i))
+        delays.append(start - now)
+        colds += cold
+    delays.sort()
+    return {
+        'mean': statistics.mean(delays),
+        'p50': delays[len(delays) // 2],
+        'p95': delays[int(len(delays) * 0.95)],
+        'max': delays[-1],
+        'cold': colds / len(delays),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--submissions', type=int, default=2000)
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=6,
+        help='submissions per second',
+    )
+    parser.add_argument('--problems', type=int, default=12)
+    parser.add_argument(
+        '--capacity',
+        type=int,
+        nargs='+',
+        default=[4, 2, 2, 1],
+        help='capacity of each sandbox',
+    )
+    parser.add_argument(
+        '--exec-time',
+        type=float,
+        default=0.8,
+        help='mean judging time in seconds',
+    )
+    parser.add_argument(
+        '--cold-penalty',
+        type=float,
+        default=0.4,
+        help='extra seconds to load uncached testdata',
+    )
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=4,
+        help='testdata cached by each sandbox',
+    )
+    parser.add_argument('--poll-interval', type=float, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    sandboxes = [
+        engine.Sandbox(
+            name=f'sandbox-{i}',
+            url=f'http://sandbox-{i}',
+            token=str(i),
+            capacity=c,
+        ) for i, c in enumerate(args.capacity)
+    ]
+    print(f'{"policy":<22}{"mean":>9}{"p50":>9}{"p95":>9}{"max":>9}'
+          f'{"cold":>8}')
+    for policy in SCHEDULERS:
+        r = simulate(policy, sandboxes, args)
+        print(f'{policy:<22}{r["mean"]:>8.2f}s{r["p50"]:>8.2f}s'
+              f'{r["p95"]:>8.2f}s{r["max"]:>8.2f}s{r["cold"]:>8.1%}')
+
+
+if __name__ == '__main__':
+    main()
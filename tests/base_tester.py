@@ -1,6 +1,7 @@
 import secrets
 from mongoengine import connect
 from mongo import *
+from mongo.utils import RedisCache
 from .conftest import *
 
 
@@ -30,6 +31,7 @@ class BaseTester:
     def drop_db(cls):
         conn = connect(cls.DB, host=cls.MONGO_HOST)
         conn.drop_database(cls.DB)
+        RedisCache().client.flushdb()
 
     @classmethod
     def setup_class(cls):
@@ -0,0 +1,187 @@
+import time
+import pytest
+from mongo import *
+from mongo import engine
+from mongo.utils import RedisCache
+from migrations import drop_user_submissions
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+def judge(submission, status='AC', stdout=''):
+    case = {
+        'exitCode': 0,
+        'status': status,
+        'stdout': stdout,
+        'stderr': '',
+        'execTime': 10,
+        'memoryUsage': 10,
+    }
+    tasks = [[case.copy() for _ in range(task.case_count)]
+             for task in submission.problem.test_case.tasks]
+    submission.process_result(tasks)
+
+
+@pytest.fixture
+def context(app):
+    with app.app_context():
+        student = utils.user.create_user()
+        course = utils.course.create_course(students=[student])
+        problem = utils.problem.create_problem(
+            course=course,
+            tasks=[{
+                'task_score': 100,
+                'case_count': 1
+            }],
+        )
+        yield {
+            'student': student,
+            'course': course,
+            'problem': problem,
+        }
+
+
+def add_homework(context, **ks):
+    course = context['course']
+    return Homework.add(
+        user=course.teacher,
+        course_name=course.course_name,
+        hw_name='hw',
+        problem_ids=[context['problem'].id],
+        start=1,
+        **ks,
+    )
+
+
+def status_of(homework, context):
+    student = context['student'].username
+    status = Homework(homework).get_student_status([student])
+    return status[student][str(context['problem'].id)]
+
+
+def submit(context, **ks):
+    return utils.submission.create_submission(
+        user=context['student'],
+        problem=context['problem'],
+        status=-1,
+        **ks,
+    )
+
+
+def test_update_user_and_homework(context):
+    homework = add_homework(context)
+    wa = submit(context)
+    judge(wa, 'WA')
+    ac = submit(context)
+    judge(ac)
+    # a lower score should not overwrite the high score
+    judge(submit(context), 'WA')
+    stat = status_of(homework, context)
+    assert stat['score'] == 100
+    assert stat['problemStatus'] == 0
+    assert stat['submissionIds'][:2] == [wa.id, ac.id]
+    assert len(stat['submissionIds']) == 3
+    user = context['student'].reload()
+    assert user.submission == 3
+    assert user.AC_submission == 1
+    assert user.AC_problem_ids == [context['problem'].id]
+
+
+def test_overdue_submission_is_penalized(context):
+    homework = add_homework(
+        context,
+        end=time.time() - 86400 * 2 - 60,
+        penalty='score=score*(0.5**overtime)',
+    )
+    submission = submit(context)
+    judge(submission)
+    stat = status_of(homework, context)
+    assert stat['score'] == 25
+    assert stat['rawScore'] == 100
+    # overdue submissions are not recorded
+    assert stat['submissionIds'] == []
+
+
+def test_overdue_without_penalty(context):
+    homework = add_homework(context, end=time.time() - 60)
+    judge(submit(context))
+    assert status_of(homework, context)['score'] == 0
+
+
+def test_cache_is_cleared(context):
+    submission = submit(context)
+    cache = RedisCache()
+    key = f'{submission.id}_True_False_True'
+    high_score = context['problem'].high_score_key(user=context['student'].obj)
+    cache.set(key, 'stale')
+    cache.set(high_score, 0)
+    judge(submission)
+    assert not cache.exists(key)
+    assert not cache.exists(high_score)
+
+
+def test_drop_legacy_user_submissions(context):
+    student = context['student']
+    submission = utils.submission.create_submission(
+        user=student,
+        problem=context['problem'],
+    )
+    collection = engine.User._get_collection()
+    collection.update_one(
+        {'_id': student.username},
+        {'$set': {
+            'submissions': [submission.id]
+        }},
+    )
+    # legacy users can still be loaded
+    assert User(student.username).reload().username == student.username
+    assert drop_user_submissions.migrate(dry_run=True) == 1
+    assert drop_user_submissions.migrate() == 1
+    assert drop_user_submissions.migrate() == 0
+    assert 'submissions' not in collection.find_one({'_id': student.username})
+
+
+def test_tasks_are_scored_separately(context):
+    problem = utils.problem.create_problem(
+        course=context['course'],
+        tasks=[{
+            'task_score': score,
+            'case_count': 1
+        } for score in (40, 60)],
+    )
+    submission = utils.submission.create_submission(
+        user=context['student'],
+        problem=problem,
+        status=-1,
+    )
+    case = {
+        'exitCode': 0,
+        'stdout': '',
+        'stderr': '',
+        'execTime': 10,
+        'memoryUsage': 10,
+    }
+    # the failed task comes first, it shouldn't affect the later one
+    submission.process_result([
+        [{
+            **case, 'status': 'WA'
+        }],
+        [{
+            **case, 'status': 'AC',
+            'execTime': 20
+        }],
+    ])
+    submission.reload()
+    assert submission.score == 60
+    assert submission.status == 1
+    assert [t.status for t in submission.tasks] == [1, 0]
+    assert [t.score for t in submission.tasks] == [0, 60]
+    assert [t.exec_time for t in submission.tasks] == [10, 20]
+    assert submission.exec_time == 20
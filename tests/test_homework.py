@@ -233,10 +233,11 @@ class TestHomework(BaseTester):
         assert {*rv_data['problemIds']} == {*new_data['problemIds']}
         # ensure that student status also updated
         hw_id = course_data.homework_ids[0]
-        homework = Homework.get_by_id(hw_id)
+        homework = Homework(hw_id)
         course = Course(course_data.name)
         print(course.obj.student_nicknames)
-        status = next(iter(homework.student_status.values()))
+        status = homework.get_student_status(homework.students())
+        status = next(iter(status.values()))
         assert sorted(status.keys()) == sorted(map(str, pids))
 
     def test_update_student_status(
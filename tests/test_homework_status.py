@@ -0,0 +1,127 @@
+import pytest
+from mongo import *
+from mongo import engine
+from migrations import split_homework_status
+from tests import utils
+from tests.test_finish_judging import judge
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def context(app):
+    with app.app_context():
+        course = utils.course.create_course(students=3)
+        problem = utils.problem.create_problem(
+            course=course,
+            tasks=[{
+                'task_score': 100,
+                'case_count': 1
+            }],
+        )
+        homework = Homework.add(
+            user=course.teacher,
+            course_name=course.course_name,
+            hw_name='hw',
+            problem_ids=[problem.id],
+            start=1,
+        )
+        yield {
+            'course': course,
+            'problem': problem,
+            'homework': Homework(homework),
+            'students': sorted(course.student_nicknames),
+        }
+
+
+def submit(context, username, status='AC'):
+    submission = utils.submission.create_submission(
+        user=username,
+        problem=context['problem'],
+        status=-1,
+    )
+    judge(submission, status)
+    return submission
+
+
+def test_status_is_created_on_submission(context):
+    homework = context['homework']
+    student = context['students'][0]
+    assert engine.HomeworkStatus.objects.count() == 0
+    submission = submit(context, student)
+    stat = engine.HomeworkStatus.objects.get(
+        homework=homework.obj,
+        user=student,
+    )
+    assert stat.score == 100
+    assert stat.submission_ids == [submission.id]
+    # non-student's submission doesn't create status
+    outsider = utils.user.create_user()
+    submit(context, outsider.username)
+    assert engine.HomeworkStatus.objects.count() == 1
+
+
+def test_get_homework_paginated(forge_client, context):
+    homework = context['homework']
+    students = context['students']
+    submit(context, students[1])
+    client = forge_client(context['course'].teacher.username)
+    rv = client.get(f'/homework/{homework.id}?offset=1&count=1')
+    assert rv.status_code == 200, rv.get_json()
+    status = rv.get_json()['data']['studentStatus']
+    assert [*status] == [students[1]]
+    assert status[students[1]][str(context['problem'].id)]['score'] == 100
+    rv = client.get(f'/homework/{homework.id}?offset=-1')
+    assert rv.status_code == 400, rv.get_json()
+    # student only gets their own status
+    client = forge_client(students[0])
+    rv = client.get(f'/course/{context["course"].course_name}/homework')
+    assert rv.status_code == 200, rv.get_json()
+    status = rv.get_json()['data'][0]['studentStatus']
+    assert status == {
+        str(context['problem'].id): Homework.default_problem_status()
+    }
+
+
+def test_status_removed_with_student_and_homework(context):
+    homework = context['homework']
+    students = context['students']
+    for student in students:
+        submit(context, student)
+    course = context['course'].reload()
+    course.update_student_namelist({s: s for s in students[1:]})
+    assert engine.HomeworkStatus.objects.count() == 2
+    homework.delete_problems(user=course.teacher, course=course.course_name)
+    assert engine.HomeworkStatus.objects.count() == 0
+
+
+def test_migrate(context):
+    homework = context['homework']
+    students = context['students']
+    pid = str(context['problem'].id)
+    legacy = {s: {pid: Homework.default_problem_status()} for s in students}
+    legacy[students[0]][pid].update(
+        score=80,
+        problemStatus=1,
+        submissionIds=['a' * 24],
+    )
+    engine.Homework._get_collection().update_one(
+        {'_id': homework.id},
+        {'$set': {
+            'studentStatus': legacy
+        }},
+    )
+    assert split_homework_status.migrate() == 1
+    assert split_homework_status.migrate() == 0
+    raw = engine.Homework._get_collection().find_one({'_id': homework.id})
+    assert 'studentStatus' not in raw
+    # only touched status is copied
+    assert engine.HomeworkStatus.objects.count() == 1
+    status = homework.get_student_status(students)
+    assert status == legacy
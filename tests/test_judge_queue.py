@@ -0,0 +1,138 @@
+import pytest
+from mongo import *
+from mongo.judge_queue import JudgeQueue, Dispatcher
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def submission(app):
+    with app.app_context():
+        user = utils.user.create_user()
+        course = utils.course.create_course(students=[user])
+        problem = utils.problem.create_problem(course=course)
+        yield utils.submission.create_submission(
+            user=user,
+            problem=problem,
+            status=-1,
+        )
+
+
+def test_submit_only_push_into_queue(submission):
+    queue = JudgeQueue()
+    # `create_submission` has submitted it once
+    assert len(queue) == 1
+    raw = queue.pop()
+    assert queue.decode(raw) == {
+        'submissionId': submission.id,
+        'attempts': 0,
+    }
+    assert submission.status == -1
+
+
+def test_rejudge_push_into_queue(app, submission):
+    queue = JudgeQueue()
+    queue.client.delete(queue.QUEUE_KEY)
+    with app.app_context():
+        assert submission.rejudge()
+    assert len(queue) == 1
+    assert Submission(submission.id).status == -1
+
+
+def test_dispatch_success(monkeypatch, submission):
+    sent = []
+    monkeypatch.setattr(
+        Submission,
+        'send',
+        lambda self: sent.append(self.id) or True,
+    )
+    queue = JudgeQueue()
+    assert Dispatcher(queue).dispatch_one()
+    assert sent == [submission.id]
+    assert len(queue) == 0
+    assert queue.client.llen(queue.PROCESSING_KEY) == 0
+    # nothing left
+    assert not Dispatcher(queue).dispatch_one()
+
+
+def test_dispatch_retry_with_backoff(monkeypatch, submission):
+    def send(self):
+        raise JudgeQueueFullError
+
+    monkeypatch.setattr(Submission, 'send', send)
+    queue = JudgeQueue()
+    assert Dispatcher(queue).dispatch_one()
+    assert len(queue) == 0
+    assert queue.client.zcard(queue.DELAYED_KEY) == 1
+    # not due yet
+    assert queue.promote() == 0
+    assert queue.promote(now=float('inf')) == 1
+    assert queue.decode(queue.pop())['attempts'] == 1
+
+
+def test_dispatch_dead_letter(monkeypatch, submission):
+    monkeypatch.setattr(Submission, 'send', lambda self: False)
+    monkeypatch.setattr(JudgeQueue, 'MAX_ATTEMPTS', 2)
+    queue = JudgeQueue()
+    dispatcher = Dispatcher(queue)
+    for _ in range(2):
+        queue.promote(now=float('inf'))
+        assert dispatcher.dispatch_one()
+    dead_letters = queue.dead_letters()
+    assert len(dead_letters) == 1
+    assert dead_letters[0]['submissionId'] == submission.id
+    assert queue.client.zcard(queue.DELAYED_KEY) == 0
+    # submission is still waiting for judgement
+    assert Submission(submission.id).status == -1
+
+
+def test_dispatch_unexpected_error(monkeypatch, submission):
+    def send(self):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(Submission, 'send', send)
+    monkeypatch.setattr(JudgeQueue, 'MAX_ATTEMPTS', 2)
+    queue = JudgeQueue()
+    dispatcher = Dispatcher(queue)
+    assert dispatcher.dispatch_one()
+    # not left in processing list
+    assert queue.client.llen(queue.PROCESSING_KEY) == 0
+    assert queue.client.zcard(queue.DELAYED_KEY) == 1
+    queue.promote(now=float('inf'))
+    assert dispatcher.dispatch_one()
+    dead_letters = queue.dead_letters()
+    assert len(dead_letters) == 1
+    assert dead_letters[0]['reason'] == 'RuntimeError: boom'
+
+
+def test_recover_processing_items(submission):
+    queue = JudgeQueue()
+    assert queue.pop() is not None
+    assert len(queue) == 0
+    assert queue.recover() == 1
+    assert len(queue) == 1
+
+
+def test_run_survives_polling_error(monkeypatch):
+    class Stop(Exception):
+        pass
+
+    def poll_sandboxes(self):
+        raise ValueError('bad sandbox')
+
+    def dispatch_one(self, timeout):
+        raise Stop
+
+    monkeypatch.setattr(Dispatcher, 'POLL_INTERVAL', 1)
+    monkeypatch.setattr(Dispatcher, 'poll_sandboxes', poll_sandboxes)
+    monkeypatch.setattr(Dispatcher, 'dispatch_one', dispatch_one)
+    # it goes on dispatching after the polling fails
+    with pytest.raises(Stop):
+        Dispatcher().run()
@@ -0,0 +1,124 @@
+import pytest
+from mongo import *
+from mongo import engine
+from mongo.utils import can_view_problem, course_roles, perm
+from tests import utils
+from tests.utils.db import count_queries
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def context(app):
+    with app.app_context():
+        student = utils.user.create_user()
+        ta = utils.user.create_user()
+        outsider = utils.user.create_user()
+        course = utils.course.create_course(students=[student])
+        course.tas.append(ta.obj)
+        course.save()
+        other = utils.course.create_course()
+        public = Course('Public')
+        problems = [
+            utils.problem.create_problem(course=c, status=status)
+            for c in (course, other, public) for status in (0, 1)
+        ]
+        # owned by the outsider, in a course without them
+        problems.append(
+            utils.problem.create_problem(
+                course=other,
+                owner=outsider,
+                status=1,
+            ))
+        yield {
+            'users': [student, ta, outsider, course.teacher],
+            'course': course,
+            'problems': problems,
+        }
+
+
+def test_course_roles(context):
+    course = context['course']
+    student, ta, outsider, teacher = context['users']
+    course_id = str(course.id)
+    assert course_roles(student) == {course_id: 1}
+    assert course_roles(ta) == {course_id: 2}
+    assert course_roles(teacher) == {course_id: 3}
+    assert course_roles(outsider) == {}
+
+
+def test_course_roles_are_cached(context):
+    student = context['users'][0]
+    course_roles(student)
+    with count_queries() as counter:
+        assert perm(context['course'], student) == 1
+        for problem in context['problems']:
+            can_view_problem(student, problem.obj)
+    assert len(counter) == 0, counter
+
+
+def test_course_roles_follow_membership(context):
+    course = context['course']
+    student, ta, outsider, teacher = context['users']
+    for user in context['users']:
+        course_roles(user)
+    course.tas.remove(ta.obj)
+    course.update_student_namelist({
+        outsider.username: 'new',
+    })
+    course_id = str(course.id)
+    assert perm(course, ta) == 0
+    assert course_roles(student) == {}
+    assert course_roles(outsider) == {course_id: 1}
+    assert course_roles(teacher) == {course_id: 3}
+    course.delete()
+    assert course_roles(outsider) == {}
+
+
+def test_problem_list_follows_can_view_problem(context):
+    for user in context['users']:
+        user = User(user.username)
+        expected = [
+            p.problem_id for p in engine.Problem.objects.order_by('problemId')
+            if can_view_problem(user, p)
+        ]
+        got = [p.problem_id for p in Problem.get_problem_list(user)]
+        assert got == expected, user.username
+        assert got
+
+
+def test_problem_list_of_contest_user(context):
+    user = User(context['users'][0].username)
+    contest = engine.Contest(name='contest').save()
+    problem = context['problems'][-1]
+    problem.update(push__contests=contest)
+    user.update(contest=contest)
+    user.reload()
+    problems = Problem.get_problem_list(user)
+    assert [p.problem_id for p in problems] == [problem.problem_id]
+
+
+def test_problem_list_is_paginated_in_db(context):
+    admin = utils.user.create_user(role=0)
+    ids = [p.problem_id for p in Problem.get_problem_list(admin)]
+    assert len(ids) == len(context['problems'])
+    with count_queries() as counter:
+        page = Problem.get_problem_list(admin, offset=2, count=3)
+    assert [p.problem_id for p in page] == ids[2:5]
+    assert len(counter) == 1, counter
+    # only list fields are loaded
+    assert page[0].description.description is None
+    assert Problem.get_problem_list(admin, offset=len(ids) - 1, count=5)
+    with pytest.raises(IndexError):
+        Problem.get_problem_list(admin, offset=len(ids))
+    with pytest.raises(IndexError):
+        Problem.get_problem_list(admin, offset=-1)
+    assert Problem.get_problem_list(admin, offset=1, count=0) == []
+    with pytest.raises(IndexError):
+        Problem.get_problem_list(admin, offset=len(ids), count=0)
@@ -0,0 +1,262 @@
+import pytest
+from mongo import *
+from mongo import engine
+from mongo.utils import doc_required
+from tests import utils
+from tests.utils.db import count_queries
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def context(app):
+    with app.app_context():
+        student = utils.user.create_user()
+        course = utils.course.create_course(students=[student])
+        problems = [
+            utils.problem.create_problem(course=course) for _ in range(3)
+        ]
+        yield {
+            'student': student,
+            'course': course,
+            'problems': problems,
+        }
+
+
+def test_truthiness_does_not_query(context):
+    username = context['student'].username
+    with count_queries() as counter:
+        user = User(username)
+        assert user
+        assert user
+        assert not User('nobody')
+    # used to be 5
+    assert len(counter) == 2, counter
+
+
+def test_exists_refresh(context):
+    user = User(context['student'].username)
+    engine.User.objects(username=user.username).delete()
+    with count_queries() as counter:
+        assert user.exists()
+        assert not user.exists(refresh=True)
+        assert not user
+    assert len(counter) == 1, counter
+
+
+def test_wrapper_state_follows_save_and_delete(context):
+    user = User('nobody')
+    assert not user
+    user.reload()
+    assert not user
+    utils.user.create_user(username='nobody')
+    assert user.reload()
+    user.delete()
+    assert not user
+    assert not user.exists(refresh=True)
+
+
+def test_doc_required(context):
+    @doc_required('user', User)
+    def get_user(user):
+        return user
+
+    with count_queries() as counter:
+        get_user(user=context['student'].username)
+    # used to be 2
+    assert len(counter) == 1, counter
+    with pytest.raises(engine.DoesNotExist):
+        get_user(user='nobody')
+
+
+def test_homework_add(context):
+    course = context['course']
+    problems = context['problems']
+    with count_queries() as counter:
+        Homework.add(
+            user=course.teacher,
+            course_name=course.course_name,
+            hw_name='hw',
+            problem_ids=[p.id for p in problems],
+        )
+    # problems are loaded once and not checked again (used to be 15)
+    # roles of the teacher are loaded instead of the teacher
+    assert counter.by_collection() == {
+        'course': 3,
+        'homework': 2,
+        'problem': 6,
+    }, counter
+
+
+def test_update_student_namelist(context):
+    course = context['course']
+    new_students = [utils.user.create_user() for _ in range(3)]
+    course.reload()
+    with count_queries() as counter:
+        course.update_student_namelist(
+            {u.username: u.username
+             for u in new_students})
+    # checking new students no longer queries them again (used to be 19)
+    assert counter.by_collection()['user'] == 16, counter
+
+
+def test_get_homework_list_api(context, forge_client):
+    course = context['course']
+    Homework.add(
+        user=course.teacher,
+        course_name=course.course_name,
+        hw_name='hw',
+        problem_ids=[p.id for p in context['problems']],
+    )
+    client = forge_client(context['student'].username)
+    with count_queries() as counter:
+        rv = client.get(f'/course/{course.course_name}/homework')
+    assert rv.status_code == 200, rv.get_json()
+    # the course is loaded once in a request (used to be 5)
+    assert len(counter) == 4, counter
+
+
+def test_create_submission_api(context, forge_client):
+    client = forge_client(context['student'].username)
+    with count_queries() as counter:
+        rv = client.post(
+            '/submission',
+            json={
+                'problemId': context['problems'][0].id,
+                'languageType': 0,
+            },
+        )
+    assert rv.status_code == 200, rv.get_json()
+    # the problem is loaded once and courses aren't dereferenced to check
+    # permission, roles aren't checked without quota, the user is updated
+    # without saving (used to be 15)
+    assert len(counter) == 11, counter
+
+
+def test_identity_map(app, context):
+    username = context['student'].username
+    with app.test_request_context():
+        user = User(username)
+        with count_queries() as counter:
+            assert User(username) is user
+            assert not User('nobody')
+        # only the missing one is queried
+        assert len(counter) == 1, counter
+        assert User('nobody') is not User('nobody')
+        course = context['course']
+        assert Course(course.course_name) is Course(course.course_name)
+
+
+def test_identity_map_is_invalidated_by_writes(app, context):
+    username = context['student'].username
+    with app.test_request_context():
+        user = User(username)
+        user.update(active=False)
+        assert User(username) is not user
+        user = User(username)
+        user.save()
+        assert User(username) is not user
+        user = User(username)
+        user.delete()
+        assert not User(username)
+
+
+def test_identity_map_is_request_scoped(app, context):
+    username = context['student'].username
+    assert User(username) is not User(username)
+    with app.test_request_context():
+        user = User(username)
+    with app.test_request_context():
+        assert User(username) is not user
+    ctx = app.test_request_context()
+    ctx.push()
+    user = User(username)
+    ctx.pop()
+    assert not ctx.g.get('identity_map')
+
+
+def test_inbox_queries_do_not_grow_with_messages(context):
+    sender = context['student']
+    receivers = [utils.user.create_user() for _ in range(3)]
+    for i in range(4):
+        Inbox.send(
+            sender.username,
+            [u.username for u in receivers],
+            f'title {i}',
+            'hello',
+        )
+    with count_queries() as counter:
+        messages = Inbox.messages(receivers[0].username)
+    assert len(messages) == 4
+    assert messages[0]['sender'] == sender.info
+    # inboxes, messages and senders (used to be 9)
+    assert len(counter) == 3, counter
+    with count_queries() as counter:
+        sents = Inbox.sents(sender.username)
+    assert len(sents) == 4
+    assert sents[0]['receivers'] == [u.info for u in receivers]
+    # messages and receivers (used to be 13)
+    assert len(counter) == 2, counter
+
+
+def test_post_queries_do_not_grow_with_replies(context):
+    course = context['course']
+    author = User(context['student'].username)
+    for i in range(3):
+        Post.add_post(course.course_name, author, 'content', f'post {i}')
+    for thread in engine.PostThread.objects:
+        for _ in range(2):
+            Post.add_reply(thread, author, 'reply')
+    course.reload()
+    with count_queries() as counter:
+        posts = Post.found_post(course.obj)
+    assert len(posts) == 3
+    assert all(len(p['thread']['reply']) == 2 for p in posts)
+    assert posts[0]['thread']['author'] == author.info
+    # two depths of threads and authors (used to be 15)
+    assert len(counter) == 3, counter
+
+
+def test_submission_list_loads_users_at_once(context):
+    problem = context['problems'][0]
+    users = [utils.user.create_user() for _ in range(4)]
+    for user in users:
+        utils.submission.create_submission(user=user, problem=problem)
+    with count_queries() as counter:
+        submissions = Submission.filter(
+            user=users[0],
+            fields=Submission.LIST_FIELDS,
+        )
+        dicts = Submission.to_dicts(submissions)
+    assert {d['user']['username']
+            for d in dicts} == {u.username
+                                for u in users}
+    # submissions and users (used to be 5)
+    assert len(counter) == 2, counter
+
+
+def test_submission_list_projection(context):
+    problem = context['problems'][0]
+    submission = utils.submission.create_submission(
+        user=context['student'],
+        problem=problem,
+        score=100,
+    )
+    docs = Submission.filter(
+        user=context['student'],
+        fields=Submission.LIST_FIELDS,
+    )
+    assert len(docs) == 1
+    # only listed columns are transferred
+    assert {*docs[0]} == {
+        '_id',
+        *(engine.Submission._fields[k].db_field
+          for k in Submission.LIST_FIELDS),
+    }
+    assert Submission.to_dicts(docs) == [submission.reload().to_dict()]
@@ -0,0 +1,125 @@
+import pytest
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from mongo import *
+from mongo.utils import RedisCache
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def context(app):
+    with app.app_context():
+        student = utils.user.create_user()
+        course = utils.course.create_course(students=[student])
+        problem = utils.problem.create_problem(course=course)
+        yield {
+            'student': student,
+            'problem': problem,
+        }
+
+
+def test_counts_are_loaded_from_submissions(context):
+    student, problem = context['student'], context['problem']
+    yesterday = datetime.now() - timedelta(days=1)
+    utils.submission.create_submission(
+        user=student,
+        problem=problem,
+        timestamp=yesterday.timestamp(),
+    )
+    for _ in range(3):
+        utils.submission.create_submission(user=student, problem=problem)
+    assert problem.submit_count(student) == 3
+    assert Problem.submit_counts(student) == {str(problem.problem_id): 3}
+
+
+def test_counts_expire_at_midnight(context):
+    key = Problem.submit_count_key(context['student'].username)
+    midnight = datetime.combine(
+        datetime.now().date() + timedelta(days=1),
+        datetime.min.time(),
+    )
+    ttl = RedisCache().client.ttl(key)
+    assert 0 < ttl <= (midnight - datetime.now()).total_seconds() + 1
+
+
+def test_take_quota(context):
+    student, problem = context['student'], context['problem']
+    assert all(problem.take_quota(student, 2) for _ in range(2))
+    assert not problem.take_quota(student, 2)
+    # refused ones are not counted
+    assert problem.submit_count(student) == 2
+    assert problem.take_quota(student, -1)
+    assert problem.submit_count(student) == 3
+
+
+def test_concurrent_submits_do_not_exceed_quota(context):
+    student, problem = context['student'], context['problem']
+    with ThreadPoolExecutor(8) as executor:
+        taken = [
+            *executor.map(
+                lambda _: problem.take_quota(student, 5),
+                range(20),
+            )
+        ]
+    assert taken.count(True) == 5
+    assert problem.submit_count(student) == 5
+
+
+def test_concurrent_seeding(context):
+    student, problem = context['student'], context['problem']
+    utils.submission.create_submission(user=student, problem=problem)
+    with ThreadPoolExecutor(8) as executor:
+        taken = [
+            *executor.map(
+                lambda _: problem.take_quota(student, -1),
+                range(20),
+            )
+        ]
+    assert all(taken)
+    assert problem.submit_count(student) == 21
+    key = Problem.submit_count_key(student.username)
+    assert RedisCache().client.ttl(key) > 0
+
+
+def test_failed_submit_gives_quota_back(monkeypatch, forge_client, context):
+    def add(*args, **ks):
+        raise TestCaseNotFound(problem.problem_id)
+
+    monkeypatch.setattr(Submission, 'add', add)
+    student, problem = context['student'], context['problem']
+    problem.update(quota=1)
+    client = forge_client(student.username)
+    rv = client.post(
+        '/submission',
+        json={
+            'problemId': problem.problem_id,
+            'languageType': 0,
+        },
+    )
+    assert rv.status_code == 403, rv.get_json()
+    assert problem.submit_count(student) == 0
+
+
+def test_admin_submits_to_problem_without_course(forge_client, context):
+    admin = utils.user.create_user(role=0)
+    problem = context['problem']
+    problem.update(courses=[], quota=1)
+    client = forge_client(admin.username)
+    rv = client.post(
+        '/submission',
+        json={
+            'problemId': problem.problem_id,
+            'languageType': 0,
+        },
+    )
+    # not a 500 from checking roles in no courses
+    assert rv.status_code == 200, rv.get_json()
+    assert problem.submit_count(admin) == 1
@@ -1,5 +1,11 @@
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+from mongo import engine
+from mongo.ranking import Ranking
+from mongo.utils import RedisCache
+from tests import utils
 from tests.base_tester import BaseTester
+from tests.utils.db import count_queries
 
 
 class TestRanking(BaseTester):
@@ -33,3 +39,121 @@ class TestRanking(BaseTester):
         assert user['ACSubmission'] == 0
         assert user['Submission'] == 1
         '''
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def users(app):
+    with app.app_context():
+        users = [utils.user.create_user() for _ in range(4)]
+        problems = [utils.problem.create_problem() for _ in range(3)]
+        # the i-th user solves i problems
+        for i, user in enumerate(users):
+            for problem in problems[:i]:
+                submission = utils.submission.create_submission(
+                    user=user,
+                    problem=problem,
+                    score=100,
+                )
+                user.add_submission(submission)
+        yield users[::-1]
+
+
+def ranked(page, users):
+    '''
+    rows of these users in a page
+    '''
+    usernames = {u.username for u in users}
+    return [row for row in page if row['user']['username'] in usernames]
+
+
+def test_ranking_order(users):
+    page = Ranking().page()
+    assert len(page) == engine.User.objects.count()
+    assert [row['rank'] for row in page] == [*range(1, len(page) + 1)]
+    rows = ranked(page, users)
+    assert [row['user']['username'] for row in rows] == \
+        [u.username for u in users]
+    assert [row['ACProblem'] for row in rows] == [3, 2, 1, 0]
+
+
+def test_ties_are_broken_by_ratio(users):
+    # they have solved one problem, the latter one with more tries
+    first, second = users[2], users[3]
+    problem = utils.problem.create_problem()
+    for user, score in ((first, 100), (second, 0), (second, 100)):
+        submission = utils.submission.create_submission(
+            user=user,
+            problem=problem,
+            score=score,
+        )
+        user.add_submission(submission)
+    first_rank = Ranking().rank_of(first)['rank']
+    assert first_rank < Ranking().rank_of(second)['rank']
+
+
+def test_ranking_api(users, client, forge_client):
+    rv = client.get('/ranking', query_string={'offset': 1, 'count': 2})
+    assert rv.status_code == 200, rv.get_json()
+    page = rv.get_json()['data']
+    assert [row['rank'] for row in page] == [2, 3]
+    assert [row['user']['username'] for row in page] == \
+        [u.username for u in users[1:3]]
+    rv = client.get('/ranking', query_string={'offset': -1})
+    assert rv.status_code == 400
+    client = forge_client(users[1].username)
+    rv = client.get('/ranking/me')
+    assert rv.status_code == 200, rv.get_json()
+    assert rv.get_json()['data']['rank'] == 2
+
+
+def test_page_is_served_from_redis(users):
+    Ranking().page()
+    with count_queries() as counter:
+        assert len(Ranking().page(offset=1, count=2)) == 2
+    assert len(counter) == 0, counter
+
+
+def test_new_user_is_ranked(users):
+    Ranking().page()
+    user = utils.user.create_user()
+    row = Ranking().rank_of(user)
+    assert row['ACProblem'] == 0
+    # after the ones solved problems
+    assert row['rank'] > 3
+
+
+def test_rebuild_corrects_drift(users):
+    Ranking().page()
+    RedisCache().client.zadd(Ranking.KEY, {users[-1].username: 100})
+    assert Ranking().page()[0]['user']['username'] == users[-1].username
+    assert Ranking().rebuild() == engine.User.objects.count()
+    assert Ranking().page()[0]['user']['username'] == users[0].username
+
+
+def test_concurrent_rebuilds(users):
+    cnt = engine.User.objects.count()
+    with ThreadPoolExecutor(4) as executor:
+        results = [*executor.map(lambda _: Ranking().rebuild(), range(8))]
+    assert results == [cnt] * 8
+    assert len(Ranking().page()) == cnt
+    # temporary keys are moved in
+    assert not [k for k in RedisCache().client.keys() if b'_TMP_' in k]
+
+
+def test_deleted_user_is_not_ranked(users):
+    Ranking().page()
+    users[0].obj.delete()
+    assert Ranking().rank_of(users[0]) is None
+    page = Ranking().page()
+    assert len(page) == engine.User.objects.count()
+    assert page[0]['user']['username'] == users[1].username
+    assert RedisCache().client.hget(Ranking.STATS_KEY, users[0].username) \
+        is None
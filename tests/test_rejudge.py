@@ -0,0 +1,191 @@
+import pytest
+from mongo import *
+from mongo import engine
+from mongo.judge_queue import JudgeQueue, Dispatcher
+from tests import utils
+from tests.test_finish_judging import judge
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def context(app):
+    with app.app_context():
+        student = utils.user.create_user()
+        course = utils.course.create_course(students=[student])
+        problem = utils.problem.create_problem(
+            course=course,
+            tasks=[{
+                'task_score': 100,
+                'case_count': 2
+            }],
+        )
+        submissions = []
+        for _ in range(3):
+            submission = utils.submission.create_submission(
+                user=student,
+                problem=problem,
+                status=-1,
+            )
+            # large enough to be packed
+            judge(submission, 'WA', 'out' * 1024)
+            submissions.append(submission.reload())
+        # submissions judged, don't care what's in the queue
+        JudgeQueue().client.delete(JudgeQueue.QUEUE_KEY)
+        yield {
+            'student': student,
+            'course': course,
+            'problem': problem,
+            'submissions': submissions,
+        }
+
+
+def test_rejudge_many(context):
+    problem = context['problem']
+    submissions = context['submissions']
+    db = engine.Submission._get_db()
+    outputs = [s.output_pack.grid_id for s in submissions]
+    assert db['fs.files'].count_documents({'_id': {'$in': outputs}}) == 3
+    cnt = Submission.rejudge_many('problem-test', problem=problem.id)
+    assert cnt == 3
+    for s in submissions:
+        s.reload()
+        assert s.status == -1
+        assert s.tasks == []
+        assert s.output_pack.grid_id is None
+    assert db['fs.files'].count_documents({'_id': {'$in': outputs}}) == 0
+    assert db['fs.chunks'].count_documents({'files_id': {'$in': outputs}}) == 0
+    queue = JudgeQueue()
+    assert len(queue) == 0
+    assert queue.bulk_size() == 3
+    progress = queue.progress('problem-test')
+    assert progress.pop('createdAt') > 0
+    assert progress == {
+        'total': 3,
+        'dispatched': 0,
+        'finished': 0,
+        'failed': 0,
+    }
+
+
+def test_bulk_is_throttled(monkeypatch, context):
+    sent = []
+    monkeypatch.setattr(
+        Submission,
+        'send',
+        lambda self: sent.append(self.id) or True,
+    )
+    Submission.rejudge_many('problem-test', problem=context['problem'].id)
+    queue = JudgeQueue()
+    dispatcher = Dispatcher(queue)
+    assert dispatcher.dispatch_one()
+    # rate limited
+    assert not dispatcher.dispatch_one()
+    # new submissions go first
+    queue.push(context['submissions'][0].id)
+    assert dispatcher.dispatch_one()
+    assert queue.bulk_size() == 2
+    dispatcher.next_bulk = 0
+    assert dispatcher.dispatch_one()
+    assert len(sent) == 3
+    # all of them belong to the job
+    assert queue.progress('problem-test')['dispatched'] == 3
+
+
+def test_finished_progress(app, context):
+    Submission.rejudge_many('problem-test', problem=context['problem'].id)
+    with app.app_context():
+        for s in context['submissions'][:2]:
+            judge(s, 'AC')
+        # judging the same one twice should not be counted
+        judge(context['submissions'][0], 'AC')
+    assert JudgeQueue().progress('problem-test')['finished'] == 2
+
+
+def test_retried_bulk_item_is_still_throttled(monkeypatch, context):
+    monkeypatch.setattr(Submission, 'send', lambda self: False)
+    Submission.rejudge_many('problem-test', problem=context['problem'].id)
+    queue = JudgeQueue()
+    assert Dispatcher(queue).dispatch_one()
+    assert queue.promote(now=float('inf')) == 1
+    assert len(queue) == 0
+    assert queue.bulk_size() == 3
+
+
+def test_dead_bulk_item_is_counted(monkeypatch, context):
+    monkeypatch.setattr(Submission, 'send', lambda self: False)
+    monkeypatch.setattr(JudgeQueue, 'MAX_ATTEMPTS', 1)
+    Submission.rejudge_many('problem-test', problem=context['problem'].id)
+    queue = JudgeQueue()
+    assert Dispatcher(queue).dispatch_one()
+    assert len(queue.dead_letters()) == 1
+    progress = queue.progress('problem-test')
+    assert progress['failed'] == 1
+    assert progress['finished'] == 0
+    assert queue.client.hlen(queue.JOB_KEY) == 2
+
+
+def test_rejudge_problem_api(forge_client, context):
+    problem = context['problem']
+    client = forge_client(context['student'].username)
+    rv = client.post(f'/problem/{problem.id}/rejudge')
+    assert rv.status_code == 403, rv.get_json()
+    client = forge_client(context['course'].teacher.username)
+    rv = client.get(f'/problem/{problem.id}/rejudge')
+    assert rv.status_code == 404, rv.get_json()
+    rv = client.post(f'/problem/{problem.id}/rejudge')
+    assert rv.status_code == 200, rv.get_json()
+    assert rv.get_json()['data']['total'] == 3
+    rv = client.get(f'/problem/{problem.id}/rejudge')
+    assert rv.status_code == 200, rv.get_json()
+    assert rv.get_json()['data']['finished'] == 0
+
+
+def test_rejudge_homework_api(forge_client, context):
+    course = context['course']
+    teacher = course.teacher
+    homework = Homework.add(
+        user=teacher,
+        course_name=course.course_name,
+        hw_name='hw',
+        problem_ids=[context['problem'].id],
+        start=1,
+    )
+    client = forge_client(context['student'].username)
+    rv = client.post(f'/homework/{homework.id}/rejudge')
+    assert rv.status_code == 403, rv.get_json()
+    client = forge_client(teacher.username)
+    rv = client.post(f'/homework/{homework.id}/rejudge')
+    assert rv.status_code == 200, rv.get_json()
+    assert rv.get_json()['data']['total'] == 3
+    rv = client.post(f'/homework/{"0" * 24}/rejudge')
+    assert rv.status_code == 404, rv.get_json()
+    rv = client.post('/homework/not-an-id/rejudge')
+    assert rv.status_code == 404, rv.get_json()
+
+
+def test_rejudge_homework_only_its_students(forge_client, context):
+    course = context['course']
+    problem = context['problem']
+    # someone from another course sharing the problem
+    other = utils.user.create_user()
+    other_course = utils.course.create_course(students=[other])
+    problem.update(push__courses=other_course.obj)
+    utils.submission.create_submission(user=other, problem=problem, status=-1)
+    homework = Homework.add(
+        user=course.teacher,
+        course_name=course.course_name,
+        hw_name='hw',
+        problem_ids=[problem.id],
+        start=1,
+    )
+    client = forge_client(course.teacher.username)
+    rv = client.post(f'/homework/{homework.id}/rejudge')
+    assert rv.status_code == 200, rv.get_json()
+    assert rv.get_json()['data']['total'] == 3
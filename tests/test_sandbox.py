@@ -0,0 +1,268 @@
+import pytest
+import requests
+from mongo import *
+from mongo import engine
+from mongo.sandbox import *
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def sandboxes(app):
+    instances = [
+        engine.Sandbox(name=f'Sandbox-{i}',
+                       url=f'http://sb-{i}',
+                       token=f'T{i}') for i in range(3)
+    ]
+    Submission.config().update(sandbox_instances=instances)
+    return instances
+
+
+@pytest.fixture
+def submission(app):
+    with app.app_context():
+        user = utils.user.create_user()
+        course = utils.course.create_course(students=[user])
+        problem = utils.problem.create_problem(course=course)
+        yield utils.submission.create_submission(
+            user=user,
+            problem=problem,
+            status=-1,
+        )
+
+
+def test_least_loaded():
+    registry = SandboxRegistry()
+    assert registry.least_loaded() is None
+    registry.report('A', 3)
+    registry.report('B', 1)
+    registry.report('C', 2)
+    assert registry.least_loaded() == 'B'
+    registry.report('B', 5)
+    assert registry.least_loaded() == 'C'
+
+
+def test_dead_sandbox_is_ignored():
+    registry = SandboxRegistry()
+    registry.report('A', 0, now=0)
+    registry.report('B', 10)
+    assert registry.least_loaded() == 'B'
+    assert registry.loads() == {'B': 10}
+
+
+def test_retain():
+    registry = SandboxRegistry()
+    for name in 'ABC':
+        registry.report(name, 0)
+    registry.retain(['A', 'C'])
+    assert set(registry.loads()) == {'A', 'C'}
+
+
+def test_target_sandbox_use_cached_load(monkeypatch, sandboxes, submission):
+    def no_network(*args, **ks):
+        raise AssertionError('target_sandbox should not send requests')
+
+    monkeypatch.setattr('requests.Session.request', no_network)
+    registry = SandboxRegistry()
+    registry.report('Sandbox-0', 4)
+    registry.report('Sandbox-2', 1)
+    # not in config, should be skipped
+    registry.report('Unknown', 0)
+    registry.retain(sb.name for sb in sandboxes)
+    target = submission.target_sandbox(LeastLoadScheduler())
+    assert target.name == 'Sandbox-2'
+
+
+def test_target_sandbox_without_alive_sandbox(sandboxes, submission):
+    assert submission.target_sandbox() is None
+
+
+def test_least_outstanding(sandboxes):
+    registry = SandboxRegistry()
+    for sb in sandboxes:
+        registry.report(sb.name, 0)
+    sandboxes[0].capacity = 2
+    scheduler = LeastOutstandingScheduler(registry)
+    picked = []
+    for i in range(4):
+        sb = scheduler.pick(sandboxes, 1)
+        registry.acquire(sb.name, i)
+        picked.append(sb.name)
+    assert sorted(picked) == [
+        'Sandbox-0',
+        'Sandbox-0',
+        'Sandbox-1',
+        'Sandbox-2',
+    ]
+    assert registry.outstanding() == {
+        'Sandbox-0': 2,
+        'Sandbox-1': 1,
+        'Sandbox-2': 1,
+    }
+    # release twice should only decrease once
+    assert registry.release(3) == picked[3]
+    assert registry.release(3) is None
+    assert scheduler.pick(sandboxes, 1).name == picked[3]
+
+
+def test_acquire_again_release_the_old_one():
+    registry = SandboxRegistry()
+    registry.acquire('A', 'sub')
+    registry.acquire('B', 'sub')
+    assert registry.outstanding() == {'A': 0, 'B': 1}
+
+
+def test_release_after_remove():
+    registry = SandboxRegistry()
+    registry.report('A', 0)
+    registry.acquire('A', 'sub')
+    registry.remove('A')
+    registry.report('A', 0)
+    # counted by the removed one
+    assert registry.release('sub') is None
+    registry.acquire('A', 'other')
+    assert registry.outstanding() == {'A': 1}
+    assert registry.client.hget(registry.OUTSTANDING_KEY, 'A') == b'1'
+
+
+def test_weighted_round_robin(sandboxes):
+    registry = SandboxRegistry()
+    for sb in sandboxes:
+        registry.report(sb.name, 0)
+    sandboxes[0].capacity = 3
+    scheduler = WeightedRoundRobinScheduler(registry)
+    picked = [scheduler.pick(sandboxes, 1).name for _ in range(10)]
+    assert picked.count('Sandbox-0') == 6
+    assert picked.count('Sandbox-1') == 2
+    assert picked.count('Sandbox-2') == 2
+    # should not send to the same one in a row
+    assert 'Sandbox-0' * 3 not in ''.join(picked)
+
+
+def test_consistent_hash(sandboxes):
+    registry = SandboxRegistry()
+    for sb in sandboxes:
+        registry.report(sb.name, 0)
+    scheduler = ConsistentHashScheduler(registry)
+    before = {pid: scheduler.pick(sandboxes, pid).name for pid in range(60)}
+    assert len({*before.values()}) == 3
+    assert before == {
+        pid: scheduler.pick(sandboxes, pid).name
+        for pid in range(60)
+    }
+    registry.remove('Sandbox-1')
+    after = {pid: scheduler.pick(sandboxes, pid).name for pid in range(60)}
+    # only problems on the dead one are moved
+    for pid, name in before.items():
+        if name != 'Sandbox-1':
+            assert after[pid] == name
+        else:
+            assert after[pid] != name
+
+
+def test_get_scheduler(monkeypatch):
+    monkeypatch.setenv('SANDBOX_SCHEDULER', 'consistent-hash')
+    assert isinstance(get_scheduler(), ConsistentHashScheduler)
+    assert isinstance(
+        get_scheduler('least-load'),
+        LeastLoadScheduler,
+    )
+    with pytest.raises(ValueError):
+        get_scheduler('random')
+
+
+def test_heartbeat(client, sandboxes):
+    rv = client.put(
+        '/submission/sandbox/heartbeat',
+        json={
+            'token': 'T1',
+            'load': 0.5,
+        },
+    )
+    assert rv.status_code == 200, rv.get_json()
+    assert SandboxRegistry().loads() == {'Sandbox-1': 0.5}
+
+
+def test_heartbeat_with_invalid_token(client, sandboxes):
+    rv = client.put(
+        '/submission/sandbox/heartbeat',
+        json={
+            'token': 'Oops',
+            'load': 0.5,
+        },
+    )
+    assert rv.status_code == 401, rv.get_json()
+    assert SandboxRegistry().loads() == {}
+
+
+def test_client_reuse_session():
+    a = SandboxClient.session('http://sb-0')
+    assert SandboxClient.session('http://sb-0') is a
+    assert SandboxClient.session('http://sb-1') is not a
+    adapter = a.get_adapter('http://sb-0/status')
+    assert adapter._pool_maxsize == SandboxClient.POOL_SIZE
+
+
+def test_client_always_set_timeout(monkeypatch, sandboxes):
+    calls = []
+
+    def request(self, method, url, **ks):
+        calls.append((method, url, ks.get('timeout')))
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = b'{"load": 0.25}'
+        return resp
+
+    monkeypatch.setattr('requests.Session.request', request)
+    SandboxRegistry().poll(sandboxes[:1])
+    SandboxClient.submit(sandboxes[0], 'a' * 24, {}, {})
+    assert calls == [
+        (
+            'GET',
+            'http://sb-0/status',
+            (SandboxClient.CONNECT_TIMEOUT, SandboxClient.STATUS_TIMEOUT),
+        ),
+        (
+            'POST',
+            f'http://sb-0/submit/{"a" * 24}',
+            (SandboxClient.CONNECT_TIMEOUT, SandboxClient.SUBMIT_TIMEOUT),
+        ),
+    ]
+    assert SandboxRegistry().loads() == {'Sandbox-0': 0.25}
+
+
+def test_poll_remove_unreachable_sandbox(monkeypatch, sandboxes):
+    def request(self, method, url, **ks):
+        raise requests.ConnectionError('refused')
+
+    monkeypatch.setattr('requests.Session.request', request)
+    registry = SandboxRegistry()
+    registry.report('Sandbox-0', 0)
+    registry.poll(sandboxes[:1])
+    assert registry.loads() == {}
+
+
+@pytest.mark.parametrize('body', [b'oops', b'{}', b'{"load": null}', b'[]'])
+def test_poll_remove_sandbox_with_invalid_status(
+    monkeypatch,
+    sandboxes,
+    body,
+):
+    def request(self, method, url, **ks):
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = body
+        return resp
+
+    monkeypatch.setattr('requests.Session.request', request)
+    registry = SandboxRegistry()
+    registry.report('Sandbox-0', 0)
+    registry.poll(sandboxes[:1])
+    assert registry.loads() == {}
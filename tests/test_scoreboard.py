@@ -2,9 +2,12 @@ from pprint import pprint
 from random import randint
 from typing import Dict
 import pytest
-from mongo import User
+from mongo import User, engine
+from mongo.scoreboard import Scoreboard
+from mongo.utils import RedisCache
 from tests.base_tester import BaseTester
 from tests.conftest import forge_client
+from tests.test_finish_judging import judge
 from . import utils
 
 
@@ -19,7 +22,14 @@ def context():
     student = utils.user.create_user(role=2)
     course = utils.course.create_course(students=[student])
     teacher = course.teacher
-    problem = utils.problem.create_problem(course=course, owner=teacher)
+    problem = utils.problem.create_problem(
+        course=course,
+        owner=teacher,
+        tasks=[{
+            'task_score': 100,
+            'case_count': 1
+        }],
+    )
     return {
         'admin': admin,
         'course': course,
@@ -65,7 +75,7 @@ def test_get_correct_query_result_with_no_submission(context, testcase):
         utils.problem.create_problem(course=course, owner=course.teacher)
         for _ in range(testcase['problem_count'] - 1)
     ]
-    data = course.get_scoreboard(problems)
+    data = course.get_scoreboard([p.id for p in problems])
     assert len(data) == testcase['student_count'], data
     for student in students:
         # find element in array
@@ -725,3 +735,132 @@ def test_get_error_for_providing_unparsable_pids(context, forge_client,
             f'/course/{context["course"].course_name}/scoreboard?pids={pids}')
         assert rv.status_code == 400
         assert rv.json['message'] == 'Error occurred when parsing `pids`.'
+
+
+@pytest.fixture
+def judged(context, app):
+    problem = context['problem']
+
+    def judge_one(status='AC', **ks):
+        submission = utils.submission.create_submission(
+            user=context['student'],
+            problem=problem,
+            status=-1,
+            **ks,
+        )
+        judge(submission, status)
+        return submission
+
+    with app.app_context():
+        yield judge_one
+
+
+def cell_of(data, context):
+    row = next(r for r in data
+               if r['user']['username'] == context['student'].username)
+    return row.get(str(context['problem'].id))
+
+
+def test_judged_submission_update_cells(monkeypatch, context, judged):
+    course = context['course']
+    pids = [context['problem'].id]
+    judged('WA')
+    assert cell_of(course.get_scoreboard(pids), context)['max'] == 0
+    board = Scoreboard(course)
+    version = board.version()
+    # cells are updated, not rebuilt
+    monkeypatch.setattr(
+        Scoreboard,
+        'aggregate',
+        lambda *a, **ks: pytest.fail('should not aggregate'),
+    )
+    judged('AC')
+    assert board.version() == version + 1
+    cell = cell_of(course.get_scoreboard(pids), context)
+    assert cell == {
+        'pid': pids[0],
+        'count': 2,
+        'max': 100,
+        'min': 0,
+        'avg': 50.0,
+    }
+
+
+def test_submission_judged_while_building(monkeypatch, context, judged):
+    course = context['course']
+    pids = [context['problem'].id]
+    judged('WA')
+    aggregate = Scoreboard.aggregate
+    calls = []
+
+    def racing_aggregate(*args, **ks):
+        cells = aggregate(*args, **ks)
+        calls.append(args)
+        # judged after the aggregate is read
+        if len(calls) == 1:
+            judged('AC')
+        return cells
+
+    monkeypatch.setattr(Scoreboard, 'aggregate', racing_aggregate)
+    cell = cell_of(course.get_scoreboard(pids), context)
+    assert len(calls) == 2
+    assert cell['count'] == 2
+    assert cell['max'] == 100
+    assert RedisCache().client.sismember(Scoreboard.BUILT_KEY, pids[0])
+
+
+def test_rejudge_rebuild_cells(context, judged):
+    course = context['course']
+    pids = [context['problem'].id]
+    submission = judged('AC')
+    assert cell_of(course.get_scoreboard(pids), context)['count'] == 1
+    submission.rejudge()
+    # not judged yet
+    assert cell_of(course.get_scoreboard(pids), context) is None
+    judge(submission, 'WA')
+    assert cell_of(course.get_scoreboard(pids), context)['count'] == 1
+
+
+def test_read_snapshot_by_version(context, judged):
+    board = Scoreboard(context['course'])
+    pids = [context['problem'].id]
+    version, data = board.get(pids)
+    judged('AC')
+    new_version, new_data = board.get(pids)
+    assert new_version > version
+    assert board.get(pids, version=version) == (version, data)
+    assert cell_of(new_data, context)['count'] == 1
+    with pytest.raises(engine.DoesNotExist):
+        board.get(pids, version=new_version + 1)
+
+
+def test_windowed_scoreboard_rebuilt_in_background(context, judged):
+    board = Scoreboard(context['course'])
+    pids = [context['problem'].id]
+    window = (1, 2**31)
+    version, data = board.get(pids, *window)
+    assert cell_of(data, context) is None
+    judged('AC')
+    # the outdated one is served at once
+    assert board.get(pids, *window) == (version, data)
+    board.worker.join()
+    new_version, data = board.get(pids, *window)
+    assert new_version > version
+    assert cell_of(data, context)['count'] == 1
+
+
+def test_scoreboard_api_version(context, forge_client, judged):
+    course = context['course']
+    client = forge_client(course.teacher.username)
+    url = f'/course/{course.course_name}/scoreboard?pids={context["problem"].id}'
+    rv = client.get(url)
+    assert rv.status_code == 200, rv.get_json()
+    version = rv.headers['X-Scoreboard-Version']
+    judged('AC')
+    rv = client.get(f'{url}&version={version}')
+    assert rv.status_code == 200, rv.get_json()
+    assert cell_of(rv.get_json()['data'], context) is None
+    rv = client.get(f'{url}&version=100')
+    assert rv.status_code == 404, rv.get_json()
+    rv = client.get(f'{url}&version=a')
+    assert rv.status_code == 400, rv.get_json()
@@ -0,0 +1,99 @@
+import pytest
+from bson import ObjectId
+from mongo import *
+from mongo.loader import ref_id
+from tests import utils
+from tests.utils.db import count_queries
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def student(app):
+    with app.app_context():
+        yield utils.user.create_user()
+
+
+def get_me(client):
+    return client.get('/auth/me', query_string={'fields': 'username,role'})
+
+
+def test_session_is_cached(student):
+    token = student.secret
+    session = User.session(token)
+    assert session['username'] == student.username
+    assert session['role'] == student.role
+    with count_queries() as counter:
+        assert User.session(token) == session
+        user = User.from_session(session)
+        assert user.username == student.username
+        assert user.role == User.engine.Role.STUDENT
+        assert user
+    assert len(counter) == 0, counter
+    # other fields are loaded on access
+    assert user.email == student.email
+
+
+def test_invalid_token():
+    assert User.session('not-a-token') is None
+
+
+def test_changed_password_expires_sessions(student, forge_client):
+    client = forge_client(student.username)
+    assert get_me(client).status_code == 200
+    student.change_password('new-password')
+    rv = get_me(client)
+    assert rv.status_code == 403
+    assert rv.get_json()['message'] == 'Authorization Expired'
+
+
+def test_role_change_is_seen_at_once(student):
+    token = student.secret
+    assert User.session(token)['role'] == User.engine.Role.STUDENT
+    student.update(role=User.engine.Role.TEACHER)
+    assert User.session(token)['role'] == User.engine.Role.TEACHER
+
+
+def test_deactivated_user(student, forge_client):
+    client = forge_client(student.username)
+    assert get_me(client).status_code == 200
+    student.obj.active = False
+    student.obj.save()
+    rv = get_me(client)
+    assert rv.status_code == 403
+    assert rv.get_json()['message'] == 'Inactive User'
+
+
+def test_contest_is_read_from_session(student):
+    token = student.secret
+    user = User.from_session(User.session(token))
+    with count_queries() as counter:
+        assert ref_id(user, 'contest') is None
+    assert len(counter) == 0, counter
+    contest = ObjectId()
+    student.update(contest=contest)
+    user = User.from_session(User.session(token))
+    with count_queries() as counter:
+        assert ref_id(user, 'contest') == contest
+    assert len(counter) == 0, counter
+
+
+def test_problem_list_does_not_load_user(student, forge_client):
+    course = utils.course.create_course(students=[student])
+    for _ in range(3):
+        utils.problem.create_problem(course=course)
+    client = forge_client(student.username)
+    query = {'offset': 0, 'count': -1}
+    rv = client.get('/problem', query_string=query)
+    assert len(rv.get_json()['data']) == 3
+    with count_queries() as counter:
+        rv = client.get('/problem', query_string=query)
+    assert rv.status_code == 200, rv.get_json()
+    # the session and course roles are cached (used to be 5)
+    assert len(counter) == 1, counter
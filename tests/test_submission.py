@@ -477,7 +477,7 @@ class TestCreateSubmission(SubmissionTester):
         forge_client,
     ):
         # get submission length
-        before_len = len(User('student').submissions)
+        before_len = engine.Submission.objects(user='student').count()
         # create a submission
         client = forge_client('student')
         rv, rv_json, rv_data = BaseTester.request(
@@ -494,7 +494,10 @@ class TestCreateSubmission(SubmissionTester):
 
         assert user
         assert rv.status_code == 200
-        assert len(user.submissions) == before_len + 1
+        # submissions are not embedded in the user
+        assert 'submissions' not in user.to_mongo()
+        assert engine.Submission.objects(
+            user='student').count() == before_len + 1
 
     def test_wrong_language_type(
         self,
@@ -1052,5 +1055,6 @@ class TestSubmissionConfig(SubmissionTester):
                 'name': 'Test',
                 'url': 'http://sandbox:6666',
                 'token': 'AAAAA',
+                'capacity': 1,
             }]
         }
@@ -0,0 +1,88 @@
+import pytest
+from mongo import *
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def context(app):
+    with app.app_context():
+        student = utils.user.create_user()
+        course = utils.course.create_course(students=[student])
+        problem = utils.problem.create_problem(course=course)
+        # some of them share the same timestamp
+        submissions = [
+            utils.submission.create_submission(
+                user=student,
+                problem=problem,
+                timestamp=1600000000 + i // 2,
+            ) for i in range(7)
+        ]
+        yield {
+            'student': student,
+            'submissions': submissions,
+        }
+
+
+def get_list(client, **args):
+    rv = client.get('/submission', query_string=args)
+    assert rv.status_code == 200, rv.get_json()
+    return rv.get_json()['data']
+
+
+def test_cursor_walks_through_all_submissions(context, forge_client):
+    client = forge_client(context['student'].username)
+    expected = [
+        s['submissionId']
+        for s in get_list(client, offset=0, count=-1)['submissions']
+    ]
+    assert len(expected) == 7
+    got = []
+    data = get_list(client, count=3)
+    while True:
+        got += [s['submissionId'] for s in data['submissions']]
+        if data['nextCursor'] is None:
+            break
+        data = get_list(
+            client,
+            count=3,
+            cursor=data['nextCursor'],
+            withCount='false',
+        )
+        assert data['submissionCount'] is None
+    assert got == expected
+
+
+def test_cursor_matches_offset(context):
+    user = context['student']
+    page, total = Submission.filter(user, count=2, with_count=True)
+    assert total == 7
+    cursor = Submission.encode_cursor(page[-1].timestamp, page[-1].id)
+    after_cursor = Submission.filter(user, count=3, cursor=cursor)
+    by_offset = Submission.filter(user, offset=2, count=3)
+    assert [s.id for s in after_cursor] == [s.id for s in by_offset]
+
+
+@pytest.mark.parametrize('cursor', ['', 'not-a-cursor', 'WzEsIDJd'])
+def test_invalid_cursor(context, forge_client, cursor):
+    client = forge_client(context['student'].username)
+    rv = client.get('/submission', query_string={'cursor': cursor})
+    assert rv.status_code == 400, rv.get_json()
+
+
+def test_cursor_with_sort_by(context):
+    submission = context['submissions'][0]
+    cursor = Submission.encode_cursor(submission.timestamp, submission.id)
+    with pytest.raises(ValueError):
+        Submission.filter(
+            context['student'],
+            cursor=cursor,
+            sort_by='runTime',
+        )
@@ -0,0 +1,174 @@
+'''
+hot queries on `submission` and the indexes serving them
+
+`explain()` is not supported by mongomock, those tests only run against
+a real mongo server (set `MONGO_HOST`), the others check declared index
+keys against the query shapes.
+'''
+import pytest
+import random
+from datetime import datetime, timedelta
+from mongo import engine
+from tests import utils
+
+USERS = [f'user{i}' for i in range(20)]
+PROBLEMS = [*range(1, 11)]
+START = datetime(2021, 1, 1)
+END = START + timedelta(days=7)
+TIME = [('timestamp', -1), ('_id', -1)]
+
+# name: (filter, sort)
+QUERIES = {
+    # `Problem.get_submission_status`, `get_tried_user_count`
+    'problem': ({
+        'problem': 1
+    }, None),
+    # `Problem.get_ac_user_count`
+    'problem_status': ({
+        'problem': 1,
+        'status': 0
+    }, None),
+    # `Problem.get_high_score`
+    'high_score': ({
+        'user': 'user1',
+        'problem': 1
+    }, [('score', -1)]),
+    # `Scoreboard.aggregate`
+    'scoreboard': ({
+        'problem': {
+            '$in': [1, 2, 3]
+        },
+        'status': {
+            '$ne': -1
+        },
+        'user': {
+            '$in': USERS[:5]
+        },
+        'timestamp': {
+            '$gte': START,
+            '$lte': END
+        },
+    }, None),
+    # `problem_stats`
+    'stats_run_time': ({
+        'problem': 1,
+        'status': 0
+    }, [('runTime', 1)]),
+    'stats_memory_usage': ({
+        'problem': 1,
+        'status': 0
+    }, [('memoryUsage', 1)]),
+    # handwritten cleanup in `Submission.submit`
+    'handwritten': ({
+        'problem': 1,
+        'user': 'user1',
+        'languageType': 3
+    }, None),
+    # `Submission.rejudge_many`
+    'rejudge': ({
+        'problem': 1,
+        'status': {
+            '$ne': -2
+        },
+        'languageType': {
+            '$ne': 3
+        },
+    }, None),
+    # `Submission.filter`
+    'list': ({}, TIME),
+    'list_of_user': ({
+        'user': 'user1',
+        'status': 0
+    }, TIME),
+    'list_of_problems': ({
+        'problem': {
+            '$in': [1, 2, 3]
+        }
+    }, TIME),
+    'list_of_problem_and_user': ({
+        'problem': 1,
+        'user': 'user1'
+    }, TIME),
+}
+
+
+def index_keys():
+    engine.Submission.ensure_indexes()
+    indexes = engine.Submission._get_collection().index_information()
+    return [info['key'] for name, info in indexes.items() if name != '_id_']
+
+
+def can_serve(key, query, sort) -> bool:
+    '''
+    whether an index can find the documents and return them in order
+    '''
+    fields = [k for k, _ in key]
+    if sort is None:
+        return fields[0] in query
+    # fields filtered before sorting keys, then the sorting keys
+    i = 0
+    while i < len(fields) and fields[i] in query:
+        i += 1
+    rest = key[i:i + len(sort)]
+    return rest in (sort, [(k, -d) for k, d in sort])
+
+
+@pytest.mark.parametrize('name', QUERIES)
+def test_query_has_index(name):
+    query, sort = QUERIES[name]
+    assert any(can_serve(key, query, sort) for key in index_keys()), name
+
+
+def test_no_index_starts_with_id():
+    assert all(key[0][0] != '_id' for key in index_keys())
+
+
+def plan_stages(plan):
+    yield plan['stage']
+    for k in ('inputStage', 'outerStage', 'innerStage'):
+        if k in plan:
+            yield from plan_stages(plan[k])
+    for child in plan.get('inputStages', []):
+        yield from plan_stages(child)
+
+
+def random_submission(rand):
+    minutes = rand.randint(0, 20000)
+    return {
+        'problem': rand.choice(PROBLEMS),
+        'user': rand.choice(USERS),
+        'languageType': rand.randint(0, 3),
+        'timestamp': START + timedelta(minutes=minutes),
+        'status': rand.randint(-1, 7),
+        'score': rand.randint(0, 100),
+        'runTime': rand.randint(0, 1000),
+        'memoryUsage': rand.randint(0, 1000),
+    }
+
+
+@pytest.fixture(scope='module')
+def seeded():
+    if engine.MONGO_HOST.startswith('mongomock'):
+        pytest.skip('explain() needs a real mongo server')
+    utils.drop_db(host=engine.MONGO_HOST)
+    engine.Submission.ensure_indexes()
+    rand = random.Random(0)
+    engine.Submission._get_collection().insert_many(
+        [random_submission(rand) for _ in range(5000)])
+    yield
+    utils.drop_db(host=engine.MONGO_HOST)
+
+
+@pytest.mark.parametrize('name', QUERIES)
+def test_query_uses_index(seeded, name):
+    query, sort = QUERIES[name]
+    cursor = engine.Submission._get_collection().find(query)
+    if sort is not None:
+        cursor = cursor.sort(sort)
+    plan = cursor.explain()['queryPlanner']['winningPlan']
+    stages = [*plan_stages(plan)]
+    assert 'IXSCAN' in stages, stages
+    assert 'COLLSCAN' not in stages, stages
+    # sorted by the index
+    if sort is not None:
+        assert 'SORT' not in stages, stages
@@ -0,0 +1,100 @@
+import pytest
+from mongo import *
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def context(app):
+    with app.app_context():
+        students = [utils.user.create_user() for _ in range(2)]
+        course = utils.course.create_course(students=students)
+        problems = [
+            utils.problem.create_problem(course=course) for _ in range(2)
+        ]
+        submission = utils.submission.create_submission(
+            user=students[0],
+            problem=problems[0],
+            status=-1,
+        )
+        yield {
+            'students': students,
+            'course': course,
+            'problems': problems,
+            'submission': submission,
+        }
+
+
+def get_list(client, **args):
+    rv = client.get('/submission', query_string=args)
+    assert rv.status_code == 200, rv.get_json()
+    return rv
+
+
+def test_result_is_shown_at_once(context, forge_client):
+    client = forge_client(context['students'][0].username)
+    submission = context['submission']
+    rv = get_list(client)
+    assert rv.get_json()['data']['submissions'][0]['status'] == -1
+    submission.modify(status=0, score=100)
+    submission.finish_judging()
+    rv = get_list(client)
+    assert rv.get_json()['data']['submissions'][0]['status'] == 0
+
+
+def test_new_submission_is_listed_at_once(context, forge_client):
+    student = context['students'][0]
+    client = forge_client(student.username)
+    assert len(get_list(client).get_json()['data']['submissions']) == 1
+    Submission.add(context['problems'][1].problem_id, student.username, 0)
+    assert len(get_list(client).get_json()['data']['submissions']) == 2
+
+
+def test_unchanged_page(context, forge_client):
+    student = context['students'][0]
+    client = forge_client(student.username)
+    etag = get_list(client).headers['ETag']
+    rv = client.get('/submission', headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+    Submission.add(context['problems'][0].problem_id, student.username, 0)
+    rv = client.get('/submission', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert rv.headers['ETag'] != etag
+
+
+def test_version_of_unrelated_lists(context):
+    first, second = context['students']
+    problems = context['problems']
+
+    def versions():
+        return [
+            Submission.list_version(second, username=second.username),
+            Submission.list_version(second, problem_id=problems[1].problem_id),
+            Submission.list_version(second),
+        ]
+
+    before = versions()
+    Submission.add(problems[0].problem_id, first.username, 0)
+    after = versions()
+    # only the unfiltered list is changed
+    assert before[:2] == after[:2]
+    assert before[2] != after[2]
+
+
+def test_filter_is_normalized(context, forge_client):
+    problem = context['problems'][0]
+    client = forge_client(context['course'].teacher.username)
+    # the same filter written differently
+    problem_id = f'0{problem.problem_id}'
+    rv = get_list(client, problemId=problem_id)
+    assert len(rv.get_json()['data']['submissions']) == 1
+    Submission.add(problem.problem_id, context['students'][1].username, 0)
+    rv = get_list(client, problemId=problem_id)
+    assert len(rv.get_json()['data']['submissions']) == 2
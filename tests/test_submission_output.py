@@ -0,0 +1,296 @@
+import io
+import json
+import pytest
+from zipfile import ZipFile
+from mongo import *
+from mongo import engine
+from mongo.submission import OutputPacker
+from migrations import pack_submission_output
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def submission(app):
+    with app.app_context():
+        user = utils.user.create_user()
+        course = utils.course.create_course(students=[user])
+        problem = utils.problem.create_problem(
+            course=course,
+            tasks=[
+                {
+                    'task_score': 50,
+                    'case_count': 2
+                },
+                {
+                    'task_score': 50,
+                    'case_count': 1
+                },
+            ],
+        )
+        yield utils.submission.create_submission(
+            user=user,
+            problem=problem,
+            status=-1,
+        )
+
+
+def case_result(stdout, stderr=''):
+    return {
+        'exitCode': 0,
+        'status': 'AC',
+        'stdout': stdout,
+        'stderr': stderr,
+        'execTime': 10,
+        'memoryUsage': 10,
+    }
+
+
+def test_packer():
+    fp = io.BytesIO()
+    packer = OutputPacker(fp, 4)
+    assert packer.add('ab', 'c') == {'stdout': 'ab', 'stderr': 'c'}
+    assert packer.add('hello', 'world') == {
+        'output_offset': 0,
+        'stdout_size': 5,
+        'stderr_size': 5,
+    }
+    # binary output is always packed
+    assert packer.add(b'\xff', b'')['output_offset'] == 10
+    assert fp.getvalue() == b'helloworld\xff'
+
+
+def test_small_output_is_inline(submission):
+    submission.process_result([
+        [case_result('1'), case_result('2', 'warn')],
+        [case_result('3')],
+    ])
+    submission.reload()
+    assert submission.output_pack.grid_id is None
+    assert submission.get_single_output(0, 1) == {
+        'stdout': '2',
+        'stderr': 'warn',
+    }
+    assert submission.get_single_output(1, 0, text=False) == {
+        'stdout': b'3',
+        'stderr': b'',
+    }
+
+
+def test_large_output_is_packed(submission):
+    outputs = ['a' * 2000, 'b' * 10, 'c' * 3000]
+    submission.process_result([
+        [case_result(outputs[0], 'err'),
+         case_result(outputs[1])],
+        [case_result(outputs[2])],
+    ])
+    submission.reload()
+    # only one file for all cases
+    assert submission.output_pack.grid_id is not None
+    assert submission.get_single_output(0, 0) == {
+        'stdout': outputs[0],
+        'stderr': 'err',
+    }
+    assert submission.get_single_output(1, 0)['stdout'] == outputs[2]
+    detail = submission.get_detailed_result()
+    assert [c['stdout'] for t in detail for c in t['cases']] == outputs
+    # output won't be exposed without permission
+    for task in submission.get_result():
+        for case in task['cases']:
+            assert {'stdout', 'outputOffset'} & {*case} == set()
+
+
+def test_rejudge_drop_old_pack(app, submission):
+    submission.process_result([
+        [case_result('a' * 2000), case_result('b')],
+        [case_result('c')],
+    ])
+    old = submission.reload().output_pack.grid_id
+    with app.app_context():
+        submission.rejudge()
+    submission.process_result([
+        [case_result('d' * 2000), case_result('e')],
+        [case_result('f')],
+    ])
+    submission.reload()
+    assert submission.output_pack.grid_id != old
+    db = engine.Submission._get_db()
+    assert db['fs.files'].count_documents({'_id': old}) == 0
+    assert submission.get_single_output(0, 0)['stdout'] == 'd' * 2000
+
+
+def test_detail_after_rejudge(app, submission):
+    submission.process_result([
+        [case_result('a' * 2000), case_result('b')],
+        [case_result('c')],
+    ])
+    with app.app_context():
+        submission.reload().rejudge()
+    # the pack is deleted, the result isn't back yet
+    submission = Submission(submission.id)
+    assert submission.output_pack.grid_id is None
+    assert submission.get_detailed_result() == []
+
+
+def add_legacy_output(submission, outputs):
+    '''
+    store outputs as per-case zips, returns their grid ids
+    '''
+    cases = []
+    for output in outputs:
+        fp = io.BytesIO()
+        with ZipFile(fp, 'w') as zf:
+            zf.writestr('stdout', output)
+            zf.writestr('stderr', '')
+        fp.seek(0)
+        cases.append(
+            engine.CaseResult(
+                status=0,
+                exec_time=1,
+                memory_usage=1,
+                output=fp,
+            ))
+    submission.update(tasks=[
+        engine.TaskResult(status=0, cases=cases[:2]),
+        engine.TaskResult(status=0, cases=cases[2:]),
+    ])
+    submission.reload()
+    return [c.output.grid_id for t in submission.tasks for c in t.cases]
+
+
+def test_migrate_legacy_output(submission):
+    outputs = ['x' * 2000, 'y', 'z']
+    legacy = add_legacy_output(submission, outputs)
+    # old format is still readable
+    assert submission.get_single_output(0, 1)['stdout'] == 'y'
+    assert pack_submission_output.migrate() == 1
+    assert pack_submission_output.migrate() == 0
+    submission.reload()
+    db = engine.Submission._get_db()
+    assert db['fs.files'].count_documents({'_id': {'$in': legacy}}) == 0
+    for task in submission.tasks:
+        for case in task.cases:
+            assert case.output.grid_id is None
+    detail = submission.get_detailed_result()
+    assert [c['stdout'] for t in detail for c in t['cases']] == outputs
+
+
+def test_rerun_interrupted_migration(submission):
+    outputs = ['x' * 2000, 'y', 'z']
+    add_legacy_output(submission, outputs)
+    # the pack was saved but cases weren't updated
+    submission.output_pack.put(b'partial')
+    submission.save_output_pack()
+    stale = submission.output_pack.grid_id
+    assert pack_submission_output.migrate() == 1
+    submission.reload()
+    assert submission.output_pack.grid_id != stale
+    db = engine.Submission._get_db()
+    assert db['fs.files'].count_documents({'_id': stale}) == 0
+    detail = submission.get_detailed_result()
+    assert [c['stdout'] for t in detail for c in t['cases']] == outputs
+
+
+def test_packer_stream_file():
+    fp = io.BytesIO()
+    packer = OutputPacker(fp, 4, cap=10)
+    packer.CHUNK_SIZE = 3
+    assert packer.add(io.BytesIO(b'x' * 100), None) == {
+        'output_offset': 0,
+        'stdout_size': 10,
+        'stderr_size': 0,
+    }
+    assert fp.getvalue() == b'x' * 10
+
+
+def test_output_is_truncated(monkeypatch, submission):
+    monkeypatch.setattr(Submission, 'OUTPUT_CAP', 1500)
+    submission.process_result([
+        [case_result('a' * 2000), case_result('b')],
+        [case_result('c')],
+    ])
+    submission.reload()
+    assert submission.get_single_output(0, 0)['stdout'] == 'a' * 1500
+    assert submission.tasks[0].cases[0].stdout_size == 1500
+
+
+def multipart(token, tasks, outputs):
+    data = {
+        'token': token,
+        'meta': json.dumps(tasks),
+    }
+    for key, output in outputs.items():
+        data[key] = (io.BytesIO(output), key)
+    return data
+
+
+def test_complete_by_multipart(client, submission):
+    token = Submission.assign_token(submission.id)
+    tasks = [[case_result(None) for _ in range(2)], [case_result(None)]]
+    for cases in tasks:
+        for case in cases:
+            del case['stdout'], case['stderr']
+    outputs = {
+        'stdout-0-0': b'a' * 5000,
+        'stderr-0-0': b'oops',
+        'stdout-1-0': b'c',
+    }
+    rv = client.put(
+        f'/submission/{submission.id}/complete',
+        data=multipart('wrong', tasks, outputs),
+        content_type='multipart/form-data',
+    )
+    assert rv.status_code == 403, rv.get_json()
+    rv = client.put(
+        f'/submission/{submission.id}/complete',
+        data=multipart(token, tasks, outputs),
+        content_type='multipart/form-data',
+    )
+    assert rv.status_code == 200, rv.get_json()
+    submission.reload()
+    assert submission.status == 0
+    assert submission.get_single_output(0, 0) == {
+        'stdout': 'a' * 5000,
+        'stderr': 'oops',
+    }
+    assert submission.get_single_output(0, 1) == {
+        'stdout': '',
+        'stderr': '',
+    }
+    assert submission.get_single_output(1, 0)['stdout'] == 'c'
+
+
+def test_complete_by_json_still_works(client, submission):
+    token = Submission.assign_token(submission.id)
+    rv = client.put(
+        f'/submission/{submission.id}/complete',
+        json={
+            'token': token,
+            'tasks': [
+                [case_result('1'), case_result('2')],
+                [case_result('3')],
+            ],
+        },
+    )
+    assert rv.status_code == 200, rv.get_json()
+    assert submission.reload().get_single_output(1, 0)['stdout'] == '3'
+
+
+def test_complete_with_invalid_meta(client, submission):
+    token = Submission.assign_token(submission.id)
+    rv = client.put(
+        f'/submission/{submission.id}/complete',
+        data={
+            'token': token,
+            'meta': '{',
+        },
+        content_type='multipart/form-data',
+    )
+    assert rv.status_code == 400, rv.get_json()
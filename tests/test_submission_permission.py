@@ -0,0 +1,74 @@
+import pytest
+from mongo import *
+from mongo import engine
+from tests import utils
+from tests.utils.db import count_queries
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def context(app):
+    with app.app_context():
+        student = utils.user.create_user()
+        ta = utils.user.create_user()
+        course = utils.course.create_course(students=[student])
+        course.tas.append(ta.obj)
+        course.save()
+        problem = utils.problem.create_problem(course=course)
+        submissions = [
+            utils.submission.create_submission(user=student, problem=problem)
+            for _ in range(3)
+        ]
+        yield {
+            'student': student,
+            'ta': ta,
+            'course': course,
+            'problem': problem,
+            'submissions': submissions,
+        }
+
+
+def test_permission(context):
+    submission = context['submissions'][0]
+    teacher = User(context['course'].teacher.username)
+    outsider = utils.user.create_user()
+    assert submission.permission(teacher) == 3
+    assert submission.permission(context['ta']) == 3
+    assert submission.permission(context['student']) == 2
+    assert submission.permission(outsider) == 0
+
+
+def test_permission_is_cached(context):
+    ta = context['ta']
+    submissions = context['submissions']
+    assert [s.permission(ta) for s in submissions] == [3, 3, 3]
+    with count_queries() as counter:
+        assert [s.permission(ta) for s in submissions] == [3, 3, 3]
+    assert len(counter) == 0, counter
+
+
+def test_removed_ta_loses_permission_at_once(context):
+    course = context['course']
+    ta = context['ta']
+    submission = context['submissions'][0]
+    assert submission.permission(ta) == 3
+    course.tas.remove(ta.obj)
+    course.save()
+    assert submission.permission(ta) == 0
+
+
+def test_problem_change_invalidates_permission(context):
+    problem = context['problem']
+    submission = context['submissions'][0]
+    outsider = utils.user.create_user()
+    assert submission.permission(outsider) == 0
+    problem.owner = outsider.username
+    problem.save()
+    assert submission.reload().permission(outsider) == 1
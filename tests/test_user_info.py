@@ -0,0 +1,56 @@
+import pytest
+from mongo import *
+from mongo import engine
+from mongo.loader import UserInfo
+from tests import utils
+from tests.utils.db import count_queries
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def users(app):
+    with app.app_context():
+        yield [utils.user.create_user() for _ in range(3)]
+
+
+def test_infos_are_cached(users):
+    usernames = [u.username for u in users]
+    infos = UserInfo.get_many(usernames)
+    assert infos == {u.username: u.info for u in users}
+    with count_queries() as counter:
+        assert UserInfo.get_many(usernames) == infos
+        assert UserInfo.get(usernames[0]) == infos[usernames[0]]
+    assert len(counter) == 0, counter
+
+
+def test_missing_user(users):
+    info = UserInfo.get('nobody')
+    assert info == engine.User(username='nobody').info
+    # it might sign up later
+    utils.user.create_user(username='nobody', displayed_name='Nobody')
+    assert UserInfo.get('nobody')['displayedName'] == 'Nobody'
+
+
+def test_profile_change_is_seen_at_once(users):
+    user = users[0]
+    UserInfo.get(user.username)
+    user.update(profile={'displayed_name': 'new name', 'bio': ''})
+    assert UserInfo.get(user.username)['displayedName'] == 'new name'
+    user.update(role=engine.User.Role.TEACHER)
+    assert UserInfo.get(user.username)['role'] == engine.User.Role.TEACHER
+
+
+def test_edit_profile_api(users, forge_client):
+    user = users[0]
+    UserInfo.get(user.username)
+    client = forge_client(user.username)
+    rv = client.post('/profile', json={'displayedName': 'new name'})
+    assert rv.status_code == 200, rv.get_json()
+    assert UserInfo.get(user.username)['displayedName'] == 'new name'
@@ -1,9 +1,11 @@
 from mongo import *
 from mongo import engine
+from mongo.utils import RedisCache
 from . import user
 from . import course
 from . import problem
 from . import submission
+from . import db
 
 import random
 import secrets
@@ -59,3 +61,4 @@ def drop_db(
 ):
     conn = connect(db, host=host)
     conn.drop_database(db)
+    RedisCache().client.flushdb()
@@ -0,0 +1,84 @@
+'''
+count round trips to mongo, it only works with mongomock
+'''
+import functools
+import contextlib
+from collections import Counter
+from mongomock.collection import Collection
+
+__all__ = (
+    'QueryCounter',
+    'count_queries',
+)
+
+# index management is excluded
+OPERATIONS = (
+    'aggregate',
+    'bulk_write',
+    'count',
+    'count_documents',
+    'delete_many',
+    'delete_one',
+    'distinct',
+    'find',
+    'find_one',
+    'find_one_and_delete',
+    'find_one_and_replace',
+    'find_one_and_update',
+    'insert_many',
+    'insert_one',
+    'replace_one',
+    'update_many',
+    'update_one',
+)
+
+
+class QueryCounter:
+    def __init__(self):
+        # (collection name, operation)
+        self.queries = []
+        self.depth = 0
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __repr__(self):
+        return f'QueryCounter({self.queries})'
+
+    def by_collection(self) -> Counter:
+        return Counter(name for name, _ in self.queries)
+
+
+@contextlib.contextmanager
+def count_queries():
+    '''
+    count operations sent to mongo in this context
+
+        with count_queries() as counter:
+            User('alice')
+        assert len(counter) == 1
+    '''
+    counter = QueryCounter()
+
+    def wrap(op, func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **ks):
+            # mongomock implements some operations by others
+            if counter.depth == 0:
+                counter.queries.append((self.name, op))
+            counter.depth += 1
+            try:
+                return func(self, *args, **ks)
+            finally:
+                counter.depth -= 1
+
+        return wrapper
+
+    originals = {op: getattr(Collection, op) for op in OPERATIONS}
+    for op, func in originals.items():
+        setattr(Collection, op, wrap(op, func))
+    try:
+        yield counter
+    finally:
+        for op, func in originals.items():
+            setattr(Collection, op, func)
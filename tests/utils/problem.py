@@ -1,6 +1,7 @@
 import secrets
 from typing import Optional, Union, List, Dict, Any
 from mongo import *
+from mongo import engine
 from . import course as course_lib
 
 __all__ = ('create_problem', )
@@ -18,7 +19,12 @@ def create_problem(
     allowed_language: Optional[int] = None,
     quota: Optional[int] = None,
     default_code: Optional[str] = None,
+    tasks: Optional[List[Dict[str, int]]] = None,
 ) -> Problem:
+    '''
+    create a problem, `tasks` are set as its test case tasks, each of
+    them is like `{'task_score': 100, 'case_count': 1}`
+    '''
     if not isinstance(course, Course):
         course = course_lib.create_course(name=course)
     if owner is None:
@@ -47,4 +53,14 @@ def create_problem(
         'default_code': default_code,
     }
     pid = Problem.add(**params)
-    return Problem(pid)
+    problem = Problem(pid)
+    if tasks is not None:
+        problem.update(test_case__tasks=[
+            engine.ProblemCase(
+                memory_limit=65536,
+                time_limit=1000,
+                **task,
+            ) for task in tasks
+        ])
+        problem.reload()
+    return problem